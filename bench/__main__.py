@@ -0,0 +1,86 @@
+"""
+The benchmark suite: runs the selected benchmarks (all by default), each in its own process,
+and writes their results with the run environment to one JSON file, see `bench.compare`.
+
+    python -m bench --output bench.json
+    python -m bench api wait --quick --output bench-quick.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+# benchmark -> arguments of the quick (smoke) run, a full run uses the benchmark defaults
+SUITE = {
+    "api": ["--jobs", "100", "--polls", "50", "--output-bytes", "1000", "1000000"],
+    "server": ["--requests", "100", "--idle", "0"],
+    "limits": ["--hogs", "4", "--seconds", "1", "--mode", "asyncio"],
+    "batch": ["--jobs", "200"],
+    "wait": ["--jobs", "20"],
+    "pipeline": ["--stages", "20", "--rtt", "0", "--mode", "asyncio"],
+    "grep": ["--jobs", "4", "--lines", "50000", "--mode", "asyncio"],
+    "listing": ["--jobs", "100", "--polls", "50"],
+    "shards": ["--jobs", "100", "--polls", "20", "--mode", "asyncio"],
+    "restart": ["--jobs", "10", "--mode", "asyncio"],
+    "jobs": ["--counts", "10", "100", "--sleep", "1"],
+    "manager": ["--history", "0", "10000", "--runs", "50"],
+    "kill": ["--counts", "100"],
+    "sampler": ["--jobs", "100", "--samples", "3", "--intervals", "1"],
+    "streams": ["--jobs", "20"],
+    "pool": ["--tasks", "50"],
+    "spawn": ["--rss-mb", "100", "--spawns", "50"],
+}
+
+
+def git_commit():
+    try:
+        proc = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=False)
+    except OSError:
+        return None
+    return proc.stdout.strip() if proc.returncode == 0 else None
+
+
+def run(name, args):
+    print(f"bench.{name} {' '.join(args)}", file=sys.stderr)
+    ts = time.monotonic()
+    command = [sys.executable, "-m", f"bench.{name}", *args]
+    proc = subprocess.run(command, stdout=subprocess.PIPE, text=True, check=False)  # a failure is reported below
+    elapsed = time.monotonic() - ts
+    if proc.returncode != 0:
+        print(f"bench.{name} failed, exit code {proc.returncode}", file=sys.stderr)
+        return {"bench": name, "args": args, "error": proc.returncode, "elapsed_s": round(elapsed, 1)}
+    return {**json.loads(proc.stdout), "args": args, "elapsed_s": round(elapsed, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m bench")
+    parser.add_argument("names", nargs="*", metavar="name", help=f"benchmarks to run: {', '.join(SUITE)}")
+    parser.add_argument("--quick", action="store_true", help="smaller runs, to check that the benchmarks work")
+    parser.add_argument("--output", default="-", help="results file, `-` is stdout")
+    args = parser.parse_args()
+    unknown = set(args.names) - set(SUITE)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    runs = [run(name, SUITE[name] if args.quick else []) for name in args.names or SUITE]
+    report = {
+        "ts": int(time.time()),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "quick": args.quick,
+        "runs": runs,
+    }
+    with open(sys.stdout.fileno() if args.output == "-" else args.output, "w", closefd=args.output != "-") as f:
+        json.dump(report, f, indent=1)
+        f.write("\n")
+    sys.exit(1 if any("error" in r for r in runs) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+HTTP API of a running `jobaman.main`, end to end:
+`/jobs/run` throughput and latency with N concurrent clients, server threads and RSS with N running jobs,
+`/jobs/` latency with N jobs, `/jobs/output` latency against the output size,
+and the shutdown (SIGINT) time with N running jobs.
+
+    python -m bench.api --jobs 100 1000 --clients 8 --output-bytes 1000 100000 1000000 --mode threads asyncio
+"""
+
+import argparse
+import http.client
+import json
+import resource
+import signal
+import threading
+import time
+import urllib.parse
+
+from bench.common import emit, jobaman_server, percentiles, rss_kb
+from bench.kill import alive_in_groups
+
+
+def threads_of(pid):
+    with open(f"/proc/{pid}/status", "r") as f:
+        for line in f:
+            if line.startswith("Threads:"):
+                return int(line.split()[1])
+    return 0
+
+
+def requests(base_url, paths, latencies):
+    """GET every path over one keep-alive connection, the decoded responses"""
+    url = urllib.parse.urlparse(base_url)
+    conn, responses = None, []
+    for path in paths:
+        ts = time.monotonic()
+        if conn is None:
+            conn = http.client.HTTPConnection(url.hostname, url.port, timeout=60)
+        conn.request("GET", path)
+        rsp = conn.getresponse()
+        responses.append(json.loads(rsp.read()))
+        latencies.append((time.monotonic() - ts) * 1000)
+        if rsp.will_close:
+            conn.close()
+            conn = None
+    if conn is not None:
+        conn.close()
+    return responses
+
+
+def concurrently(base_url, paths, clients):
+    """`paths` split between `clients` threads: (latencies, elapsed seconds, responses)"""
+    latencies, responses = [], []
+    threads = [
+        threading.Thread(target=lambda chunk: responses.extend(requests(base_url, chunk, latencies)), args=(chunk,))
+        for chunk in (paths[i::clients] for i in range(clients))
+    ]
+    ts = time.monotonic()
+    _ = list(map(lambda t: t.start(), threads))
+    _ = list(map(lambda t: t.join(), threads))
+    return latencies, time.monotonic() - ts, responses
+
+
+def rounded(values, digits=2):
+    return {key: value and round(value, digits) for key, value in values.items()}
+
+
+def run_jobs(mode, jobs, clients, polls):
+    with jobaman_server(server_mode=mode, server_workers=clients, max_jobs=jobs) as (base_url, server):
+        threads_idle, rss_idle = threads_of(server.pid), rss_kb(server.pid)
+        paths = [f"/jobs/run?_0=sleep&_1=600&__job_id=job-{i}" for i in range(jobs)]
+        run_latencies, elapsed, responses = concurrently(base_url, paths, clients)
+        assert all(rsp.get("state") == "running" for rsp in responses), "not all jobs are running"
+        time.sleep(1)
+        threads_running, rss_running = threads_of(server.pid), rss_kb(server.pid)
+        list_latencies, _, _ = concurrently(base_url, ["/jobs/?__limit=1000"] * polls, clients)
+        pids = {job["pid"] for job in requests(base_url, ["/jobs/?__limit=1000"], [])[0]["jobs"].values()}
+        ts = time.monotonic()
+        server.send_signal(signal.SIGINT)
+        server.wait(timeout=60)
+        shutdown = time.monotonic() - ts
+    return {
+        "mode": mode,
+        "jobs": jobs,
+        "clients": clients,
+        "run_per_s": round(jobs / elapsed, 1),
+        "run_latency_ms": rounded(percentiles(run_latencies)),
+        "threads_idle": threads_idle,
+        "threads_running": threads_running,
+        "rss_idle_kb": rss_idle,
+        "rss_running_kb": rss_running,
+        "list_latency_ms": rounded(percentiles(list_latencies)),
+        "shutdown_s": round(shutdown, 3),
+        "left_alive": alive_in_groups(pids),
+    }
+
+
+def run_output(mode, output_bytes, clients, polls):
+    with jobaman_server(server_mode=mode, server_workers=clients, stream_max_bytes=2 * output_bytes) as (base_url, _):
+        command = f"head -c {output_bytes} /dev/zero | tr '\\0' x | fold -w 99"
+        requests(base_url, [f"/jobs/run?_0=sh&_1=-c&_2={urllib.parse.quote(command)}&__job_id=output"], [])
+        if not requests(base_url, ["/jobs/wait?__job_id=output&timeout=60"], [])[0]["done"]:
+            raise RuntimeError("output job did not finish")
+        latencies, _, responses = concurrently(base_url, ["/jobs/output?__job_id=output"] * polls, clients)
+    return {
+        "mode": mode,
+        "output_bytes": output_bytes,
+        "clients": clients,
+        "read_bytes": len(responses[-1]["stdout"]),
+        "output_latency_ms": rounded(percentiles(latencies)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--polls", type=int, default=200)
+    parser.add_argument("--output-bytes", type=int, nargs="+", default=[1000, 100_000, 1_000_000])
+    parser.add_argument("--mode", nargs="+", default=["threads", "asyncio"])
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    results = [run_jobs(mode, jobs, args.clients, args.polls) for mode in args.mode for jobs in args.jobs]
+    results += [run_output(mode, size, args.clients, args.polls) for mode in args.mode for size in args.output_bytes]
+    emit("api", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Submission of N jobs over HTTP: one `GET /jobs/run` per job against one `POST /jobs/run-batch`.
+Jobs run `true`, so the numbers are the request plus spawn cost.
+
+    python -m bench.batch --jobs 1000 --mode threads asyncio
+"""
+
+import argparse
+import http.client
+import json
+import time
+import urllib.parse
+
+from bench.common import emit, jobaman_server
+
+
+def submit_single(conn, count):
+    for _ in range(count):
+        conn.request("GET", "/jobs/run?_1=true")
+        rsp = conn.getresponse()
+        rsp.read()
+        if rsp.will_close:
+            conn.close()
+
+
+def submit_batch(conn, count):
+    conn.request("POST", "/jobs/run-batch", body=json.dumps([{"command": ["true"]}] * count))
+    rsp = conn.getresponse()
+    assert len(json.loads(rsp.read())["job_ids"]) == count
+
+
+def run(mode, submit, count):
+    with jobaman_server(server_mode=mode, max_jobs=count) as (base_url, _):
+        url = urllib.parse.urlparse(base_url)
+        conn = http.client.HTTPConnection(url.hostname, url.port, timeout=30)
+        ts = time.monotonic()
+        submit(conn, count)
+        submitted = time.monotonic() - ts
+        conn.close()
+    return {
+        "mode": mode,
+        "submit": submit.__name__.removeprefix("submit_"),
+        "jobs": count,
+        "submit_s": round(submitted, 3),
+        "jobs_per_s": round(count / submitted),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=1000)
+    parser.add_argument("--mode", nargs="+", default=["threads", "asyncio"])
+    args = parser.parse_args()
+    emit("batch", [run(mode, submit, args.jobs) for mode in args.mode for submit in (submit_single, submit_batch)])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import contextlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+
+def rss_kb(pid="self"):
+    with open(f"/proc/{pid}/status", "r") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def threads_count():
+    return threading.active_count()
+
+
+def percentiles(values, points=(50, 90, 99)):
+    if not values:
+        return {f"p{p}": None for p in points}
+    values = sorted(values)
+    last = len(values) - 1
+    return {f"p{p}": values[min(last, round(last * p / 100))] for p in points}
+
+
+def wait_for(predicate, timeout=60, step=0.01):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(step)
+    return True
+
+
+def emit(name, results):
+    json.dump({"bench": name, "ts": int(time.time()), "pid": os.getpid(), "results": results}, sys.stdout, indent=1)
+    sys.stdout.write("\n")
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextlib.contextmanager
+def jobaman_server(**options):
+    """run `python -m jobaman.main` with the given ini options on a free local port, yield its base url"""
+    port = options.pop("server_listen_port", None) or free_port()
+    ini = {
+        "log-level": "ERROR",
+        "max-jobs": 1000,
+        "entrypoint": "",
+        "server-listen-host": "127.0.0.1",
+        "server-listen-port": port,
+        **{key.replace("_", "-"): value for key, value in options.items()},
+    }
+    with tempfile.NamedTemporaryFile("w", suffix=".ini") as f:
+        f.write("[DEFAULT]\n" + "".join(f"{key} = {value}\n" for key, value in ini.items()))
+        f.flush()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "jobaman.main", "--ini-path", f.name, "--no-env-use"],
+            stdout=subprocess.DEVNULL,
+        )
+        try:
+            base_url = f"http://127.0.0.1:{port}"
+            if not wait_for(lambda: http_get(base_url + "/ping", timeout=1) is not None, timeout=10, step=0.05):
+                raise RuntimeError(f"server {base_url} did not start")
+            yield base_url, server
+        finally:
+            server.terminate()
+            server.wait(timeout=10)
+
+
+def http_get(url, timeout=10):
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as rsp:
+            return json.loads(rsp.read())
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,78 @@
+"""
+Compare two result files of `python -m bench`: every measurement of the benchmarks run with the same arguments,
+results matched by position; exits with 1 if any measurement got worse by more than the threshold.
+Throughputs (`*_per_s`, `rps`) are better higher, everything else (latencies, times, RSS, threads) lower.
+
+    python -m bench.compare bench-old.json bench-new.json --threshold 0.2
+"""
+
+import argparse
+import json
+import sys
+
+HIGHER_IS_BETTER = ("_per_s", "rps")
+IGNORED = ("pid", "ts", "elapsed_s")
+
+
+def load(path):
+    with open(path, "r") as f:
+        return {(run["bench"], tuple(run["args"])): run for run in json.load(f)["runs"] if "error" not in run}
+
+
+def flatten(result, prefix=""):
+    """numeric measurements of one result as `{"key.subkey": value}`"""
+    values = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and key not in IGNORED:
+            values[prefix + key] = value
+    return values
+
+
+def label(result):
+    return ",".join(f"{key}={value}" for key, value in result.items() if isinstance(value, str))
+
+
+def compare(old, new, threshold):
+    """(rows of `bench, result label, key, old, new, change`, regressions count)"""
+    rows, regressions = [], 0
+    for key, new_run in new.items():
+        old_run = old.get(key)
+        if old_run is None:
+            continue
+        for old_result, new_result in zip(old_run["results"], new_run["results"], strict=False):
+            old_values, new_values = flatten(old_result), flatten(new_result)
+            for name, new_value in new_values.items():
+                old_value = old_values.get(name)
+                if not old_value or old_value == new_value:
+                    continue
+                change = (new_value - old_value) / abs(old_value)
+                worse = -change if name.endswith(HIGHER_IS_BETTER) else change
+                flag = ""
+                if worse > threshold:
+                    flag, regressions = "worse", regressions + 1
+                elif worse < -threshold:
+                    flag = "better"
+                rows.append((key[0], label(new_result), name, old_value, new_value, f"{change:+.1%}", flag))
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative change reported as worse/better")
+    parser.add_argument("--all", action="store_true", help="print unflagged changes too")
+    args = parser.parse_args()
+
+    rows, regressions = compare(load(args.old), load(args.new), args.threshold)
+    for row in rows:
+        if args.all or row[-1]:
+            print("\t".join(map(str, row)))
+    print(f"{regressions} measurements worse by more than {args.threshold:.0%}", file=sys.stderr)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
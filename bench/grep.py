@@ -0,0 +1,76 @@
+"""
+Output search: lines matching a pattern in the output of many finished jobs, found by the client
+(`/jobs/output` of every job, searched client-side) against one server-side `/jobs/grep` over all of them;
+time and bytes sent, then the same search with a `timeout` budget too short for it.
+
+    python -m bench.grep --jobs 10 --lines 200000 --mode threads asyncio
+"""
+
+import argparse
+import json
+import re
+import time
+import urllib.parse
+import urllib.request
+
+from bench.common import emit, http_get, jobaman_server
+
+PATTERN = "^9.*77$"
+
+
+def fetch(url):
+    with urllib.request.urlopen(url, timeout=60) as rsp:
+        return rsp.read()
+
+
+def run(mode, jobs, lines):
+    options = {"server_mode": mode, "stream_max_bytes": lines * 20}
+    with jobaman_server(**options) as (base_url, _):
+        job_ids = [http_get(f"{base_url}/jobs/run?_0=seq&_1={lines}&__label=grep")["job_id"] for _ in range(jobs)]
+        http_get(f"{base_url}/jobs/wait?" + "&".join(f"__job_id={job_id}" for job_id in job_ids), timeout=60)
+        regex = re.compile(PATTERN, re.MULTILINE)
+
+        ts = time.monotonic()
+        client_bytes, client_matches = 0, 0
+        for job_id in job_ids:
+            body = fetch(f"{base_url}/jobs/output?__job_id={job_id}")
+            client_bytes += len(body)
+            client_matches += len(regex.findall(json.loads(body)["stdout"]))
+        client_s = time.monotonic() - ts
+
+        pattern = urllib.parse.quote(PATTERN)
+        url = f"{base_url}/jobs/grep?__label=grep&pattern={pattern}&max_matches=10000&stream=stdout"
+        ts = time.monotonic()
+        body = fetch(url)
+        server_s = time.monotonic() - ts
+        server_matches = json.loads(body)["matches"]
+
+        ts = time.monotonic()
+        budget = json.loads(fetch(url + "&timeout=0.01"))
+        budget_s = time.monotonic() - ts
+    return {
+        "mode": mode,
+        "jobs": jobs,
+        "lines": lines,
+        "matches": {"client": client_matches, "server": server_matches},
+        "client_ms": round(client_s * 1000, 1),
+        "client_kb": round(client_bytes / 1024),
+        "server_ms": round(server_s * 1000, 1),
+        "server_kb": round(len(body) / 1024),
+        "budget_ms": round(budget_s * 1000, 1),
+        "budget_complete": budget["complete"],
+        "budget_jobs_searched": len(budget["jobs"]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=10)
+    parser.add_argument("--lines", type=int, default=200_000)
+    parser.add_argument("--mode", nargs="+", default=["threads", "asyncio"])
+    args = parser.parse_args()
+    emit("grep", [run(mode, args.jobs, args.lines) for mode in args.mode])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Job engine footprint: threads, RSS and completion-detection latency
+for N concurrent `sleep` jobs.
+
+    python -m bench.jobs --counts 10 100 1000 --sleep 2.2
+"""
+
+import argparse
+import resource
+import time
+
+from bench.common import emit, percentiles, rss_kb, threads_count, wait_for
+from jobaman.jobs.manager import JobState, Manager
+
+
+def run(count, sleep):
+    manager = Manager(config={"max_jobs": count, "entrypoint": None})
+    threads_before = threads_count()
+    rss_before = rss_kb()
+
+    jobs, started = [], {}
+    ts_spawn = time.monotonic()
+    for _ in range(count):
+        job = manager[manager.run_task(["sleep", str(sleep)])]
+        started[id(job)] = time.monotonic()
+        jobs.append(job)
+    spawn_time = time.monotonic() - ts_spawn
+
+    time.sleep(sleep / 2)
+    threads_running = threads_count()
+    rss_running = rss_kb()
+
+    completed = {}
+
+    def all_done():
+        now = time.monotonic()
+        for job in jobs:
+            if id(job) not in completed and job.state != JobState.RUNNING:
+                completed[id(job)] = now
+        return len(completed) == len(jobs)
+
+    wait_for(all_done, timeout=sleep * 10 + count / 10, step=0.001)
+    latencies = [(completed[key] - started[key] - sleep) * 1000 for key in completed]
+    manager.shutdown()
+
+    return {
+        "jobs": count,
+        "spawn_s": round(spawn_time, 3),
+        "threads_before": threads_before,
+        "threads_running": threads_running,
+        "rss_before_kb": rss_before,
+        "rss_running_kb": rss_running,
+        "completion_latency_ms": {k: round(v, 1) for k, v in percentiles(latencies).items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--counts", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--sleep", type=float, default=2.2)
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    emit("jobs", [run(count, args.sleep) for count in args.counts])
+
+
+if __name__ == "__main__":
+    main()
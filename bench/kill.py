@@ -0,0 +1,70 @@
+"""
+Shutdown of N running jobs: wall time and processes left behind,
+for jobs that exit on SIGTERM and for jobs that ignore it (SIGKILL after the grace period).
+Every job runs a shell with a background grandchild.
+
+    python -m bench.kill --counts 100 500 --grace 1
+"""
+
+import argparse
+import logging
+import os
+import resource
+import time
+
+from bench.common import emit
+from jobaman.jobs.manager import Manager
+
+PROFILES = {
+    "exits-on-term": "sleep 60 & wait",
+    "ignores-term": "trap '' TERM; sleep 60 & wait",
+}
+
+
+def alive_in_groups(pgids):
+    """non-zombie processes in the given process groups"""
+    count = 0
+    for entry in os.scandir("/proc"):
+        if not entry.name.isdigit():
+            continue
+        try:
+            with open(f"{entry.path}/stat", "r") as f:
+                fields = f.read().rpartition(")")[2].split()
+        except OSError:
+            continue
+        if fields[0] != "Z" and int(fields[2]) in pgids:
+            count += 1
+    return count
+
+
+def run(profile, count, grace):
+    manager = Manager(config={"max_jobs": count, "entrypoint": None, "kill_grace_period": grace})
+    pids = {manager[manager.run_task(["sh", "-c", PROFILES[profile]])].pid for _ in range(count)}
+    time.sleep(1)
+    ts = time.monotonic()
+    manager.shutdown()
+    elapsed = time.monotonic() - ts
+    time.sleep(1 / 2)
+    return {
+        "profile": profile,
+        "jobs": count,
+        "grace_s": grace,
+        "shutdown_s": round(elapsed, 3),
+        "left_alive": alive_in_groups(pids),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--counts", type=int, nargs="+", default=[100, 500])
+    parser.add_argument("--grace", type=float, default=1.0)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    emit("kill", [run(profile, count, args.grace) for profile in PROFILES for count in args.counts])
+
+
+if __name__ == "__main__":
+    main()
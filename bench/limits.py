@@ -0,0 +1,92 @@
+"""
+Admission control: clients polling `/jobs/output` of a job with a large output in a tight loop (the hogs)
+and one client listing the jobs now and then, without limits against a per-client read budget;
+latency of the well-behaved client, requests of the hogs that were answered and rejected.
+The hogs send a known API key (`rate-limit-key-header`, `rate-limit-keys`), so they share one budget although
+they all come from the same address as the other client.
+
+    python -m bench.limits --hogs 8 --seconds 3 --mode threads asyncio
+"""
+
+import argparse
+import collections
+import http.client
+import threading
+import time
+import urllib.parse
+from dataclasses import dataclass, field
+
+from bench.api import rounded
+from bench.common import emit, http_get, jobaman_server, percentiles
+
+LIMITS = {
+    "rate_limit_read_rate": 5,
+    "rate_limit_read_burst": 5,
+    "rate_limit_key_header": "X-Api-Key",
+    "rate_limit_keys": "hog",
+}
+
+
+@dataclass
+class Poller:
+    """a client sending GET `path` until stopped, with its latencies (ms) and response statuses"""
+
+    path: str
+    headers: dict = field(default_factory=dict)
+    pause: float = 0
+    latencies: list = field(default_factory=list)
+    statuses: collections.Counter = field(default_factory=collections.Counter)
+
+    def poll(self, base_url, stopped):
+        url = urllib.parse.urlparse(base_url)
+        conn = http.client.HTTPConnection(url.hostname, url.port, timeout=60)
+        while not stopped.is_set():
+            ts = time.monotonic()
+            conn.request("GET", self.path, headers=self.headers)
+            rsp = conn.getresponse()
+            rsp.read()
+            self.latencies.append((time.monotonic() - ts) * 1000)
+            self.statuses[rsp.status] += 1
+            if rsp.will_close:
+                conn.close()
+            time.sleep(self.pause)
+        conn.close()
+
+
+def run(mode, limited, hogs, seconds):
+    options = {"server_mode": mode, "server_workers": 4, **(LIMITS if limited else {})}
+    with jobaman_server(**options) as (base_url, _):
+        job_id = http_get(base_url + "/jobs/run?_0=seq&_1=20000")["job_id"]
+        time.sleep(0.5)
+        stopped = threading.Event()
+        hog = Poller(f"/jobs/output?__job_id={job_id}", {"X-Api-Key": "hog"})  # shared by all the hogs
+        client = Poller("/jobs/?__limit=10", pause=0.25)
+        threads = [threading.Thread(target=poller.poll, args=(base_url, stopped)) for poller in [hog] * hogs + [client]]
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stopped.set()
+        for thread in threads:
+            thread.join()
+    return {
+        "mode": mode,
+        "limited": limited,
+        "hogs": hogs,
+        "latency_ms": rounded(percentiles(client.latencies)),
+        "statuses": dict(client.statuses),
+        "hog_answered_per_s": round(hog.statuses[200] / seconds, 1),
+        "hog_rejected_per_s": round(hog.statuses[429] / seconds, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hogs", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--mode", nargs="+", default=["threads", "asyncio"])
+    args = parser.parse_args()
+    emit("limits", [run(mode, limited, args.hogs, args.seconds) for mode in args.mode for limited in (False, True)])
+
+
+if __name__ == "__main__":
+    main()
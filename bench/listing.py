@@ -0,0 +1,74 @@
+"""
+`/jobs/` with N running jobs: handler plus response rendering time when the listing changed since the last poll,
+when it did not (served from the cache) and for a conditional request (304); indented against compact JSON.
+
+    python -m bench.listing --jobs 1000 --polls 200
+"""
+
+import argparse
+import logging
+import resource
+import time
+
+from bench.common import emit, percentiles
+from jobaman.api.handlers import handle_list_jobs
+from jobaman.api.query import Query
+from jobaman.api.server import render_response
+from jobaman.config import Configuration
+from jobaman.jobs.manager import Manager
+
+
+def poll(config, query, polls, changed):
+    manager = config["manager"]
+    latencies, size = [], 0
+    for _ in range(polls):
+        if changed:
+            with manager.lock:
+                manager.version += 1
+        ts = time.perf_counter()
+        code, data = handle_list_jobs(query, config)
+        size = len(render_response(code, data, indent=config.json_indent))
+        latencies.append((time.perf_counter() - ts) * 1000)
+    return latencies, size
+
+
+def run(manager, indent, polls):
+    config = Configuration()
+    config.configure(params={}, env_use=False)
+    config["manager"] = manager
+    config.server_base_url = "http://localhost:1954"
+    config.json_indent = indent
+    results = []
+    for name, changed in (("changed", True), ("unchanged", False)):
+        latencies, size = poll(config, Query(), polls, changed)
+        results.append({"indent": indent, "poll": name, "bytes": size, **ms(latencies)})
+    etag = handle_list_jobs(Query(), config)[1].headers["ETag"]
+    latencies, size = poll(config, Query(headers={"if-none-match": etag}), polls, False)
+    results.append({"indent": indent, "poll": "if-none-match", "bytes": size, **ms(latencies)})
+    return results
+
+
+def ms(latencies):
+    return {f"{key}_ms": round(value, 3) for key, value in percentiles(latencies).items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=1000)
+    parser.add_argument("--polls", type=int, default=200)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    manager = Manager(config={"max_jobs": args.jobs, "entrypoint": None})
+    for _ in range(args.jobs):
+        manager.run_task(["sleep", "60"])
+    try:
+        emit("listing", [result for indent in (1, None) for result in run(manager, indent, args.polls)])
+    finally:
+        manager.shutdown()
+
+
+if __name__ == "__main__":
+    main()
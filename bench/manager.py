@@ -0,0 +1,70 @@
+"""
+Manager bookkeeping with a long history: `run_task` and `/jobs/` handler latency (running jobs,
+and the newest page of finished ones) with N finished jobs kept by the manager, and the time to evict them by retention.
+
+    python -m bench.manager --history 0 100000 --runs 200
+"""
+
+import argparse
+import logging
+import time
+
+from bench.common import emit, percentiles, wait_for
+from jobaman.api.handlers import handle_list_jobs
+from jobaman.api.query import Query
+from jobaman.config import Configuration
+from jobaman.jobs.job import Job
+from jobaman.jobs.manager import JobState, Manager
+from jobaman.jobs.process import ExitedProcess
+
+
+def timed(func, *args, **kwargs):
+    ts = time.perf_counter()
+    result = func(*args, **kwargs)
+    return (time.perf_counter() - ts) * 1000, result
+
+
+def run(history, runs):
+    manager = Manager(config={"max_jobs": runs + 10, "entrypoint": None})
+    for n in range(history):
+        manager._add_job(f"old-{n}", Job(ExitedProcess(n, 0), state=JobState.DONE))
+
+    config = Configuration()
+    config.configure(params={}, env_use=False)
+    config["manager"] = manager
+    config.server_base_url = "http://localhost"
+
+    finished_query = Query(params={"__state": ["finished"], "__sort": ["-started"]})
+    run_task, list_jobs, list_finished = [], [], []
+    for _ in range(runs):
+        elapsed, _ = timed(manager.run_task, ["sleep", "5"])
+        run_task.append(elapsed)
+        elapsed, _ = timed(handle_list_jobs, Query(), config)
+        list_jobs.append(elapsed)
+        elapsed, (_, rsp) = timed(handle_list_jobs, finished_query, config)
+        list_finished.append(elapsed)
+    manager.shutdown()
+
+    manager.retention_count = 1
+    elapsed, _ = timed(wait_for, lambda: not manager._evict(Manager.RETENTION_BATCH), step=0)
+    return {
+        "history": history,
+        "run_task_ms": {k: round(v, 3) for k, v in percentiles(run_task).items()},
+        "list_jobs_ms": {k: round(v, 3) for k, v in percentiles(list_jobs).items()},
+        "list_finished_ms": {k: round(v, 3) for k, v in percentiles(list_finished).items()},
+        "list_finished_bytes": len(rsp.body),
+        "evict_all_ms": round(elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--history", type=int, nargs="+", default=[0, 100_000])
+    parser.add_argument("--runs", type=int, default=200)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    emit("manager", [run(history, args.runs) for history in args.history])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Pipelines: a chain of jobs, each one started after the previous one has succeeded, driven by the client
+(`/jobs/run`, then `/jobs/wait` for it before the next one) against one `/jobs/run-batch` with `after`;
+per stage overhead on top of the job run time, with `--rtt` milliseconds of network round trip emulated
+by the client before every request.
+
+    python -m bench.pipeline --stages 50 --rtt 0 20 --mode threads asyncio
+"""
+
+import argparse
+import json
+import time
+import urllib.request
+
+from bench.common import emit, http_get, jobaman_server
+
+
+def request(url, rtt, body=None):
+    time.sleep(rtt / 1000)
+    if body is None:
+        return http_get(url)
+    with urllib.request.urlopen(urllib.request.Request(url, data=body, method="POST"), timeout=60) as rsp:
+        return json.loads(rsp.read())
+
+
+def run(mode, stages, rtt, driver):
+    with jobaman_server(server_mode=mode, max_jobs=10, max_queue=stages) as (base_url, _):
+        ts = time.monotonic()
+        if driver == "client":
+            for _ in range(stages):
+                job_id = request(base_url + "/jobs/run?_0=true", rtt)["job_id"]
+                request(f"{base_url}/jobs/wait?__job_id={job_id}&timeout=60", rtt)
+        else:
+            tasks = [{"command": ["true"], "after": [i - 1] if i else []} for i in range(stages)]
+            job_id = request(base_url + "/jobs/run-batch", rtt, body=json.dumps(tasks).encode())["job_ids"][-1]
+        rsp = request(f"{base_url}/jobs/wait?__job_id={job_id}&timeout=60", rtt)
+        elapsed = time.monotonic() - ts
+    return {
+        "mode": mode,
+        "driver": driver,
+        "stages": stages,
+        "rtt_ms": rtt,
+        "done": rsp["done"],
+        "total_s": round(elapsed, 3),
+        "stage_ms": round(elapsed * 1000 / stages, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stages", type=int, default=50)
+    parser.add_argument("--rtt", type=float, nargs="+", default=[0, 20])
+    parser.add_argument("--mode", nargs="+", default=["threads", "asyncio"])
+    args = parser.parse_args()
+    emit(
+        "pipeline",
+        [
+            run(mode, args.stages, rtt, driver)
+            for mode in args.mode
+            for rtt in args.rtt
+            for driver in ("client", "server")
+        ],
+    )
+
+
+if __name__ == "__main__":
+    main()
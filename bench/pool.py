@@ -0,0 +1,75 @@
+"""
+Short Python jobs with import-heavy startup: completion latency of a cold entrypoint spawn
+against the same entrypoint running as a warm pool worker.
+
+    python -m bench.pool --tasks 200 --workers 4
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from bench.common import emit, percentiles
+from jobaman.jobs.manager import JobState, Manager
+
+ENTRYPOINT = f"""#!{sys.executable}
+import sys
+sys.path.insert(0, {os.getcwd()!r})
+import asyncio, decimal, email.parser, http.client, json, logging.handlers, sqlite3, unittest, urllib.request
+
+
+def main(args):
+    print(json.dumps({{"args": args, "total": str(sum(decimal.Decimal(arg) for arg in args))}}))
+
+
+if sys.argv[1:2] == ["--worker"]:
+    from jobaman.jobs.pool import serve
+    serve(main)
+else:
+    main(sys.argv[1:])
+"""
+
+
+def run(mode, entrypoint, tasks, workers):
+    config = {"max_jobs": workers, "entrypoint": entrypoint}
+    if mode == "pool":
+        config.update(worker_pool_size=workers, worker_pool_command=f"{entrypoint} --worker")
+    manager = Manager(config=config)
+    time.sleep(1)
+    latencies = []
+    for i in range(tasks):
+        ts = time.perf_counter()
+        job = manager[manager.run_task(["1", str(i)])]
+        while job.state == JobState.RUNNING:
+            time.sleep(1 / 10_000)
+        latencies.append((time.perf_counter() - ts) * 1000)
+        assert job.exit_code == 0 and str(i + 1) in job.stdout, job.stdout
+    manager.shutdown()
+    return {
+        "mode": mode,
+        "tasks": tasks,
+        **{f"{key}_ms": round(value, 2) for key, value in percentiles(latencies).items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    with tempfile.NamedTemporaryFile("w", suffix=".py", delete=False) as f:
+        f.write(ENTRYPOINT)
+    os.chmod(f.name, 0o755)
+    try:
+        emit("pool", [run(mode, f.name, args.tasks, args.workers) for mode in ("spawn", "pool")])
+    finally:
+        os.unlink(f.name)
+
+
+if __name__ == "__main__":
+    main()
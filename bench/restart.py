@@ -0,0 +1,88 @@
+"""
+Restart: `/restart` handing the socket and the running jobs over to a new jobaman against stopping it
+and starting a new one on the same port; failed pings and ping latency while it restarts, jobs still running.
+
+    python -m bench.restart --jobs 50 --clients 4 --mode threads asyncio
+"""
+
+import argparse
+import contextlib
+import os
+import signal
+import threading
+import time
+import urllib.request
+
+from bench.api import rounded
+from bench.common import emit, free_port, http_get, jobaman_server, percentiles, wait_for
+
+
+def ping(base_url, latencies, errors, stopped):
+    while not stopped.is_set():
+        ts = time.monotonic()
+        try:
+            with urllib.request.urlopen(base_url + "/ping", timeout=10) as rsp:
+                rsp.read()
+            latencies.append((time.monotonic() - ts) * 1000)
+        except OSError:
+            errors.append(time.monotonic())
+            time.sleep(1 / 1000)
+
+
+def run(mode, method, jobs, clients):
+    port = free_port()
+    options = {"server_mode": mode, "max_jobs": jobs, "server_listen_port": port}
+    with contextlib.ExitStack() as stack:
+        base_url, server = stack.enter_context(jobaman_server(**options))
+        for _ in range(jobs):
+            http_get(base_url + "/jobs/run?_0=sh&_1=-c&_2=while+true%3B+do+echo+.%3B+sleep+0.1%3B+done")
+        old_pid = http_get(base_url + "/ping")["pid"]
+        latencies, errors, stopped = [], [], threading.Event()
+        threads = [threading.Thread(target=ping, args=(base_url, latencies, errors, stopped)) for _ in range(clients)]
+        _ = list(map(lambda t: t.start(), threads))
+        time.sleep(0.5)
+
+        ts = time.monotonic()
+        if method == "handoff":
+            http_get(base_url + "/restart")
+        else:
+            server.terminate()
+            server.wait(timeout=30)
+            stack.enter_context(jobaman_server(**options))
+        wait_for(lambda: (http_get(base_url + "/ping", timeout=1) or {}).get("pid", old_pid) != old_pid, timeout=30)
+        elapsed = time.monotonic() - ts
+        time.sleep(0.5)
+        stopped.set()
+        _ = list(map(lambda t: t.join(), threads))
+
+        rsp = http_get(base_url + "/ping")
+        running = len(http_get(base_url + "/jobs/?__state=running&__limit=1000")["jobs"])
+        http_get(base_url + "/jobs/kill?__state=running")
+        if method == "handoff":  # not the process `jobaman_server` started
+            os.kill(rsp["pid"], signal.SIGTERM)
+            wait_for(lambda: not os.path.exists(f"/proc/{rsp['pid']}"), timeout=30, step=0.05)
+    return {
+        "mode": mode,
+        "method": method,
+        "jobs": jobs,
+        "restart_s": round(elapsed, 3),
+        "failed_pings": len(errors),
+        "ping_latency_ms": rounded({**percentiles(latencies), "max": max(latencies, default=None)}),
+        "jobs_running_after": running,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=50)
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--mode", nargs="+", default=["threads", "asyncio"])
+    args = parser.parse_args()
+    emit(
+        "restart",
+        [run(mode, method, args.jobs, args.clients) for mode in args.mode for method in ("stop-start", "handoff")],
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Usage sampler overhead with N running jobs (each a shell with a `sleep` child):
+wall and CPU time of one `/proc` pass, and the share of one CPU it takes per sampling interval;
+compared with one `/proc` walk per job (`helpers.get_pids_by_ppid`).
+
+    python -m bench.sampler --jobs 1000 --samples 10 --intervals 1 5
+"""
+
+import argparse
+import logging
+import resource
+import time
+
+from bench.common import emit, percentiles
+from jobaman.helpers import get_pids_by_ppid
+from jobaman.jobs.manager import Manager
+from jobaman.jobs.sampler import Sampler
+
+
+def run(count, samples, intervals, walks):
+    manager = Manager(config={"max_jobs": count, "entrypoint": None})
+    for _ in range(count):
+        manager.run_task(["sh", "-c", "sleep 600 & wait"])
+    time.sleep(1)
+    sampler = Sampler(manager.running_jobs_snapshot, interval=3600)
+
+    wall, cpu = [], []
+    for _ in range(samples):
+        ts, ts_cpu = time.perf_counter(), time.thread_time()
+        sampler.sample()
+        wall.append((time.perf_counter() - ts) * 1000)
+        cpu.append((time.thread_time() - ts_cpu) * 1000)
+    sampler.stop()
+
+    pids = [job.pid for job in list(manager.running_jobs.values())[:walks]]
+    ts_cpu = time.thread_time()
+    for pid in pids:
+        get_pids_by_ppid(pid)
+    walk_ms = (time.thread_time() - ts_cpu) * 1000 / len(pids)
+
+    sampled = sum(1 for job in manager.running_jobs.values() if job.rss)
+    manager.shutdown()
+    cpu_p50 = percentiles(cpu)["p50"]
+    return {
+        "jobs": count,
+        "jobs_sampled": sampled,
+        "sample_wall_ms": {k: round(v, 1) for k, v in percentiles(wall).items()},
+        "sample_cpu_ms": {k: round(v, 1) for k, v in percentiles(cpu).items()},
+        "cpu_share_pct": {f"interval_{i}s": round(cpu_p50 / (i * 10), 2) for i in intervals},
+        "walk_per_job_cpu_ms": round(walk_ms, 1),
+        "walk_per_job_total_cpu_ms": round(walk_ms * count, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--samples", type=int, default=10)
+    parser.add_argument("--intervals", type=float, nargs="+", default=[1, 5])
+    parser.add_argument("--walks", type=int, default=20, help="per-job /proc walks to time")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    emit("sampler", [run(count, args.samples, args.intervals, args.walks) for count in args.jobs])
+
+
+if __name__ == "__main__":
+    main()
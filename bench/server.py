@@ -0,0 +1,91 @@
+"""
+HTTP front-end: throughput and latency of `/ping` for each `server-mode`,
+optionally with idle (slow) client connections held open.
+
+    python -m bench.server --clients 16 --requests 500 --idle 0 8 --duration 20
+"""
+
+import argparse
+import http.client
+import socket
+import threading
+import time
+import urllib.parse
+
+from bench.common import emit, jobaman_server, percentiles
+
+
+def client(base_url, requests, keep_alive, deadline, results):
+    """send up to `requests` pings until `deadline`, a latency (ms) or `None` for an error goes to `results`"""
+    url = urllib.parse.urlparse(base_url)
+    conn = None
+    for _ in range(requests):
+        ts = time.monotonic()
+        if ts > deadline:
+            break
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection(url.hostname, url.port, timeout=1)
+            conn.request("GET", "/ping")
+            rsp = conn.getresponse()
+            rsp.read()
+            if not keep_alive or rsp.will_close:
+                conn.close()
+                conn = None
+        except OSError:
+            results.append(None)
+            conn = None
+            continue
+        results.append((time.monotonic() - ts) * 1000)
+    if conn is not None:
+        conn.close()
+
+
+def run(mode, clients, requests, idle, duration):
+    with jobaman_server(server_mode=mode, server_workers=4) as (base_url, _):
+        url = urllib.parse.urlparse(base_url)
+        idle_conns = [socket.create_connection((url.hostname, url.port)) for _ in range(idle)]
+        time.sleep(0.2)
+
+        results = []
+        ts = time.monotonic()
+        client_args = (base_url, requests, mode == "asyncio", ts + duration, results)
+        threads = [threading.Thread(target=client, args=client_args) for _ in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - ts
+        latencies = [latency for latency in results if latency is not None]
+
+        for conn in idle_conns:
+            conn.close()
+
+    return {
+        "mode": mode,
+        "clients": clients,
+        "idle_connections": idle,
+        "requests": len(latencies),
+        "errors": len(results) - len(latencies),
+        "rps": round(len(latencies) / elapsed, 1),
+        "latency_ms": {k: v and round(v, 2) for k, v in percentiles(latencies).items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modes", nargs="+", default=["threads", "asyncio"])
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--idle", type=int, nargs="+", default=[0, 8])
+    parser.add_argument("--duration", type=float, default=20, help="max seconds per run")
+    args = parser.parse_args()
+
+    emit(
+        "server",
+        [run(mode, args.clients, args.requests, idle, args.duration) for idle in args.idle for mode in args.modes],
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Router mode: `/jobs/run` and `/jobs/` through a router in front of N backends against one backend directly;
+submission rate and latency, listing latency with all jobs running, and how the jobs were spread.
+
+    python -m bench.shards --jobs 400 --backends 2 --clients 8 --mode threads asyncio
+"""
+
+import argparse
+import collections
+import contextlib
+import resource
+
+from bench.api import concurrently, requests, rounded
+from bench.common import emit, jobaman_server, percentiles
+
+
+def run(mode, backends, jobs, clients, polls):
+    with contextlib.ExitStack() as stack:
+        urls = [
+            stack.enter_context(jobaman_server(server_mode="asyncio", max_jobs=jobs))[0] for _ in range(backends)
+        ]
+        if backends:
+            router = jobaman_server(server_mode=mode, server_workers=clients, router_backends=",".join(urls))
+            base_url = stack.enter_context(router)[0]
+        else:
+            base_url = stack.enter_context(jobaman_server(server_mode=mode, server_workers=clients, max_jobs=jobs))[0]
+        paths = ["/jobs/run?_0=sleep&_1=600"] * jobs
+        run_latencies, elapsed, responses = concurrently(base_url, paths, clients)
+        list_latencies, _, _ = concurrently(base_url, ["/jobs/?__limit=100"] * polls, clients)
+        spread = collections.Counter(rsp.get("backend", base_url) for rsp in responses)
+        requests(base_url, ["/jobs/kill?__state=running"], [])
+    return {
+        "mode": mode,
+        "backends": backends,
+        "jobs": jobs,
+        "run_per_s": round(jobs / elapsed, 1),
+        "run_latency_ms": rounded(percentiles(run_latencies)),
+        "list_latency_ms": rounded(percentiles(list_latencies)),
+        "jobs_per_backend": sorted(spread.values()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=400)
+    parser.add_argument("--backends", type=int, default=2)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--polls", type=int, default=100)
+    parser.add_argument("--mode", nargs="+", default=["threads", "asyncio"])
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    emit(
+        "shards",
+        [
+            run(mode, backends, args.jobs, args.clients, args.polls)
+            for mode in args.mode
+            for backends in (0, args.backends)
+        ],
+    )
+
+
+if __name__ == "__main__":
+    main()
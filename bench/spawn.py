@@ -0,0 +1,64 @@
+"""
+Job spawn latency with the manager process grown to a given RSS:
+`Manager._spawn` (vfork) against the same `Popen` forced onto the fork path by a `group` (its own, a no-op
+in the child; a `preexec_fn` would do too, but is not safe with threads).
+
+    python -m bench.spawn --rss-mb 100 2048 --spawns 200
+"""
+
+import argparse
+import logging
+import os
+import subprocess
+import time
+
+from bench.common import emit, percentiles, rss_kb
+from jobaman.jobs.manager import Manager
+
+
+def spawn_fork(command_run):
+    return subprocess.Popen(
+        command_run,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        start_new_session=True,
+        group=os.getgid(),  # no vfork with a uid or gid change
+    )
+
+
+def run(rss_mb, spawns):
+    ballast = b"\1" * max(0, rss_mb * 1024 * 1024 - rss_kb() * 1024)  # touched pages, not just reserved
+    manager = Manager(config={"max_jobs": spawns, "entrypoint": None})
+    results = []
+    for name, spawn in (("vfork", manager._spawn), ("fork", spawn_fork)):
+        latencies = []
+        for _ in range(spawns):
+            ts = time.perf_counter()
+            process = spawn(["true"])
+            latencies.append((time.perf_counter() - ts) * 1000)
+            process.communicate()
+        results.append(
+            {
+                "spawn": name,
+                "rss_mb": rss_kb() // 1024,
+                "spawns": spawns,
+                **{f"{key}_ms": round(value, 3) for key, value in percentiles(latencies).items()},
+            }
+        )
+    manager.shutdown()
+    del ballast
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rss-mb", type=int, nargs="+", default=[100, 2048])
+    parser.add_argument("--spawns", type=int, default=200)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    emit("spawn", [result for rss_mb in args.rss_mb for result in run(rss_mb, args.spawns)])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Output buffer memory: 100 jobs worth of stdout kept by the legacy
+`deque(maxlen=10_000)` of `str` lines vs the byte-budgeted `StreamBuffer`.
+
+    python -m bench.streams --jobs 100 --max-bytes 1048576
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+from collections import deque
+
+from bench.common import emit
+from jobaman.jobs.streams import StreamBuffer
+
+PROFILES = {
+    "short-lines": (16, 100_000),
+    "long-lines": (2048, 20_000),
+}
+CHUNK_SIZE = 64 * 1024  # of output read at once
+
+
+def legacy_buffer(_):
+    return deque(maxlen=10_000)
+
+
+def legacy_extend(buffer, lines):
+    buffer.extend(line.decode("utf-8", errors="ignore") for line in lines)
+
+
+def measure(jobs, line_size, lines, buffer_kind):
+    """memory and time to write `lines` to the buffers of `jobs`, `buffer_kind` is (make_buffer, extend)"""
+    make_buffer, extend = buffer_kind
+    line = b"x" * (line_size - 1) + b"\n"
+    chunk = [line] * max(1, CHUNK_SIZE // line_size)
+    gc.collect()
+    tracemalloc.start()
+    ts = time.monotonic()
+    buffers = [make_buffer(i) for i in range(jobs)]
+    for buffer in buffers:
+        for _ in range(lines // len(chunk)):
+            extend(buffer, chunk)
+    elapsed = time.monotonic() - ts
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    kept = sum(len(buffer) for buffer in buffers)
+    del buffers
+    return {
+        "memory_mb": round(current / 2**20, 1),
+        "peak_mb": round(peak / 2**20, 1),
+        "lines_kept": kept,
+        "bytes_per_line": round(current / kept, 1),
+        "append_s": round(elapsed, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=100)
+    parser.add_argument("--max-bytes", type=int, default=1024 * 1024)
+    args = parser.parse_args()
+
+    results = []
+    for profile, (line_size, lines) in PROFILES.items():
+        results.append(
+            {
+                "profile": profile,
+                "jobs": args.jobs,
+                "line_size": line_size,
+                "lines_written": lines,
+                "legacy": measure(args.jobs, line_size, lines, (legacy_buffer, legacy_extend)),
+                "stream_buffer": measure(
+                    args.jobs, line_size, lines, (lambda _: StreamBuffer(args.max_bytes), StreamBuffer.extend)
+                ),
+            }
+        )
+    emit("streams", results)
+
+
+if __name__ == "__main__":
+    main()
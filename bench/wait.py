@@ -0,0 +1,84 @@
+"""
+Waiting for N jobs to complete: every client polling `/jobs/output` against one long-poll `/jobs/wait` each;
+requests sent and the delay between job completion and the client noticing it
+(measured from the submission, so it includes the `/jobs/run` request),
+with more waiting clients than `server-workers`.
+
+    python -m bench.wait --jobs 100 --poll-interval 0.25 --mode threads asyncio
+"""
+
+import argparse
+import functools
+import json
+import random
+import threading
+import time
+import urllib.request
+
+from bench.common import emit, jobaman_server, percentiles
+
+
+def get(url):
+    with urllib.request.urlopen(url, timeout=60) as rsp:
+        return json.loads(rsp.read())
+
+
+def poll_client(base_url, job_id, stats, interval):
+    while True:
+        stats["requests"] += 1
+        job = get(f"{base_url}/jobs/output?__job_id={job_id}")["job"]
+        if "state=running" not in job and "state=queued" not in job:
+            return
+        time.sleep(interval)
+
+
+def wait_client(base_url, job_id, stats, interval):
+    while True:
+        stats["requests"] += 1
+        if get(f"{base_url}/jobs/wait?__job_id={job_id}&timeout=30")["done"]:
+            return
+
+
+def client(base_url, job_id, duration, wait, stats):
+    ts = time.monotonic()
+    get(f"{base_url}/jobs/run?_0=sleep&_1={duration}&__job_id={job_id}")
+    wait(base_url, job_id, stats)
+    stats["delays"].append((time.monotonic() - ts - duration) * 1000)
+
+
+def run(mode, wait, jobs, interval):
+    with jobaman_server(server_mode=mode, server_workers=4) as (base_url, _):
+        stats = {"requests": 0, "delays": []}
+        durations = [round(random.uniform(0.5, 2.0), 3) for _ in range(jobs)]
+        waiter = functools.partial(wait, interval=interval)
+        threads = [
+            threading.Thread(target=client, args=(base_url, f"{wait.__name__}-{i}", d, waiter, stats))
+            for i, d in enumerate(durations)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return {
+        "mode": mode,
+        "client": wait.__name__.removesuffix("_client"),
+        "jobs": jobs,
+        "requests": stats["requests"],
+        **{f"delay_{key}_ms": round(value, 1) for key, value in percentiles(stats["delays"]).items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=100)
+    parser.add_argument("--poll-interval", type=float, default=0.25)
+    parser.add_argument("--mode", nargs="+", default=["threads", "asyncio"])
+    args = parser.parse_args()
+    results = [
+        run(mode, wait, args.jobs, args.poll_interval) for mode in args.mode for wait in (poll_client, wait_client)
+    ]
+    emit("wait", results)
+
+
+if __name__ == "__main__":
+    main()
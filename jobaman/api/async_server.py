@@ -0,0 +1,141 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from jobaman.logger import get_logger
+
+from .handlers import admit, handle
+from .parser import RECV_SIZE, RequestError, RequestParser
+from .query import Query
+from .server import LISTEN_BACKLOG, RESPONSE_400, RESPONSE_500, listen_socket, render_response, server_params
+from .streaming import AsyncResponse
+
+log = get_logger(__name__)
+
+KEEPALIVE_TIMEOUT_DEFAULT = 60
+DRAIN_TIMEOUT = 10  # seconds for the requests in progress when the server stops
+
+
+async def read_request(reader, parser, keepalive_timeout):
+    """read one request from a keep-alive connection, `None` if the client has gone or idled out"""
+    while (request := parser.next_request()) is None:
+        try:
+            data = await asyncio.wait_for(reader.read(RECV_SIZE), timeout=keepalive_timeout)
+        except (TimeoutError, ConnectionError):
+            return None
+        if not data:
+            return None
+        parser.feed(data)
+    return request
+
+
+async def handle_request(query, config, executor):
+    """
+    `handle` on a server worker, in flight for admission control until it is done (see `limits`);
+    admitted on the loop, so a rejected request never waits in the queue of the server workers
+    """
+    admission = config.get("admission")
+    if admission is not None:
+        admission.submitted()
+    try:
+        rejected = admit(query, config)
+        if rejected is not None:
+            return rejected
+        return await asyncio.get_running_loop().run_in_executor(executor, handle, query, config, True)
+    finally:
+        if admission is not None:
+            admission.done()
+
+
+async def serve_client(reader, writer, config, executor, busy=None):
+    """serve a connection, `busy[task]` is `False` while it waits for its next request (see `serve`)"""
+    task = asyncio.current_task()
+    busy = {} if busy is None else busy
+    busy[task] = True  # a new connection: its first request is on its way
+    keepalive_timeout = float(config.get("server-keepalive-timeout", KEEPALIVE_TIMEOUT_DEFAULT))
+    addr = writer.get_extra_info("peername")[:2]
+    parser = RequestParser()
+    try:
+        while True:
+            request = await read_request(reader, parser, keepalive_timeout)
+            if request is None:
+                break
+            busy[task] = True
+            query = Query.from_request(request, addr)
+            keep_alive = request.keep_alive
+            rsp_code, rsp_data = await handle_request(query, config, executor)
+            log.info("[%s:%s] %s %s - %s", *addr, query.method, query.path, rsp_code)
+
+            if isinstance(rsp_data, AsyncResponse):
+                busy[task] = False
+                await rsp_data.serve(writer)
+                break
+
+            keep_alive = keep_alive and task in busy  # not when the server is stopping
+            writer.write(render_response(rsp_code, rsp_data, keep_alive=keep_alive, indent=config.json_indent))
+            await writer.drain()
+            if not keep_alive:
+                break
+            busy[task] = False
+    except RequestError as e:
+        log.error("bad request from [%s:%s]: %s", *addr, e)
+        writer.write(render_response(e.code, {"error": str(e)}, indent=config.json_indent))
+    except (ValueError, IndexError) as e:
+        log.error("bad request from [%s:%s]: %s", *addr, e)
+        writer.write(RESPONSE_400)
+    except ConnectionError:
+        pass
+    except Exception as e:
+        log.error("failed to handle request from [%s:%s]: %s", *addr, e)
+        writer.write(RESPONSE_500)
+    finally:
+        busy.pop(task, None)
+        writer.close()
+
+
+async def serve(config):
+    """
+    the event loop server, returns when a restart stops it (see `jobaman.handoff`): idle keep-alive connections,
+    streams and long-polls are closed, new connections and requests in progress get `DRAIN_TIMEOUT` seconds
+    to complete their request
+    """
+
+    host, port, max_workers = server_params(config)
+    sock = listen_socket(config, host, port)
+    handoff = config.get("handoff")
+    loop = asyncio.get_running_loop()
+    stopped = asyncio.Event()
+    busy = {}  # client task -> handling a request
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        async def on_connect(reader, writer):
+            await serve_client(reader, writer, config, executor, busy)
+
+        # a duplicate: closing the server must not close the socket, it is handed over on a restart
+        server = await asyncio.start_server(on_connect, sock=sock.dup(), backlog=LISTEN_BACKLOG)
+        log.info("asyncio server started on %s:%d", host, port)
+        if handoff is not None:
+            loop.add_reader(handoff.stop_fd, stopped.set)
+        await stopped.wait()
+
+        loop.remove_reader(handoff.stop_fd)  # restarting: the new jobaman accepts from now on
+        server.close()
+        deadline = loop.time() + DRAIN_TIMEOUT
+        await asyncio.sleep(1 / 100)  # connections accepted just before get their tasks
+        while busy:
+            clients = list(busy)
+            for task in clients:
+                if not busy[task]:
+                    task.cancel()
+                del busy[task]  # the busy ones close their connection after the response
+            _, pending = await asyncio.wait(clients, timeout=max(0, deadline - loop.time()))
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        await server.wait_closed()
+
+    log.info("asyncio server stopped")
+
+
+def run_async_server(config):
+    asyncio.run(serve(config))
@@ -1,74 +1,416 @@
+import collections
+import json
+import os
+import re
+import threading
 import time
+from http import HTTPStatus
 
+from jobaman import metrics
 from jobaman.helpers import human_time
+from jobaman.jobs.index import JobSelection
+from jobaman.jobs.job import Job, JobState
+from jobaman.jobs.manager import CapacityError
+from jobaman.jobs.search import Search
 from jobaman.logger import get_logger
 
+from .limits import Admission
 from .query import Query
+from .streaming import JobOutputStream, JobWait
 
 log = get_logger(__name__)
 
+REQUESTS = metrics.Counter("jobaman_http_requests_total", "requests by route and response code", ("route", "code"))
+REQUEST_DURATION = metrics.Histogram("jobaman_http_request_duration_seconds", "request handling time", ("route",))
+JOBS = metrics.Gauge("jobaman_jobs", "jobs known to the manager by state", ("state",))
+STREAMS_BYTES = metrics.Gauge("jobaman_stream_buffered_bytes", "job output bytes kept in memory")
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+BATCH_MAX_JOBS = 10_000
+LIST_LIMIT_DEFAULT = 100
+LIST_LIMIT_MAX = 1000
+LIST_STATES_DEFAULT = (JobState.RUNNING, JobState.QUEUED)
+WAIT_TIMEOUT_DEFAULT = 30
+WAIT_TIMEOUT_MAX = 600
 
-def handle(query, config):
-    for route, handler in ROUTING_TABLE:
-        if route.method is None or query.method == route.method:
-            if route.path == "*" or str(query.path).startswith(route.path):
-                return handler(query, config)
-    return 404, {}
+
+class TextResponse:
+    """response body (`str` or already encoded `bytes`) sent as is instead of JSON, with extra headers"""
+
+    def __init__(self, body, content_type="text/plain; charset=utf-8", headers=None):
+        self.body = body
+        self.content_type = content_type
+        self.headers = headers or {}
+
+
+class ListingCache:
+    """the last few serialized job listings by their ETag, see `handle_list_jobs`"""
+
+    SIZE = 16
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bodies = collections.OrderedDict()  # etag -> body, least recently used first
+
+    def get(self, etag, render):
+        with self.lock:
+            body = self.bodies.get(etag)
+            if body is None:
+                body = self.bodies[etag] = render()
+                while len(self.bodies) > self.SIZE:
+                    self.bodies.popitem(last=False)
+            self.bodies.move_to_end(etag)
+            return body
+
+
+LISTING_CACHE = ListingCache()
+
+
+class Router:
+    """
+    routes by exact path (one dict lookup), then by the longest prefix for route paths ending with `*`;
+    a route with `method=None` takes any method
+    """
+
+    def __init__(self, table):
+        self.exact = collections.defaultdict(list)  # path -> [(route, handler)]
+        prefixes = collections.defaultdict(list)
+        for route, handler in table:
+            if route.path.endswith("*"):
+                prefixes[route.path[:-1]].append((route, handler))
+            else:
+                self.exact[route.path].append((route, handler))
+        self.prefixes = sorted(prefixes.items(), key=lambda item: len(item[0]), reverse=True)
+
+    def match(self, method, path):
+        """`(route, handler)` for the request, `(None, None)` if there is none"""
+        routes = self.exact.get(path)
+        if routes is None:
+            routes = next((routes for prefix, routes in self.prefixes if path.startswith(prefix)), ())
+        for route, handler in routes:
+            if route.method is None or route.method == method:
+                return route, handler
+        return None, None
+
+
+def dump_json(data, indent=1):
+    """JSON response body, `indent=None` for compact JSON"""
+    separators = None if indent else (",", ":")
+    return json.dumps(data, indent=indent, separators=separators, ensure_ascii=False).encode("utf-8")
+
+
+def admit(query, config):
+    """`None` if admission control lets the request through (see `limits`), its 429 or 503 response otherwise"""
+    admission = config.get("admission") if config is not None else None
+    if admission is None:
+        return None
+    route, _ = (config.get("routes") or ROUTES).match(query.method, str(query.path))
+    rejected = admission.admit(query) if route is not None else None  # a 404 is no work
+    if rejected is None:
+        return None
+    REQUESTS.inc(route.path, str(rejected[0]))
+    error = "too many requests" if rejected[0] == HTTPStatus.TOO_MANY_REQUESTS else "overloaded"
+    return retry_response(*rejected, error, config)
+
+
+def handle(query, config, admitted=False):
+    """the response to the request, `admitted` if the server has already called `admit`"""
+    routes = config.get("routes") if config is not None else None  # see `shard_handlers`
+    route, handler = (routes or ROUTES).match(query.method, str(query.path))
+    if route is None:
+        REQUESTS.inc("", "404")
+        return 404, {}
+    admission = config.get("admission") if config is not None else None  # see `limits`
+    rejected = None if admitted else admit(query, config)
+    if rejected is not None:
+        return rejected
+    ts = time.perf_counter()
+    rsp_code = 500
+    try:
+        rsp_code, rsp_data = handler(query, config)
+        return rsp_code, rsp_data
+    finally:
+        duration = time.perf_counter() - ts
+        REQUEST_DURATION.observe(duration, route.path)
+        REQUESTS.inc(route.path, str(rsp_code))
+        if admission is not None:
+            admission.handled(duration)
+
+
+def retry_response(code, retry_after, error, config):
+    """a JSON error with `Retry-After` (whole seconds)"""
+    body = dump_json({"error": error, "retry_after": retry_after}, getattr(config, "json_indent", 1))
+    return code, TextResponse(body, "application/json", {"Retry-After": str(retry_after)})
+
+
+def capacity_response(manager, error, config):
+    """no job slot is free and the queue is full: a 503 to retry once a slot is likely free"""
+    return retry_response(503, Admission.retry_after(manager.free_slot_eta()), str(error), config)
 
 
 def handle_ping(query, config=None):
-    rsp = {"message": "pong", "ts": int(time.time())}
+    rsp = {"message": "pong", "ts": int(time.time()), "pid": os.getpid()}
+    if config is not None and "manager" in config:  # the load, for routers
+        manager = config["manager"]
+        rsp.update(running=manager.running_jobs_count, queued=manager.queued_jobs_count, max_jobs=manager.max_jobs)
     return 200, rsp
 
 
+def handle_restart(query, config):
+    """start a zero-downtime restart, see `jobaman.handoff`"""
+    handoff = config.get("handoff")
+    if handoff is None:
+        return 501, {"error": "restart is not available"}
+    if not handoff.restart():
+        return 409, {"error": "restart in progress"}
+    return 200, {"message": "restarting", "pid": os.getpid()}
+
+
 def handle_run_job(query, config):
+    """
+    run the command (`_0=..&_1=..`); `__after=<job_id>` (may be repeated) waits for those jobs to succeed,
+    `__stdin=<job_id>` makes the stdout of that job the stdin of this one
+    """
     cmd = query.params_to_args()
     job_id = query.get_param("__job_id", None)
+    manager = config["manager"]
     try:
-        real_job_id = config["manager"].run_task(cmd, job_id=job_id)
+        output_bytes = query.get_param("__output_bytes", None)
+        output_bytes = int(output_bytes) if output_bytes is not None else None
+        priority = int(query.get_param("__priority", 0))
+        label = query.get_param("__label", "")
+        real_job_id = manager.run_task(
+            cmd,
+            job_id=job_id,
+            output_bytes=output_bytes,
+            priority=priority,
+            label=label,
+            after=query.params.get("__after"),
+            stdin_job=query.get_param("__stdin", None),
+        )
+    except CapacityError as e:
+        return capacity_response(manager, e, config)
     except ValueError as e:
         return 400, {"error": str(e)}
     return 200, {
         "job_id": real_job_id,
-        "running": config["manager"].running_jobs_count,
+        "state": manager[real_job_id].state,
+        "running": manager.running_jobs_count,
+        "queued": manager.queued_jobs_count,
+    }
+
+
+def parse_batch_task(item):
+    """
+    one job of a batch: `{"command": [...], "job_id": .., "label": .., "priority": .., "output_bytes": ..,
+    "after": [..], "stdin": ..}`, `after` and `stdin` are job ids or positions of earlier jobs in the batch
+    """
+    if not isinstance(item, dict):
+        raise ValueError("a job must be an object")
+    command = item.get("command") or []
+    if isinstance(command, str):
+        command = [command]
+    if not isinstance(command, list) or not all(isinstance(arg, str) for arg in command):
+        raise ValueError("command must be a list of strings")
+    job_id = item.get("job_id")
+    label = item.get("label") or ""
+    if not isinstance(job_id, str | None) or not isinstance(label, str):
+        raise ValueError("job_id and label must be strings")
+    after = item.get("after") or []
+    if not isinstance(after, list) or not all(isinstance(ref, str | int) for ref in [*after, item.get("stdin") or 0]):
+        raise ValueError("after must be a list of job ids or batch positions, stdin one of them")
+    output_bytes = item.get("output_bytes")
+    return {
+        "command": command,
+        "job_id": job_id or None,
+        "output_bytes": int(output_bytes) if output_bytes is not None else None,
+        "priority": int(item.get("priority") or 0),
+        "label": label,
+        "after": after,
+        "stdin_job": item.get("stdin"),
+    }
+
+
+def handle_run_batch(query, config):
+    jobs = query.data.get("jobs") if isinstance(query.data, dict) else query.data
+    if not isinstance(jobs, list) or not jobs:
+        return 400, {"error": "a list of jobs expected"}
+    if len(jobs) > BATCH_MAX_JOBS:
+        return 400, {"error": f"too many jobs in batch (max {BATCH_MAX_JOBS})"}
+    manager = config["manager"]
+    try:
+        results = manager.run_batch([parse_batch_task(item) for item in jobs])
+    except CapacityError as e:
+        return capacity_response(manager, e, config)
+    except (TypeError, ValueError) as e:
+        return 400, {"error": str(e)}
+    return 200, {
+        "job_ids": [result if isinstance(result, str) else None for result in results],
+        "errors": {str(i): str(result) for i, result in enumerate(results) if not isinstance(result, str)},
+        "running": manager.running_jobs_count,
+        "queued": manager.queued_jobs_count,
     }
 
 
+def parse_list_filters(query, states=LIST_STATES_DEFAULT):
+    """`/jobs/` query parameters as a `JobSelection` for `Manager.query_jobs`, `ValueError` if one is invalid"""
+    states = tuple(JobState(state) for state in query.params.get("__state") or states)
+    sort = query.get_param("__sort", "started")
+    if sort not in ("started", "-started"):
+        raise ValueError(f"invalid sort order: {sort}")
+    limit = int(query.get_param("__limit", LIST_LIMIT_DEFAULT))
+    if not 1 <= limit <= LIST_LIMIT_MAX:
+        raise ValueError(f"limit must be from 1 to {LIST_LIMIT_MAX}")
+    cursor = query.get_param("__cursor") or None
+    if cursor is not None:
+        ts, _, seq = cursor.partition("_")
+        cursor = (int(ts), int(seq))
+    started_after = query.get_param("__started_after") or None
+    started_before = query.get_param("__started_before") or None
+    return JobSelection(
+        states=states,
+        labels=tuple(query.params.get("__label") or ()) or None,
+        started_after=float(started_after) if started_after is not None else None,
+        started_before=float(started_before) if started_before is not None else None,
+        descending=sort == "-started",
+        cursor=cursor,
+        limit=limit,
+    )
+
+
 def handle_list_jobs(query, config):
+    """
+    A page of jobs filtered by `__state` (running and queued by default), `__label`, `__started_after`,
+    `__started_before` (unix time), sorted by start time (`__sort=-started` for the newest first);
+    the next page is at `__cursor=<next_cursor>`.
+    The listing is serialized once per version of it (manager version, usage samples taken,
+    and the current second while jobs are running, for their run time), `If-None-Match` gets a 304.
+    """
+    try:
+        filters = parse_list_filters(query)
+    except ValueError as e:
+        return 400, {"error": str(e)}
+    manager = config["manager"]
+    indent = getattr(config, "json_indent", 1)
+    version = (
+        manager.version,
+        manager.sampler.passes if manager.sampler is not None else 0,
+        int(time.time()) if manager.running_jobs_count else 0,
+    )
+    key = hash((indent, config.server_base_url, filters))
+    etag = '"{}"'.format("-".join(map(str, (id(manager), *version, key))))
+    headers = {"ETag": etag}
+    if_none_match = query.headers.get("if-none-match", "")
+    if etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")) or if_none_match == "*":
+        return 304, TextResponse(b"", "application/json", headers)
+    body = LISTING_CACHE.get(etag, lambda: dump_json(jobs_listing(manager, config.server_base_url, filters), indent))
+    return 200, TextResponse(body, "application/json", headers)
+
+
+def jobs_listing(manager, base_url, filters):
+    page, total, next_cursor = manager.query_jobs(filters)
     jobs = {
         job_id: {
             "state": job.state,
-            "pid": job.process.pid,
+            "pid": job.pid,
             "exit_code": job.exit_code,
             "ts_started": job.ts_started,
             "ts_completed": job.ts_completed,
             "run-time": human_time(job.runtime),
-            "kill-link": f"{config.server_base_url}/jobs/kill?__job_id={job_id}",
-            "output-link": f"{config.server_base_url}/jobs/output?__job_id={job_id}",
+            "cpu-time": round(job.cpu_time, 2),
+            "rss": job.rss,
+            "peak-rss": job.peak_rss,
+            "io-read-bytes": job.io_read_bytes,
+            "io-write-bytes": job.io_write_bytes,
+            "queue-wait": round(job.queue_wait, 3) if job.queue_wait is not None else None,
+            "priority": job.priority,
+            "label": job.label,
+            "after": job.after,
+            "stdin_job": job.stdin_job,
+            "kill-link": f"{base_url}/jobs/kill?__job_id={job_id}",
+            "output-link": f"{base_url}/jobs/output?__job_id={job_id}",
+            "cursor": format_cursor(manager.index.cursor(job_id)),
         }
-        for job_id, job in config["manager"].running_jobs.items()
+        for job_id, job in page.items()
     }
-    rsp = {"count": len(jobs), "jobs": jobs}
-    return 200, rsp
+    return {"count": len(jobs), "total": total, "next_cursor": format_cursor(next_cursor), "jobs": jobs}
+
+
+def format_cursor(cursor):
+    return "{}_{}".format(*cursor) if cursor is not None else None
 
 
 def handle_kill_job(query, config):
+    """kill one or more jobs: `__job_id` (may be repeated), or all running and queued jobs by `__state`/`__label`"""
+    job_ids = query.params.get("__job_id") or None
+    state = query.get_param("__state", None)
+    label = query.get_param("__label", None)
+    if job_ids is None and state is None and label is None:
+        return 400, {"error": "__job_id, __state or __label is required"}
+    manager = config["manager"]
+    not_found = [job_id for job_id in job_ids or [] if job_id not in manager.jobs]
+    if job_ids and len(not_found) == len(job_ids):
+        return 404, {"error": f"job_id {', '.join(not_found)} not found"}
+    try:
+        killed = manager.kill_jobs(job_ids=job_ids, state=state, label=label)
+    except ValueError as e:
+        return 400, {"error": str(e)}
+    message = f"job_id {job_ids[0]} killed" if job_ids and len(job_ids) == 1 else f"{len(killed)} jobs killed"
+    rsp = {"message": message, "killed": killed}
+    if not_found:
+        rsp["not_found"] = not_found
+    return 200, rsp
+
+
+def parse_output_cursor(value):
+    """`<stdout seq>:<stderr seq>` (as returned in `cursor`) -> {stream name: seq}"""
+    if value is None:
+        return {}
+    stdout_seq, _, stderr_seq = value.partition(":")
+    cursor = {"stdout": int(stdout_seq), "stderr": int(stderr_seq or 0)}
+    if min(cursor.values()) < 0:
+        raise ValueError(f"invalid cursor: {value}")
+    return cursor
+
+
+OUTPUT_RANGE_MAX_BYTES = 1024 * 1024
+
+
+def handle_output_range(query, config):
     job_id = query.get_param("__job_id", None)
+    stream_name = query.get_param("stream", "stdout")
+    if stream_name not in Job.STREAMS:
+        return 400, {"error": f"unknown stream: {stream_name}"}
     try:
-        config["manager"][job_id].kill()
+        job = config["manager"][job_id]
+        offset = int(query.get_param("offset"))
+        length = min(int(query.get_param("length", OUTPUT_RANGE_MAX_BYTES)), OUTPUT_RANGE_MAX_BYTES)
+        data, offset, end = job.read_range(stream_name, offset, length)
     except KeyError:
         return 404, {"error": f"job_id {job_id} not found"}
     except Exception as e:
         return 400, {"error": str(e)}
-    return 200, {"message": f"job_id {job_id} killed"}
+    return 200, {
+        "job_id": job_id,
+        "job": str(job),
+        "stream": stream_name,
+        "offset": offset,
+        "length": len(data),
+        "end": end,
+        "data": data.decode(job.encoding, errors="ignore"),
+    }
 
 
 def handle_output_job(query, config):
+    if query.get_param("offset", None) is not None:
+        return handle_output_range(query, config)
     job_id = query.get_param("__job_id", None)
     try:
         job = config["manager"][job_id]
-        stdout = job.stdout
-        stderr = job.stderr
+        cursor = parse_output_cursor(query.get_param("cursor", None))
+        tail = query.get_param("tail", None)
+        tail = int(tail) if tail is not None else None
+        stdout, stdout_cursor, stdout_dropped = job.read_output("stdout", cursor.get("stdout"), tail)
+        stderr, stderr_cursor, stderr_dropped = job.read_output("stderr", cursor.get("stderr"), tail)
     except KeyError:
         return 404, {"error": f"job_id {job_id} not found"}
     except Exception as e:
@@ -78,13 +420,184 @@ def handle_output_job(query, config):
         "job": str(job),
         "stdout": stdout,
         "stderr": stderr,
+        "cursor": f"{stdout_cursor}:{stderr_cursor}",
+        "dropped": {"stdout": stdout_dropped, "stderr": stderr_dropped},
     }
 
 
+GREP_MATCHES_DEFAULT = 100
+GREP_MATCHES_MAX = 10_000
+GREP_CONTEXT_MAX = 20
+GREP_PATTERN_MAX = 1000
+GREP_TIMEOUT_DEFAULT = 2.0
+GREP_TIMEOUT_MAX = 10.0
+
+
+def parse_grep(query, encoding=Job.STREAM_ENCODING_DEFAULT):
+    """`/jobs/grep` parameters: (`Search`, the other ones), `ValueError` if one is invalid"""
+    pattern = query.get_param("pattern", None)
+    if not pattern:
+        raise ValueError("pattern is required")
+    if len(pattern) > GREP_PATTERN_MAX:
+        raise ValueError(f"pattern is longer than {GREP_PATTERN_MAX}")
+    stream_name = query.get_param("stream", "all")
+    if stream_name != "all" and stream_name not in Job.STREAMS:
+        raise ValueError(f"unknown stream: {stream_name}")
+    context = int(query.get_param("context", 0))
+    if not 0 <= context <= GREP_CONTEXT_MAX:
+        raise ValueError(f"context must be from 0 to {GREP_CONTEXT_MAX}")
+    max_matches = int(query.get_param("max_matches", GREP_MATCHES_DEFAULT))
+    if not 1 <= max_matches <= GREP_MATCHES_MAX:
+        raise ValueError(f"max_matches must be from 1 to {GREP_MATCHES_MAX}")
+    timeout = min(max(0.0, float(query.get_param("timeout", GREP_TIMEOUT_DEFAULT))), GREP_TIMEOUT_MAX)
+    try:
+        search = Search(
+            pattern.encode(encoding),
+            fixed=query.get_param("fixed", "") in ("1", "true"),
+            ignore_case=query.get_param("ignore_case", "") in ("1", "true"),
+            context=context,
+            deadline=time.monotonic() + timeout,
+        )
+    except re.error as e:
+        raise ValueError(f"invalid pattern: {e}") from e
+    return search, {
+        "streams": Job.STREAMS if stream_name == "all" else (stream_name,),
+        "max_matches": max_matches,
+        "offsets": parse_output_cursor(query.get_param("offset", None)),
+    }
+
+
+def handle_grep_jobs(query, config):
+    """
+    Lines of job output matching `pattern` (a regular expression, or a plain string with `fixed=1`;
+    `ignore_case=1`), with `context` lines around them, of `stream` (stdout, stderr, all by default):
+    of the `__job_id` jobs (may be repeated), or of a `/jobs/` page (`__state` -- any by default, `__label`, ...).
+    The buffered output (and the spool files) is copied a chunk at a time and searched, in job order,
+    until `max_matches` lines are found or the `timeout` seconds budget is spent (a regular expression runs
+    in a child process, killed then): then `complete` is false, and every job searched tells where to go on
+    from (`next_offset`, the end of its output if it was searched to the end),
+    for `offset=<stdout offset>:<stderr offset>` of the next search of it.
+    """
+    manager = config["manager"]
+    job_ids = query.params.get("__job_id") or None
+    jobs, next_cursor, not_found = {}, None, []
+    try:
+        search, options = parse_grep(query)
+        if job_ids is None:
+            jobs, _, next_cursor = manager.query_jobs(parse_list_filters(query, states=tuple(JobState)))
+    except ValueError as e:
+        return 400, {"error": str(e)}
+    for job_id in job_ids or []:
+        try:
+            jobs[job_id] = manager[job_id]
+        except KeyError:
+            not_found.append(job_id)
+    if job_ids and len(not_found) == len(job_ids):
+        return 404, {"error": f"job_id {', '.join(not_found)} not found"}
+    try:
+        results, pending, count, complete = grep_jobs(jobs, search, options)
+    except OSError as e:
+        return 500, {"error": str(e)}
+    finally:
+        search.close()
+    rsp = {"matches": count, "complete": complete and not pending, "jobs": results}
+    if pending:
+        rsp["pending"] = pending
+    if next_cursor is not None:
+        rsp["next_cursor"] = format_cursor(next_cursor)
+    if not_found:
+        rsp["not_found"] = not_found
+    return 200, rsp
+
+
+def grep_jobs(jobs, search, options):
+    """`/jobs/grep` of `jobs`: (results by job id, ids of the jobs not searched, matches count, all searched)"""
+    max_matches = options["max_matches"]
+    results, pending, count, complete = {}, list(jobs), 0, True
+    for job_id, job in jobs.items():
+        if count >= max_matches or search.expired:
+            complete = False
+            break
+        pending.remove(job_id)
+        result, next_offsets = {}, []
+        for stream_name in Job.STREAMS:
+            offset = options["offsets"].get(stream_name, 0)
+            if stream_name not in options["streams"]:
+                next_offsets.append(offset)
+                continue
+            found, offset, done = job.grep(stream_name, search, offset, max_matches - count)
+            count += len(found)
+            complete = complete and done
+            next_offsets.append(offset)
+            result[stream_name] = [
+                {"seq": seq, "offset": line_offset, "line": line, "before": before, "after": after}
+                for seq, line_offset, line, before, after in found
+            ]
+        results[job_id] = {"job": str(job), **result, "next_offset": "{}:{}".format(*next_offsets)}
+    return results, pending, count, complete
+
+
+def handle_stream_job(query, config):
+    job_id = query.get_param("__job_id", None)
+    try:
+        job = config["manager"][job_id]
+        cursor = parse_output_cursor(query.get_param("cursor", None))
+        tail = query.get_param("tail", None)
+        tail = int(tail) if tail is not None else None
+        max_lag = int(config.get("stream-max-lag", 0) or 0)
+    except KeyError:
+        return 404, {"error": f"job_id {job_id} not found"}
+    except Exception as e:
+        return 400, {"error": str(e)}
+    return 200, JobOutputStream(job_id, job, cursor=cursor, tail=tail, max_lag=max_lag)
+
+
+def handle_wait_jobs(query, config):
+    """long-poll until all (`mode=any`: any) of the `__job_id` jobs are done, or for `timeout` seconds"""
+    job_ids = query.params.get("__job_id") or []
+    if not job_ids:
+        return 400, {"error": "__job_id is required"}
+    manager = config["manager"]
+    jobs, not_found = {}, []
+    for job_id in job_ids:
+        try:
+            jobs[job_id] = manager[job_id]
+        except KeyError:
+            not_found.append(job_id)
+    if not_found:
+        return 404, {"error": "jobs not found", "not_found": not_found}
+    mode = query.get_param("mode", "all")
+    try:
+        timeout = min(max(0.0, float(query.get_param("timeout", WAIT_TIMEOUT_DEFAULT))), WAIT_TIMEOUT_MAX)
+    except ValueError as e:
+        return 400, {"error": str(e)}
+    if mode not in ("all", "any"):
+        return 400, {"error": f"invalid mode: {mode}"}
+    wait = JobWait(jobs, any_done=mode == "any", timeout=timeout)
+    if wait.done or not timeout:  # nothing to wait for: a plain response, no connection hand-over
+        return 200, wait.result()
+    return 200, wait
+
+
+def handle_metrics(query, config):
+    manager = config["manager"]
+    for state, count in manager.jobs_count_by_state.items():
+        JOBS.set(count, state)
+    STREAMS_BYTES.set(manager.streams_size)
+    return 200, TextResponse(metrics.render(), METRICS_CONTENT_TYPE)
+
+
 ROUTING_TABLE = [
+    (Query(method="POST", path="/jobs/run-batch"), handle_run_batch),
     (Query(method="GET", path="/jobs/run"), handle_run_job),
     (Query(method="GET", path="/jobs/kill"), handle_kill_job),
     (Query(method="GET", path="/jobs/output"), handle_output_job),
+    (Query(method="GET", path="/jobs/grep"), handle_grep_jobs),
+    (Query(method="GET", path="/jobs/stream"), handle_stream_job),
+    (Query(method="GET", path="/jobs/wait"), handle_wait_jobs),
     (Query(method="GET", path="/jobs/"), handle_list_jobs),
+    (Query(method="GET", path="/metrics"), handle_metrics),
     (Query(method=None, path="/ping"), handle_ping),
+    (Query(method="GET", path="/restart"), handle_restart),
 ]
+ROUTES = Router(ROUTING_TABLE)
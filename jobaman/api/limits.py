@@ -0,0 +1,150 @@
+"""
+Admission control in front of the handlers (see `handlers.admit`):
+token buckets per client -- the value of the `rate-limit-key-header` header if it is one of the API keys of
+`rate-limit-keys`, its address otherwise (a made up key is no new budget) -- with one budget for reads and
+another for the jobs submitted (`/jobs/run`, `/jobs/run-batch` costs one token per job), and load shedding:
+once more than `shed-backlog` requests wait for a server worker, new ones get a 503. Both answers carry
+`Retry-After`. The addresses of `rate-limit-exempt-addresses` (a router in front of this jobaman, which has
+limits of its own for its clients) are not limited.
+"""
+
+import collections
+import math
+import threading
+import time
+
+from jobaman import metrics
+
+REJECTED = metrics.Counter("jobaman_http_rejected_total", "requests rejected by admission control", ("reason",))
+
+
+def split_list(value):
+    """a comma or space separated config value -> list"""
+    return (value or "").replace(",", " ").split()
+
+
+class TokenBuckets:
+    """
+    token buckets by key, refilled at `rate` tokens per second up to `burst`;
+    the least recently used first, so idle ones (full again, nothing to remember) are dropped first,
+    and never more than `max_keys` of them
+    """
+
+    def __init__(self, rate, burst, max_keys):
+        self.rate = rate
+        self.burst = max(1.0, burst or rate)
+        self.max_keys = max_keys
+        self.idle = self.burst / rate  # seconds to refill an empty bucket
+        self.buckets = collections.OrderedDict()  # key -> (tokens, monotonic time of the last take)
+
+    def __repr__(self) -> str:
+        return f"TokenBuckets(rate={self.rate}, burst={self.burst}, keys={len(self.buckets)})"
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def take(self, key, cost=1, now=None):
+        """take `cost` tokens of the key's bucket, return 0 or the seconds until they are there (none taken)"""
+        now = time.monotonic() if now is None else now
+        tokens, ts = self.buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - ts) * self.rate)
+        cost = min(cost, self.burst)  # a batch larger than the burst goes once the bucket is full
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / self.rate
+        self.buckets[key] = (tokens, now)
+        while self.buckets:
+            _, (_, oldest) = next(iter(self.buckets.items()))
+            if len(self.buckets) <= self.max_keys and now - oldest < self.idle:
+                break
+            self.buckets.popitem(last=False)
+        return wait
+
+
+class Admission:
+
+    EXEMPT = ("/ping", "/metrics")  # health checks and scrapes are never limited
+    RUN_PATHS = ("/jobs/run", "/jobs/run-batch")
+    MAX_CLIENTS_DEFAULT = 10_000
+    RETRY_AFTER_MAX = 600
+    DURATION_WEIGHT = 0.05  # of the last request in the mean handling time
+
+    def __init__(self, config=None):
+        config = config or {}
+        self.lock = threading.Lock()
+        self.key_header = (config.get("rate_limit_key_header") or "").lower() or None
+        self.keys = set(split_list(config.get("rate_limit_keys")))
+        self.exempt_addresses = set(split_list(config.get("rate_limit_exempt_addresses")))
+        max_clients = int(config.get("rate_limit_max_clients", 0) or self.MAX_CLIENTS_DEFAULT)
+        self.buckets = {}  # "read" or "run" -> `TokenBuckets`
+        for name in ("read", "run"):
+            rate = float(config.get(f"rate_limit_{name}_rate", 0) or 0)
+            if rate > 0:
+                burst = float(config.get(f"rate_limit_{name}_burst", 0) or 0)
+                self.buckets[name] = TokenBuckets(rate, burst, max_clients)
+        self.workers = int(config.get("server_workers", 0) or 4)
+        self.shed_backlog = int(config.get("shed_backlog", 0) or 0)
+        self.in_flight = 0  # requests submitted to the server workers and not done yet
+        self.request_seconds = 0.0  # moving mean of the handling time
+
+    def __repr__(self) -> str:
+        return f"Admission(buckets={self.buckets}, in_flight={self.in_flight}, shed_backlog={self.shed_backlog})"
+
+    @property
+    def backlog(self):
+        """requests waiting for a server worker"""
+        return max(0, self.in_flight - self.workers)
+
+    def submitted(self):
+        """the servers call it as they pass a request to a server worker, and `done` once it is answered"""
+        with self.lock:
+            self.in_flight += 1
+
+    def done(self):
+        with self.lock:
+            self.in_flight = max(0, self.in_flight - 1)
+
+    def admit(self, query):
+        """`None` to handle the request, or (429 or 503, retry after seconds) to reject it"""
+        with self.lock:
+            if query.path in self.EXEMPT:
+                return None
+            backlog = self.backlog
+            if self.shed_backlog and backlog > self.shed_backlog:
+                REJECTED.inc("overload")
+                return 503, self.retry_after(backlog * self.request_seconds / self.workers)
+            name, cost = ("run", self.jobs_count(query)) if query.path in self.RUN_PATHS else ("read", 1)
+            buckets = self.buckets.get(name)
+            if buckets is None or (query.addr and query.addr[0] in self.exempt_addresses):
+                return None
+            wait = buckets.take(self.client_key(query), cost)
+            if not wait:
+                return None
+            REJECTED.inc(name)
+            return 429, self.retry_after(wait)
+
+    def handled(self, seconds):
+        with self.lock:
+            self.request_seconds += (seconds - self.request_seconds) * self.DURATION_WEIGHT
+
+    def client_key(self, query):
+        """the API key of the request if it is a known one, the address otherwise"""
+        if self.key_header is not None:
+            key = query.headers.get(self.key_header)
+            if key and key in self.keys:
+                return "key:" + key
+        return query.addr[0] if query.addr else ""
+
+    @staticmethod
+    def jobs_count(query):
+        if query.path != "/jobs/run-batch":
+            return 1
+        jobs = query.data.get("jobs") if isinstance(query.data, dict) else query.data
+        return max(1, len(jobs)) if isinstance(jobs, list) else 1
+
+    @classmethod
+    def retry_after(cls, seconds):
+        """whole seconds for `Retry-After`, at least 1"""
+        return min(cls.RETRY_AFTER_MAX, max(1, math.ceil(seconds)))
@@ -0,0 +1,132 @@
+"""
+Incremental HTTP/1.x request parser working on bytes.
+
+Socket data is received straight into one reusable buffer (`recv_into`) or copied into it (`feed`);
+the header is searched where the last search stopped, decoded once and checked against the size limits
+as soon as it is complete, the body is cut out by `Content-Length` when all of it has arrived.
+Pipelined requests stay in the buffer for the next `next_request()` call.
+"""
+
+from dataclasses import dataclass, field
+
+MAX_REQUEST_HEADER_SIZE = 16 * 1024  # 16 KB
+MAX_REQUEST_BODY_SIZE = 1024 * 1024  # 1 MB
+RECV_SIZE = 64 * 1024
+HEADER_END = b"\r\n\r\n"
+
+
+class RequestError(Exception):
+    """a request that can not be served, `code` is the HTTP status to respond with"""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+@dataclass
+class Request:
+
+    method: str
+    target: str
+    version: str
+    headers: dict = field(default_factory=dict)
+    body: bytes = b""
+
+    @property
+    def keep_alive(self) -> bool:
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+
+class RequestParser:
+
+    def __init__(self, max_header_size=MAX_REQUEST_HEADER_SIZE, max_body_size=MAX_REQUEST_BODY_SIZE):
+        self.max_header_size = max_header_size
+        self.max_body_size = max_body_size
+        self.buffer = bytearray(RECV_SIZE)
+        self.start = 0  # first byte of the current request
+        self.end = 0  # end of the received data
+        self.scanned = 0  # the header end is searched from here
+        self.head = None  # (request without its body, body size) once the header is parsed
+
+    def __repr__(self) -> str:
+        return f"RequestParser(buffered={self.end - self.start}, size={len(self.buffer)})"
+
+    def recv_into(self, sock, size=RECV_SIZE):
+        """receive up to `size` bytes from `sock` into the buffer, the number of bytes received (0: closed)"""
+        self._reserve(size)
+        with memoryview(self.buffer) as view:
+            received = sock.recv_into(view[self.end :], size)
+        self.end += received
+        return received
+
+    def feed(self, data):
+        size = len(data)
+        self._reserve(size)
+        self.buffer[self.end : self.end + size] = data
+        self.end += size
+
+    def next_request(self):
+        """the next complete request, `None` if more data is needed, `RequestError` if it is invalid or too large"""
+        if self.head is None:
+            header_end = self.buffer.find(HEADER_END, max(self.scanned, self.start), self.end)
+            if header_end < 0:
+                self.scanned = max(self.start, self.end - len(HEADER_END) + 1)
+                if self.end - self.start > self.max_header_size:
+                    raise RequestError(431, "request header too large")
+                return None
+            if header_end - self.start > self.max_header_size:
+                raise RequestError(431, "request header too large")
+            self.head = self._parse_head(self.buffer[self.start : header_end].decode("latin-1"))
+            self.start = header_end + len(HEADER_END)
+        request, body_size = self.head
+        if self.end - self.start < body_size:
+            return None
+        if body_size:
+            with memoryview(self.buffer) as view:
+                request.body = bytes(view[self.start : self.start + body_size])
+        self.start += body_size
+        self.scanned = self.start
+        self.head = None
+        if self.start == self.end:
+            self.start = self.end = self.scanned = 0
+            if len(self.buffer) > RECV_SIZE:  # do not keep the memory of a large body
+                self.buffer = bytearray(RECV_SIZE)
+        return request
+
+    def _parse_head(self, header):
+        request_line, _, fields = header.partition("\r\n")
+        try:
+            method, target, version = request_line.split(" ")
+        except ValueError:
+            raise RequestError(400, "invalid request line") from None
+        if not version.startswith("HTTP/"):
+            raise RequestError(400, "invalid request line")
+        headers = {}
+        for line in fields.split("\r\n") if fields else ():
+            name, sep, value = line.partition(":")
+            if not sep:
+                raise RequestError(400, "invalid header line")
+            headers[name.strip().lower()] = value.strip()
+        if "transfer-encoding" in headers:
+            raise RequestError(501, "transfer-encoding is not supported")
+        body_size = headers.get("content-length", "0")
+        if not body_size.isdigit():
+            raise RequestError(400, "invalid content-length")
+        body_size = int(body_size)
+        if body_size > self.max_body_size:
+            raise RequestError(413, "request body too large")
+        return Request(method=method.upper(), target=target, version=version, headers=headers), body_size
+
+    def _reserve(self, size):
+        """make room for `size` more bytes after the received data, moving or growing the buffer if needed"""
+        if len(self.buffer) - self.end < size:
+            pending = self.end - self.start
+            if self.start:
+                self.buffer[:pending] = self.buffer[self.start : self.end]
+                self.scanned -= self.start
+                self.start, self.end = 0, pending
+            if len(self.buffer) - self.end < size:
+                self.buffer.extend(bytes(max(size, len(self.buffer))))
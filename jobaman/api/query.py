@@ -14,40 +14,34 @@ class Query:
     data: dict | None = None
 
     @classmethod
-    def parse_http_request(cls, request: str, addr=None) -> "Query":
-
-        header, _, body = request.partition("\r\n\r\n")
-        lines = header.split("\r\n")
-        command = lines[0] if lines else ""
-        headers = {}
-        for line in lines[1:]:
-            if ":" in line:
-                key, value = line.split(":", 1)
-                headers[key.strip().lower()] = value.strip()
-
-        method, path, params = cls.parse_http_command(command)
-
-        data = json.loads(body) if body else None
-
+    def from_request(cls, request, addr=None) -> "Query":
+        path, params = cls.parse_target(request.target)
         return cls(
             addr=addr,
-            method=method,
+            method=request.method,
             path=path,
             params=params,
-            headers=headers,
-            data=data,
+            headers=request.headers,
+            data=json.loads(request.body) if request.body else None,
         )
 
     @staticmethod
     def parse_http_command(command: str) -> tuple[str, str, dict]:
         parts = command.split()
         method = parts[0].upper()
-        uri = parts[1]
-        urlp = urlparse.urlparse(uri)
-        path = urlp.path
-        qs = urlparse.parse_qs(urlp.query, keep_blank_values=True, strict_parsing=True)
+        path, qs = Query.parse_target(parts[1])
         return method, path, qs
 
+    @staticmethod
+    def parse_target(target: str) -> tuple[str, dict]:
+        path, _, query = target.partition("?")
+        path = path.partition("#")[0]
+        if not path.startswith("/"):  # absolute-form, `http://host/path`
+            path = urlparse.urlsplit(path).path
+        query = query.partition("#")[0]
+        qs = urlparse.parse_qs(query, keep_blank_values=True, strict_parsing=True) if query else {}
+        return path, qs
+
     def params_to_args(self) -> list[str]:
 
         if not self.params:
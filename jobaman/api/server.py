@@ -1,70 +1,143 @@
-import json
+import selectors
 import socket
 from concurrent.futures import ThreadPoolExecutor
 
+from jobaman.handoff import systemd_socket
 from jobaman.logger import get_logger
 
-from .handlers import handle
+from .handlers import TextResponse, dump_json, handle
+from .parser import RequestError, RequestParser
 from .query import Query
+from .streaming import AsyncResponse, Streamer
 
 log = get_logger(__name__)
 
-MAX_REQUEST_BODY_SIZE = 16 * 1024  # 16 KB
+LISTEN_BACKLOG = 1024
 RESPONSE_400 = b"HTTP/1.1 400\r\nConnection: close\r\n\r\n"
 RESPONSE_500 = b"HTTP/1.1 500\r\nConnection: close\r\n\r\n"
 RESPONSE_200 = (
     "HTTP/1.1 {}\r\n"
-    "Connection: close\r\n"
+    "Connection: {}\r\n"
     "Content-Length: {}\r\n"
-    "Content-Type: application/json\r\n"
+    "Content-Type: {}\r\n"
+    "{}"
     "Access-Control-Allow-Origin: *\r\n"
     "\r\n"
 )
 
 
-def try_handle_client(conn, addr, config):
+def try_handle_client(conn, addr, config, streamer, admission=None):
+    handed_over = False
     try:
-        handle_client(conn, addr, config)
+        handed_over = handle_client(conn, addr, config, streamer)
+    except RequestError as e:
+        log.error("bad request from [%s:%s]: %s", *addr, e)
+        conn.sendall(render_response(e.code, {"error": str(e)}, indent=config.json_indent))
+    except ValueError as e:
+        log.error("bad request from [%s:%s]: %s", *addr, e)
+        conn.sendall(RESPONSE_400)
     except Exception as e:
         log.error("failed to handle request from [%s:%s]: %s", *addr, e)
         conn.sendall(RESPONSE_500)
     finally:
-        conn.close()
+        if not handed_over:
+            conn.close()
+        if admission is not None:
+            admission.done()
 
 
-def handle_client(conn, addr, config):
+def handle_client(conn, addr, config, streamer):
+    """handle one request, return `True` if the connection was handed over to the streamer"""
 
-    request = conn.recv(MAX_REQUEST_BODY_SIZE).decode("utf-8", errors="ignore")
-    query = Query.parse_http_request(request, addr)
+    request = recv_request(conn)
+    if request is None:
+        return False
+    query = Query.from_request(request, addr)
 
     rsp_code, rsp_data = handle(query, config)
-    rsp_json = json.dumps(rsp_data, indent=1, ensure_ascii=False).encode("utf-8")
-    rsp_json_len = len(rsp_json)
+    log.info("[%s:%s] %s %s - %s", *addr, query.method, query.path, rsp_code)
 
-    conn.sendall(RESPONSE_200.format(rsp_code, rsp_json_len).encode())
-    conn.sendall(rsp_json)
+    if isinstance(rsp_data, AsyncResponse):
+        streamer.submit(conn, addr, rsp_data)
+        return True
 
-    log.info("[%s:%s] %s %s - %s", *addr, query.method, query.path, rsp_code)
+    conn.sendall(render_response(rsp_code, rsp_data, indent=config.json_indent))
+    return False
 
 
-def run_server(config):
+def recv_request(conn):
+    """read one request, `None` if the client has gone before sending all of it"""
+    parser = RequestParser()
+    while (request := parser.next_request()) is None:
+        if not parser.recv_into(conn):
+            return None
+    return request
+
+
+def render_response(rsp_code, rsp_data, keep_alive=False, indent=1):
+    headers = ""
+    if isinstance(rsp_data, TextResponse):
+        body, content_type = rsp_data.body, rsp_data.content_type
+        body = body.encode("utf-8") if isinstance(body, str) else body
+        headers = "".join(f"{name}: {value}\r\n" for name, value in rsp_data.headers.items())
+    else:
+        body, content_type = dump_json(rsp_data, indent), "application/json"
+    connection = "keep-alive" if keep_alive else "close"
+    return RESPONSE_200.format(rsp_code, connection, len(body), content_type, headers).encode() + body
+
 
+def server_params(config):
     max_workers = int(config.get("server-workers", 4))
     host = config.get("server-listen-host", "127.0.0.1")
     port = int(config.get("server-listen-port", 1954))
-    listen_to = (host, port)
     config.server_base_url = config.get("server-base-url", f"http://{host}:{port}")
+    config.json_indent = int(config.get("server-json-indent", 1) or 0) or None
+    return host, port, max_workers
+
+
+def listen_socket(config, host, port):
+    """
+    the listening socket: handed over by the previous jobaman (see `jobaman.handoff`),
+    passed by systemd (`LISTEN_FDS`), or a new one; it outlives the servers, which return on a restart
+    """
+    server = config.get("server_socket") or systemd_socket()
+    if server is None:
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((host, port))
+        server.listen(LISTEN_BACKLOG)
+    config["server_socket"] = server
+    return server
 
-    with (
-        socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server,
-        ThreadPoolExecutor(max_workers=max_workers) as executor,
-    ):
 
-        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server.bind(listen_to)
-        server.listen()
+def run_server(config):
+    """accept loop, returns when a restart stops it (see `jobaman.handoff`) once the requests in progress are done"""
+
+    host, port, max_workers = server_params(config)
+    server = listen_socket(config, host, port)
+    handoff = config.get("handoff")
+    admission = config.get("admission")  # see `limits`
+    streamer = config.get("streamer") or Streamer()  # one for the process: the server runs again after a failed restart
+    config["streamer"] = streamer
+
+    with selectors.DefaultSelector() as selector, ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        server.setblocking(False)
+        selector.register(server, selectors.EVENT_READ)
+        if handoff is not None:
+            selector.register(handoff.stop_fd, selectors.EVENT_READ)
         log.info("server started on %s:%d", host, port)
 
         while True:
-            conn, addr = server.accept()
-            executor.submit(try_handle_client, conn, addr, config)
+            if any(key.fileobj is not server for key, _ in selector.select()):
+                break  # restarting: the new jobaman accepts from now on
+            while True:
+                try:
+                    conn, addr = server.accept()
+                except BlockingIOError:
+                    break
+                if admission is not None:
+                    admission.submitted()
+                executor.submit(try_handle_client, conn, addr, config, streamer, admission)
+
+    log.info("server stopped")
@@ -0,0 +1,495 @@
+"""
+HTTP handlers of the router mode (`router-backends` is set): requests are forwarded to the backends
+of `config["router"]` (a `ShardRouter`), job requests to the shard owning the job id,
+listings, bulk kills and searches to all of them; streams and long-polls are copied from the backend
+by the event loop, as any `AsyncResponse`.
+"""
+
+import asyncio
+import functools
+import heapq
+import itertools
+import json
+import os
+import time
+import urllib.parse
+from http import HTTPStatus
+
+from jobaman import metrics
+
+from .handlers import (
+    BATCH_MAX_JOBS,
+    GREP_MATCHES_DEFAULT,
+    LIST_LIMIT_DEFAULT,
+    LIST_LIMIT_MAX,
+    METRICS_CONTENT_TYPE,
+    WAIT_TIMEOUT_DEFAULT,
+    WAIT_TIMEOUT_MAX,
+    Router,
+    TextResponse,
+    dump_json,
+    handle_restart,
+)
+from .query import Query
+from .shards import ShardError
+from .streaming import WAITING_STATES, AsyncResponse
+
+BACKEND_UP = metrics.Gauge("jobaman_router_backend_up", "1 if the backend passes health checks", ("backend",))
+BACKEND_JOBS = metrics.Gauge("jobaman_router_backend_jobs", "running and queued jobs of the backend", ("backend",))
+RESPONSE_JSON = "HTTP/1.1 {}\r\nConnection: close\r\nContent-Length: {}\r\nContent-Type: application/json\r\n\r\n"
+
+
+def forwarding(handler):
+    """a backend that can not be reached is a 503"""
+
+    @functools.wraps(handler)
+    def wrapper(query, config):
+        try:
+            return handler(query, config)
+        except ShardError as e:
+            return 503, {"error": str(e)}
+
+    return wrapper
+
+
+def backend_target(path, params, overrides=None):
+    """request target for a backend: the client's query parameters with `overrides` (`None` removes one)"""
+    params = dict(params)
+    for key, value in (overrides or {}).items():
+        if value is None:
+            params.pop(key, None)
+        else:
+            params[key] = value if isinstance(value, list) else [str(value)]
+    query_string = urllib.parse.urlencode(params, doseq=True)
+    return f"{path}?{query_string}" if query_string else path
+
+
+def backend_request(shard, target):
+    return (
+        f"GET {target} HTTP/1.1\r\n"
+        f"Host: {shard.host}:{shard.port}\r\n"
+        "Connection: close\r\n"
+        "\r\n"
+    ).encode("latin-1")
+
+
+def handle_ping(query, config):
+    router = config["router"]
+    backends = {
+        shard.base_url: {
+            "healthy": shard.healthy,
+            "running": shard.running,
+            "queued": shard.queued,
+            "max_jobs": shard.max_jobs,
+        }
+        for shard in router.shards
+    }
+    return 200, {"message": "pong", "ts": int(time.time()), "pid": os.getpid(), "backends": backends}
+
+
+@forwarding
+def handle_run_job(query, config):
+    """run on the least loaded (or the job id owning) shard, on the next one if it is full; on the shard of its
+    dependencies if it has `__after` or `__stdin`"""
+    router = config["router"]
+    job_id = query.get_param("__job_id", None)
+    near = next(iter(query.params.get("__after", []) + query.params.get("__stdin", [])), None)
+    tried, last = [], None
+    while True:
+        try:
+            shard, real_job_id = router.place(job_id, exclude=tried, near=near)
+        except ShardError:
+            if last is not None:
+                return last
+            raise
+        status, rsp = shard.request_json("GET", backend_target("/jobs/run", query.params, {"__job_id": real_job_id}))
+        if status == HTTPStatus.OK:
+            shard.update_load(rsp)
+            return 200, {**rsp, "backend": shard.base_url}
+        if job_id is not None or near is not None or "limit reached" not in str(rsp.get("error")):
+            return status, rsp
+        shard.running = max(shard.running, shard.max_jobs)
+        tried.append(shard)
+        last = status, rsp
+
+
+@forwarding
+def handle_run_batch(query, config):
+    """
+    the batch split by shard and submitted to all of them at once; the result is per job, as for one backend,
+    but the batch is all-or-nothing per backend only: one backend may take its part while another one rejects
+    its own (e.g. it is full), `partial` is true then
+    """
+    jobs = query.data.get("jobs") if isinstance(query.data, dict) else query.data
+    if not isinstance(jobs, list) or not jobs:
+        return 400, {"error": "a list of jobs expected"}
+    if len(jobs) > BATCH_MAX_JOBS:
+        return 400, {"error": f"too many jobs in batch (max {BATCH_MAX_JOBS})"}
+    if not all(isinstance(item, dict) for item in jobs):
+        return 400, {"error": "a job must be an object"}
+    router = config["router"]
+    job_ids, errors, batches = [None] * len(jobs), {}, {}
+    placed = {}  # position -> job id: positions in `after` and `stdin` are per backend batch, ids are not
+
+    def resolve(ref):
+        if not isinstance(ref, int):
+            return ref
+        if ref not in placed:
+            raise ShardError(f"job at position {ref} of the batch is not placed")
+        return placed[ref]
+
+    for i, item in enumerate(jobs):
+        try:
+            after = [resolve(ref) for ref in item.get("after") or []]
+            stdin = resolve(item["stdin"]) if item.get("stdin") is not None else None
+            near = next((ref for ref in [*after, stdin] if ref is not None), None)
+            shard, job_id = router.place(item.get("job_id") or None, near=near)
+        except ShardError as e:
+            errors[str(i)] = str(e)
+            continue
+        placed[i] = job_id
+        batches.setdefault(shard, []).append((i, {**item, "job_id": job_id, "after": after, "stdin": stdin}))
+
+    def submit(shard):
+        return shard.request_json("POST", "/jobs/run-batch", body=json.dumps([item for _, item in batches[shard]]))
+
+    for shard, result in router.map(submit, list(batches)):
+        positions = [i for i, _ in batches[shard]]
+        if isinstance(result, ShardError) or result[0] != HTTPStatus.OK:
+            error = str(result) if isinstance(result, ShardError) else result[1].get("error")
+            errors.update((str(i), error) for i in positions)
+            continue
+        rsp = result[1]
+        shard.update_load(rsp)
+        for i, job_id in zip(positions, rsp["job_ids"], strict=True):
+            job_ids[i] = job_id
+        errors.update((str(positions[int(k)]), error) for k, error in rsp.get("errors", {}).items())
+    rsp = {"job_ids": job_ids, "errors": dict(sorted(errors.items(), key=lambda item: int(item[0])))}
+    if errors and any(job_ids):  # a backend took its part, another one did not
+        rsp["partial"] = True
+    return 200, rsp
+
+
+@forwarding
+def handle_kill_job(query, config):
+    """`__job_id` jobs killed on their shards, `__state`/`__label` ones on every shard"""
+    router = config["router"]
+    job_ids = query.params.get("__job_id") or None
+    if job_ids is None and query.get_param("__state") is None and query.get_param("__label") is None:
+        return 400, {"error": "__job_id, __state or __label is required"}
+    if job_ids is None:
+        targets = {shard: query.params for shard in router.healthy_shards}
+    else:
+        targets = {}
+        for job_id in job_ids:
+            targets.setdefault(router.owner(job_id), {**query.params, "__job_id": []})["__job_id"].append(job_id)
+    killed, not_found = [], []
+    results = router.map(lambda shard: shard.request_json("GET", backend_target("/jobs/kill", targets[shard])), targets)
+    for shard, result in results:
+        if isinstance(result, ShardError):
+            raise result
+        status, rsp = result
+        if status == HTTPStatus.NOT_FOUND:
+            not_found.extend(targets[shard]["__job_id"])
+        elif status != HTTPStatus.OK:
+            return status, rsp
+        else:
+            killed.extend(rsp.get("killed", []))
+            not_found.extend(rsp.get("not_found", []))
+    if job_ids and len(not_found) == len(job_ids):
+        return 404, {"error": f"job_id {', '.join(not_found)} not found"}
+    message = f"job_id {job_ids[0]} killed" if job_ids and len(job_ids) == 1 else f"{len(killed)} jobs killed"
+    rsp = {"message": message, "killed": killed}
+    if not_found:
+        rsp["not_found"] = not_found
+    return 200, rsp
+
+
+@forwarding
+def handle_output_job(query, config):
+    job_id = query.get_param("__job_id", None)
+    if job_id is None:
+        return 400, {"error": "__job_id is required"}
+    _, (status, content_type, body) = config["router"].request_by_id(
+        job_id, "GET", backend_target("/jobs/output", query.params)
+    )
+    return status, TextResponse(body, content_type)
+
+
+@forwarding
+def handle_grep_jobs(query, config):
+    """
+    `/jobs/grep` of the `__job_id` jobs on their shards, of the selected jobs on every shard (the page of each
+    of them, no `next_cursor`); `max_matches` stays the limit of the merged result
+    """
+    router = config["router"]
+    job_ids = query.params.get("__job_id") or None
+    try:
+        max_matches = int(query.get_param("max_matches", GREP_MATCHES_DEFAULT))
+    except ValueError as e:
+        return 400, {"error": str(e)}
+    if job_ids is None:
+        targets = {shard: query.params for shard in router.healthy_shards}
+    else:
+        targets = {}
+        for job_id in job_ids:
+            targets.setdefault(router.owner(job_id), {**query.params, "__job_id": []})["__job_id"].append(job_id)
+    results = router.map(lambda shard: shard.request_json("GET", backend_target("/jobs/grep", targets[shard])), targets)
+    return merge_grep(results, targets, job_ids, max_matches)
+
+
+def merge_grep(results, targets, job_ids, max_matches):
+    """one `/jobs/grep` response of the shards' ones, the jobs past `max_matches` matches are left pending"""
+    jobs, pending, not_found, count, complete = {}, [], [], 0, True
+    for shard, result in results:
+        if isinstance(result, ShardError):
+            raise result
+        status, rsp = result
+        if status == HTTPStatus.NOT_FOUND:
+            not_found.extend(targets[shard]["__job_id"])
+            continue
+        if status != HTTPStatus.OK:
+            return status, rsp
+        for job_id, job in rsp["jobs"].items():
+            matches = sum(len(job.get(stream_name, [])) for stream_name in ("stdout", "stderr"))
+            if count + matches > max_matches:
+                pending.append(job_id)
+                continue
+            count += matches
+            jobs[job_id] = {**job, "backend": shard.base_url}
+        complete = complete and rsp["complete"]
+        pending.extend(rsp.get("pending", []))
+        not_found.extend(rsp.get("not_found", []))
+    if job_ids and len(not_found) == len(job_ids):
+        return 404, {"error": f"job_id {', '.join(not_found)} not found"}
+    rsp = {"matches": count, "complete": complete and not pending, "jobs": jobs}
+    if pending:
+        rsp["pending"] = pending
+    if not_found:
+        rsp["not_found"] = not_found
+    return 200, rsp
+
+
+@forwarding
+def handle_stream_job(query, config):
+    job_id = query.get_param("__job_id", None)
+    if job_id is None:
+        return 400, {"error": "__job_id is required"}
+    return 200, BackendResponse(config["router"].owner(job_id), backend_target("/jobs/stream", query.params))
+
+
+@forwarding
+def handle_wait_jobs(query, config):
+    """jobs of one shard: that backend's long-poll; jobs of several shards: the long-polls of all of them"""
+    job_ids = query.params.get("__job_id") or []
+    if not job_ids:
+        return 400, {"error": "__job_id is required"}
+    mode = query.get_param("mode", "all")
+    if mode not in ("all", "any"):
+        return 400, {"error": f"invalid mode: {mode}"}
+    try:
+        timeout = min(max(0.0, float(query.get_param("timeout", WAIT_TIMEOUT_DEFAULT))), WAIT_TIMEOUT_MAX)
+    except ValueError as e:
+        return 400, {"error": str(e)}
+    router = config["router"]
+    groups = {}
+    for job_id in job_ids:
+        groups.setdefault(router.owner(job_id), []).append(job_id)
+    if len(groups) == 1:
+        shard = next(iter(groups))
+        return 200, BackendResponse(shard, backend_target("/jobs/wait", query.params))
+    return 200, ShardsWait(groups, any_done=mode == "any", timeout=timeout)
+
+
+def parse_shards_cursor(value, shards):
+    """`<shard>:<its cursor>,...` -> {shard: cursor or `None`}, shards missing from it have no more jobs"""
+    cursors = {}
+    for item in value.split(","):
+        index, _, cursor = item.partition(":")
+        cursors[shards[int(index)]] = cursor or None
+    return cursors
+
+
+@forwarding
+def handle_list_jobs(query, config):
+    """
+    a page of `/jobs/` merged from all shards by start time: every shard is asked for a page after its own cursor,
+    the next page cursor is made of the cursors of the last jobs taken from every shard
+    """
+    router = config["router"]
+    try:
+        limit = int(query.get_param("__limit", LIST_LIMIT_DEFAULT))
+        if not 1 <= limit <= LIST_LIMIT_MAX:
+            raise ValueError(f"limit must be from 1 to {LIST_LIMIT_MAX}")
+        cursor = query.get_param("__cursor") or None
+        cursors = parse_shards_cursor(cursor, router.shards) if cursor else dict.fromkeys(router.shards)
+    except (ValueError, IndexError) as e:
+        return 400, {"error": str(e)}
+    descending = query.get_param("__sort", "started") == "-started"
+
+    def fetch(shard):
+        overrides = {"__cursor": cursors[shard], "__limit": limit}
+        return shard.request_json("GET", backend_target("/jobs/", query.params, overrides))
+
+    pages, total, unavailable = {}, 0, []
+    for shard, result in router.map(fetch, [shard for shard in cursors if shard.healthy]):
+        if isinstance(result, ShardError):
+            continue
+        status, rsp = result
+        if status != HTTPStatus.OK:
+            return status, rsp
+        total += rsp["total"]
+        pages[shard] = (list(rsp["jobs"].items()), rsp["next_cursor"])
+    unavailable = [shard for shard in cursors if shard not in pages]
+
+    def entries(shard, items):
+        for pos, (job_id, job) in enumerate(items):
+            ts = int(job["cursor"].partition("_")[0])
+            yield (ts, shard.index, -pos if descending else pos), shard, job_id, job
+
+    merged = heapq.merge(*(entries(shard, items) for shard, (items, _) in pages.items()), reverse=descending)
+    taken = list(itertools.islice(merged, limit))
+
+    next_cursors, more = {shard: cursors[shard] for shard in unavailable}, False  # kept for when they are back
+    for shard, (items, next_cursor) in pages.items():
+        jobs = [job for _, owner, _, job in taken if owner is shard]
+        next_cursors[shard] = jobs[-1]["cursor"] if jobs else cursors[shard]
+        more = more or len(jobs) < len(items) or next_cursor is not None
+    base_url = config.server_base_url
+    jobs = {
+        job_id: {
+            **job,
+            "backend": shard.base_url,
+            "kill-link": f"{base_url}/jobs/kill?__job_id={job_id}",
+            "output-link": f"{base_url}/jobs/output?__job_id={job_id}",
+        }
+        for _, shard, job_id, job in taken
+    }
+    next_cursor = ",".join(f"{shard.index}:{cursor or ''}" for shard, cursor in next_cursors.items()) if more else None
+    rsp = {"count": len(jobs), "total": total, "next_cursor": next_cursor, "jobs": jobs}
+    if unavailable:
+        rsp["unavailable"] = [shard.base_url for shard in unavailable]
+    return 200, rsp
+
+
+def handle_metrics(query, config):
+    for shard in config["router"].shards:
+        BACKEND_UP.set(int(shard.healthy), shard.base_url)
+        BACKEND_JOBS.set(shard.running + shard.queued, shard.base_url)
+    return 200, TextResponse(metrics.render(), METRICS_CONTENT_TYPE)
+
+
+class BackendResponse(AsyncResponse):
+    """the backend's response to a GET (a stream, a long-poll) copied to the client as it comes"""
+
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, shard, target):
+        self.shard = shard
+        self.target = target
+
+    def __repr__(self) -> str:
+        return f"BackendResponse(backend={self.shard.base_url}, target={self.target})"
+
+    async def serve(self, writer):
+        try:
+            reader, backend = await asyncio.open_connection(self.shard.host, self.shard.port)
+        except OSError as e:
+            self.shard.set_healthy(False, e)
+            body = dump_json({"error": f"backend {self.shard.base_url} failed: {e}"}, None)
+            writer.write(RESPONSE_JSON.format(503, len(body)).encode() + body)
+            await writer.drain()
+            return
+        try:
+            backend.write(backend_request(self.shard, self.target))
+            while data := await reader.read(self.READ_SIZE):
+                writer.write(data)
+                await writer.drain()
+        finally:
+            backend.close()
+
+
+class ShardsWait(AsyncResponse):
+    """
+    `/jobs/wait` for jobs on several shards: every shard long-polls for its jobs (with the same `mode`),
+    for `any_done` the first shard done ends the wait and the other ones are only asked for the job states
+    """
+
+    def __init__(self, groups, any_done=False, timeout=30):
+        self.groups = groups  # shard -> [job_id]
+        self.any_done = any_done
+        self.timeout = timeout
+
+    def __repr__(self) -> str:
+        return f"ShardsWait(shards={len(self.groups)}, any_done={self.any_done}, timeout={self.timeout})"
+
+    async def wait(self, shard, timeout):
+        """(status, response) of the shard's `/jobs/wait`"""
+        params = {"__job_id": self.groups[shard], "mode": ["any" if self.any_done else "all"]}
+        try:
+            reader, backend = await asyncio.open_connection(shard.host, shard.port)
+        except OSError as e:
+            shard.set_healthy(False, e)
+            return 503, {"error": f"backend {shard.base_url} failed: {e}"}
+        try:
+            backend.write(backend_request(shard, backend_target("/jobs/wait", params, {"timeout": timeout})))
+            data = await reader.read()
+        finally:
+            backend.close()
+        header, _, body = data.partition(b"\r\n\r\n")
+        status_line = header.partition(b"\r\n")[0]
+        return int(status_line.split(b" ")[1]), json.loads(body) if body else {}
+
+    async def results(self):
+        shards = list(self.groups)
+        if not self.any_done:
+            shard_results = await asyncio.gather(*(self.wait(shard, self.timeout) for shard in shards))
+            return dict(zip(shards, shard_results, strict=True))
+        waits = {asyncio.create_task(self.wait(shard, self.timeout)): shard for shard in shards}
+        results, pending = {}, set(waits)
+        try:
+            while pending and not any(status == HTTPStatus.OK and rsp["done"] for status, rsp in results.values()):
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                results.update((waits[wait], wait.result()) for wait in done)
+        finally:
+            for wait in pending:
+                wait.cancel()
+        late = [waits[wait] for wait in pending]
+        late_results = await asyncio.gather(*(self.wait(shard, 0) for shard in late))
+        results.update(zip(late, late_results, strict=True))
+        return results
+
+    async def serve(self, writer):
+        results = await self.results()
+        code, rsp, jobs, not_found = 200, None, {}, []
+        for shard, (status, result) in results.items():
+            if status == HTTPStatus.NOT_FOUND:
+                not_found.extend(result.get("not_found", self.groups[shard]))
+            elif status != HTTPStatus.OK:
+                code, rsp = status, result
+            else:
+                jobs.update(result["jobs"])
+        if rsp is None and not_found:
+            code, rsp = 404, {"error": "jobs not found", "not_found": not_found}
+        elif rsp is None:
+            finished = [job["state"] not in WAITING_STATES for job in jobs.values()]
+            rsp = {"done": any(finished) if self.any_done else all(finished), "jobs": jobs}
+        body = dump_json(rsp, None)
+        writer.write(RESPONSE_JSON.format(code, len(body)).encode() + body)
+        await writer.drain()
+
+
+SHARD_ROUTING_TABLE = [
+    (Query(method="POST", path="/jobs/run-batch"), handle_run_batch),
+    (Query(method="GET", path="/jobs/run"), handle_run_job),
+    (Query(method="GET", path="/jobs/kill"), handle_kill_job),
+    (Query(method="GET", path="/jobs/output"), handle_output_job),
+    (Query(method="GET", path="/jobs/grep"), handle_grep_jobs),
+    (Query(method="GET", path="/jobs/stream"), handle_stream_job),
+    (Query(method="GET", path="/jobs/wait"), handle_wait_jobs),
+    (Query(method="GET", path="/jobs/"), handle_list_jobs),
+    (Query(method="GET", path="/metrics"), handle_metrics),
+    (Query(method=None, path="/ping"), handle_ping),
+    (Query(method="GET", path="/restart"), handle_restart),
+]
+SHARD_ROUTES = Router(SHARD_ROUTING_TABLE)
@@ -0,0 +1,296 @@
+"""
+Router mode: one jobaman in front of N jobaman backends (shards), see `shard_handlers`.
+
+New jobs go to the least loaded healthy shard (`router-placement = least-loaded`), their job ids get
+the shard number as a prefix (`s<n>-<uuid>`), so requests for a job are routed by its id alone;
+jobs submitted with their own `__job_id` (and all jobs with `router-placement = hash`) are placed
+by consistent hashing of the job id. Backends are pinged every `router-health-interval` seconds,
+failed requests mark a backend down too; jobs are not placed on shards that are down.
+"""
+
+import bisect
+import hashlib
+import http.client
+import json
+import re
+import threading
+import urllib.parse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+from jobaman.logger import get_logger
+
+log = get_logger(__name__)
+
+SHARD_JOB_ID_RE = re.compile(r"^s(\d+)-[0-9a-f]{32}$")
+
+
+class ShardError(Exception):
+    pass
+
+
+class ConnectionPool:
+    """keep-alive HTTP connections to one backend, a connection is reused if its last response allows it"""
+
+    def __init__(self, host, port, size=8, timeout=10):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.idle = []
+
+    def __repr__(self) -> str:
+        return f"ConnectionPool({self.host}:{self.port}, idle={len(self.idle)})"
+
+    def request(self, method, target, body=None):
+        """
+        (status, content type, body), `OSError` or `HTTPException` if the backend can not be reached;
+        a request is sent again on the next connection only if a reused one turns out to be closed by the backend
+        while idle: the sending failed, or the connection was closed before any response.
+        Never after a timeout: the backend may have taken the request (a job started) and be just slow.
+        """
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        while True:
+            conn, reused = self._get()
+            try:
+                conn.request(method, target, body=body, headers=headers)
+            except (BrokenPipeError, ConnectionResetError):
+                conn.close()
+                if reused:
+                    continue
+                raise
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                raise
+            try:
+                rsp = conn.getresponse()
+                data = rsp.read()
+            except http.client.RemoteDisconnected:
+                conn.close()
+                if reused:
+                    continue
+                raise
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                raise
+            if rsp.will_close:
+                conn.close()
+            else:
+                self._put(conn)
+            return rsp.status, rsp.getheader("content-type", "application/json"), data
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
+
+    def _get(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop(), True
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout), False
+
+    def _put(self, conn):
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+
+class Shard:
+
+    def __init__(self, index, base_url, pool_size=8, timeout=10):
+        url = urllib.parse.urlsplit(base_url)
+        if url.scheme != "http" or not url.hostname:
+            raise ValueError(f"invalid backend url: {base_url}")
+        self.index = index
+        self.base_url = base_url.rstrip("/")
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.pool = ConnectionPool(self.host, self.port, size=pool_size, timeout=timeout)
+        self.healthy = False
+        self.running = 0
+        self.queued = 0
+        self.max_jobs = 0
+
+    def __repr__(self) -> str:
+        return f"Shard(index={self.index}, url={self.base_url}, healthy={self.healthy})"
+
+    @property
+    def load(self):
+        return (self.running + self.queued) / max(1, self.max_jobs)
+
+    def request(self, method, target, body=None):
+        """(status, content type, body); `ShardError` (and the shard marked down) if the backend is unreachable"""
+        try:
+            return self.pool.request(method, target, body=body)
+        except (OSError, http.client.HTTPException) as e:
+            self.set_healthy(False, e)
+            raise ShardError(f"backend {self.base_url} failed: {e}") from e
+
+    def request_json(self, method, target, body=None):
+        status, _, data = self.request(method, target, body=body)
+        try:
+            return status, json.loads(data) if data else {}
+        except ValueError as e:
+            raise ShardError(f"backend {self.base_url} sent invalid JSON: {e}") from e
+
+    def update_load(self, rsp):
+        """take the load from a backend response (`/ping`, `/jobs/run`)"""
+        self.running = rsp.get("running", self.running)
+        self.queued = rsp.get("queued", self.queued)
+        self.max_jobs = rsp.get("max_jobs", self.max_jobs)
+
+    def set_healthy(self, healthy, reason=None):
+        if healthy != self.healthy:
+            if healthy:
+                log.info("backend %s is up", self.base_url)
+            else:
+                log.warning("backend %s is down: %s", self.base_url, reason)
+        self.healthy = healthy
+
+
+class ShardRouter:
+
+    PLACEMENTS = ("least-loaded", "hash")
+    RING_REPLICAS = 64  # points per shard on the hash ring
+    HEALTH_INTERVAL_DEFAULT = 2.0
+    TIMEOUT_DEFAULT = 10.0
+    POOL_SIZE_DEFAULT = 8
+
+    def __init__(self, config=None):
+        self.shards = []
+        self.ring = []  # sorted [(hash, shard index)]
+        self.placement = self.PLACEMENTS[0]
+        self.health_interval = self.HEALTH_INTERVAL_DEFAULT
+        self.stopped = threading.Event()
+        self.health_thread = None
+        self.executor = None
+        if config:
+            self.configure(config)
+
+    def __repr__(self) -> str:
+        return f"ShardRouter(shards={len(self.shards)}, placement={self.placement})"
+
+    def configure(self, config):
+        backends = (config.get("router_backends") or "").replace(",", " ").split()
+        if not backends:
+            raise ValueError("router_backends is empty")
+        self.placement = config.get("router_placement") or self.PLACEMENTS[0]
+        if self.placement not in self.PLACEMENTS:
+            raise ValueError(f"invalid router_placement: {self.placement}")
+        self.health_interval = float(config.get("router_health_interval", 0) or self.HEALTH_INTERVAL_DEFAULT)
+        timeout = float(config.get("router_timeout", 0) or self.TIMEOUT_DEFAULT)
+        pool_size = int(config.get("router_pool_size", 0) or self.POOL_SIZE_DEFAULT)
+        self.shards = [Shard(i, url, pool_size=pool_size, timeout=timeout) for i, url in enumerate(backends)]
+        self.ring = sorted(
+            (ring_hash(f"{shard.base_url}#{replica}"), shard.index)
+            for shard in self.shards
+            for replica in range(self.RING_REPLICAS)
+        )
+        self.executor = ThreadPoolExecutor(max_workers=2 * len(self.shards), thread_name_prefix="jobaman-router")
+        self.check_health()
+        self.health_thread = threading.Thread(target=self._health_loop, name="jobaman-router-health", daemon=True)
+        self.health_thread.start()
+
+    @property
+    def healthy_shards(self):
+        return [shard for shard in self.shards if shard.healthy]
+
+    def owners(self, job_id):
+        """shards that may own the job: its prefix shard, or the shards in hash ring order from the job id"""
+        if match := SHARD_JOB_ID_RE.match(job_id):
+            index = int(match.group(1))
+            return [self.shards[index]] if index < len(self.shards) else []
+        owners = []
+        start = bisect.bisect(self.ring, (ring_hash(job_id), -1))
+        for _, index in self.ring[start:] + self.ring[:start]:
+            if self.shards[index] not in owners:
+                owners.append(self.shards[index])
+                if len(owners) == len(self.shards):
+                    break
+        return owners
+
+    def place(self, job_id=None, exclude=(), near=None):
+        """
+        (shard, job id) for a new job, `ShardError` if no shard can take it;
+        with `near` (a job id) on the shard of that job: dependent jobs run on the backend of their dependencies
+        """
+        if near is not None:
+            shard = self.owner(near)
+            return shard, job_id or f"s{shard.index}-{uuid.uuid4().hex}"
+        if job_id is None and self.placement == "least-loaded":
+            shards = [shard for shard in self.healthy_shards if shard not in exclude]
+            if not shards:
+                raise ShardError("no backend available")
+            shard = min(shards, key=lambda s: (s.load, s.index))
+            shard.queued += 1  # until the backend tells its load, for the next jobs of a batch
+            return shard, f"s{shard.index}-{uuid.uuid4().hex}"
+        job_id = job_id or uuid.uuid4().hex
+        for shard in self.owners(job_id):
+            if shard.healthy and shard not in exclude:
+                return shard, job_id
+        raise ShardError(f"no backend available for job_id {job_id}")
+
+    def owner(self, job_id):
+        """the healthy shard a request for the job goes to first, `ShardError` if there is none"""
+        for shard in self.owners(job_id):
+            if shard.healthy:
+                return shard
+        raise ShardError(f"no backend available for job_id {job_id}")
+
+    def request_by_id(self, job_id, method, target):
+        """send the request to the shards that may own the job until one of them knows it (not a 404)"""
+        rsp = None
+        for shard in self.owners(job_id):
+            if shard.healthy:
+                rsp = shard.request(method, target)
+                if rsp[0] != HTTPStatus.NOT_FOUND:
+                    return shard, rsp
+        if rsp is None:
+            raise ShardError(f"no backend available for job_id {job_id}")
+        return None, rsp
+
+    def map(self, function, shards):
+        """`function(shard)` for every shard concurrently, [(shard, result or the `ShardError`)]"""
+
+        def call(shard):
+            try:
+                return function(shard)
+            except ShardError as e:
+                return e
+
+        return list(zip(shards, self.executor.map(call, shards), strict=True))
+
+    def check_health(self):
+        def ping(shard):
+            status, rsp = shard.request_json("GET", "/ping")
+            if status == HTTPStatus.OK:
+                shard.update_load(rsp)
+            shard.set_healthy(status == HTTPStatus.OK, f"/ping status {status}")
+
+        self.map(ping, self.shards)
+
+    def _health_loop(self):
+        while not self.stopped.wait(self.health_interval):
+            try:
+                self.check_health()
+            except Exception as e:
+                log.error("health check failed: %s", e)
+
+    def shutdown(self):
+        self.stopped.set()
+        if self.health_thread is not None:
+            self.health_thread.join(timeout=10)
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+        for shard in self.shards:
+            shard.pool.close()
+
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
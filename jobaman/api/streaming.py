@@ -0,0 +1,189 @@
+import asyncio
+import json
+import threading
+
+from jobaman.jobs.job import JobState
+from jobaman.logger import get_logger
+
+log = get_logger(__name__)
+
+SSE_HEADER = (
+    b"HTTP/1.1 200\r\n"
+    b"Connection: close\r\n"
+    b"Content-Type: text/event-stream\r\n"
+    b"Cache-Control: no-cache\r\n"
+    b"Access-Control-Allow-Origin: *\r\n"
+    b"\r\n"
+)
+JSON_HEADER = (
+    "HTTP/1.1 200\r\n"
+    "Connection: close\r\n"
+    "Content-Length: {}\r\n"
+    "Content-Type: application/json\r\n"
+    "Access-Control-Allow-Origin: *\r\n"
+    "\r\n"
+)
+WAITING_STATES = (JobState.QUEUED, JobState.RUNNING)
+
+
+class AsyncResponse:
+    """long-lived response: written by a coroutine on an event loop instead of a server worker"""
+
+    async def serve(self, writer):
+        raise NotImplementedError
+
+
+class JobOutputStream(AsyncResponse):
+    """
+    Server-Sent Events with the job output:
+    `stdout`/`stderr` events (one line each, `id` is the line sequence number),
+    `lag` events when the follower fell behind the job output and lines were skipped,
+    and the final `exit` event once the job is no longer queued or running.
+    """
+
+    STREAMS = ("stdout", "stderr")
+    MAX_LAG_DEFAULT = 1000
+    HEARTBEAT_INTERVAL = 15
+
+    def __init__(self, job_id, job, cursor=None, tail=None, max_lag=None):
+        self.job_id = job_id
+        self.job = job
+        self.cursor = {name: (cursor or {}).get(name) for name in self.STREAMS}
+        self.tail = tail
+        self.max_lag = max_lag or self.MAX_LAG_DEFAULT
+
+    def __repr__(self) -> str:
+        return f"JobOutputStream(job_id={self.job_id}, cursor={self.cursor})"
+
+    def _read_events(self):
+        events = []
+        for name in self.STREAMS:
+            cursor = self.cursor[name]
+            tail = self.max_lag if cursor is not None or self.tail is None else min(self.tail, self.max_lag)
+            lines, next_cursor, _ = self.job.read_lines(name, cursor=cursor, tail=tail)
+            first_seq = next_cursor - len(lines)
+            if cursor is not None and first_seq > cursor:
+                events.append(sse_event("lag", json.dumps({"stream": name, "skipped": first_seq - cursor})))
+            events.extend(sse_event(name, line.rstrip("\n"), seq) for seq, line in enumerate(lines, first_seq))
+            self.cursor[name] = next_cursor
+        return events
+
+    async def serve(self, writer):
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+
+        def notify():
+            loop.call_soon_threadsafe(wakeup.set)
+
+        self.job.add_watcher(notify)
+        try:
+            writer.write(SSE_HEADER)
+            while True:
+                wakeup.clear()
+                waiting = self.job.state in WAITING_STATES  # a queued job is followed from its start on
+                events = self._read_events()
+                if events:
+                    writer.write("".join(events).encode("utf-8"))
+                    await writer.drain()
+                if not waiting:
+                    break
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout=self.HEARTBEAT_INTERVAL)
+                except TimeoutError:
+                    writer.write(b": heartbeat\n\n")
+                    await writer.drain()
+            exit_info = {"job_id": self.job_id, "state": self.job.state, "exit_code": self.job.exit_code}
+            writer.write(sse_event("exit", json.dumps(exit_info)).encode("utf-8"))
+            await writer.drain()
+        finally:
+            self.job.remove_watcher(notify)
+
+
+class JobWait(AsyncResponse):
+    """
+    Long-poll for job completion: the JSON response is sent once the jobs are no longer queued or running
+    (all of them, or any of them with `any_done`) or when `timeout` expires;
+    job watchers wake the waiting coroutine up, no thread is held while waiting.
+    """
+
+    def __init__(self, jobs, any_done=False, timeout=30):
+        self.jobs = jobs
+        self.any_done = any_done
+        self.timeout = timeout
+
+    def __repr__(self) -> str:
+        return f"JobWait(jobs={len(self.jobs)}, any_done={self.any_done}, timeout={self.timeout})"
+
+    @property
+    def done(self):
+        finished = (job.state not in WAITING_STATES for job in self.jobs.values())
+        return any(finished) if self.any_done else all(finished)
+
+    def result(self):
+        jobs = {
+            job_id: {
+                "state": job.state,
+                "exit_code": job.exit_code,
+                "ts_started": job.ts_started,
+                "ts_completed": job.ts_completed,
+            }
+            for job_id, job in self.jobs.items()
+        }
+        return {"done": self.done, "jobs": jobs}
+
+    async def serve(self, writer):
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        watchers = {}
+        for job_id, job in self.jobs.items():
+
+            def notify(job=job):  # called on output too, only a finished job wakes the waiter up
+                if job.state not in WAITING_STATES:
+                    loop.call_soon_threadsafe(wakeup.set)
+
+            watchers[job_id] = notify
+            job.add_watcher(notify)
+        try:
+            deadline = loop.time() + self.timeout
+            while not self.done and loop.time() < deadline:
+                wakeup.clear()
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout=deadline - loop.time())
+                except TimeoutError:
+                    break
+            body = json.dumps(self.result()).encode("utf-8")
+            writer.write(JSON_HEADER.format(len(body)).encode() + body)
+            await writer.drain()
+        finally:
+            for job_id, notify in watchers.items():
+                self.jobs[job_id].remove_watcher(notify)
+
+
+def sse_event(event, data, event_id=None):
+    event_id = f"id: {event_id}\n" if event_id is not None else ""
+    return f"event: {event}\n{event_id}data: {data}\n\n"
+
+
+class Streamer:
+    """event loop thread serving `AsyncResponse`s for connections handed over by the threaded server"""
+
+    def __init__(self, name="jobaman-streamer"):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, conn, addr, response):
+        asyncio.run_coroutine_threadsafe(self._serve(conn, addr, response), self.loop)
+
+    async def _serve(self, conn, addr, response):
+        conn.setblocking(False)
+        _, writer = await asyncio.open_connection(sock=conn)
+        try:
+            await response.serve(writer)
+        except ConnectionError:
+            pass
+        except Exception as e:
+            log.error("failed to serve %s to [%s:%s]: %s", response, *addr, e)
+        finally:
+            writer.close()
+        log.info("[%s:%s] %s - done", *addr, response)
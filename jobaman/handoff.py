@@ -0,0 +1,255 @@
+"""
+Zero-downtime restart: the running jobaman starts a new one (the same command line) and hands over to it
+the listening socket, the pipes, pidfds and spool files of the running jobs (`SCM_RIGHTS` over a UNIX socket pair)
+and everything else it knows about its jobs, so jobs keep running and new connections wait in the listen backlog.
+
+1. old: `restart()` (SIGUSR2 or `/restart`) starts the new process, its end of the socket pair is `JOBAMAN_HANDOFF_FD`;
+2. new: starts up without loading the registry and sends `ready`;
+3. old: stops accepting, finishes the requests in progress, pauses its manager and sends the state;
+4. new: takes the jobs over and sends `done`, then serves on the socket it got; the old one exits.
+
+If anything fails before `done`, the old jobaman kills the new one and carries on.
+Jobs taken over are not children of the new process: their exit codes are unknown, as for `AdoptedProcess`.
+"""
+
+import json
+import os
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import threading
+
+from jobaman.logger import get_logger
+
+log = get_logger(__name__)
+
+HANDOFF_FD_ENV = "JOBAMAN_HANDOFF_FD"
+SYSTEMD_FIRST_FD = 3
+SCM_MAX_FD = 253  # fds per message
+MESSAGE_HEADER = struct.Struct("!QQI")  # state size, blob size, number of fds
+
+
+class HandoffError(Exception):
+    pass
+
+
+class HandoffWriter:
+    """the bytes and fds of a handoff message: the state refers to them by position, see `HandoffReader`"""
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+        self.fds = []
+        self.owned = []  # fds opened for the handoff, closed once it is sent
+
+    def blob(self, data):
+        ref = [self.size, len(data)]
+        self.parts.append(data)
+        self.size += len(data)
+        return ref
+
+    def fd(self, fd, owned=False):
+        if fd is None:
+            return None
+        self.fds.append(fd)
+        if owned:
+            self.owned.append(fd)
+        return len(self.fds) - 1
+
+    def close(self):
+        for fd in self.owned:
+            os.close(fd)
+        self.owned = []
+
+
+class HandoffReader:
+
+    def __init__(self, blob, fds):
+        self.data = memoryview(blob)
+        self.fds = fds
+        self.taken = set()
+
+    def blob(self, ref):
+        start, size = ref
+        return self.data[start : start + size]
+
+    def fd(self, index):
+        if index is None:
+            return None
+        self.taken.add(index)
+        return self.fds[index]
+
+    def close_unused(self):
+        for index, fd in enumerate(self.fds):
+            if index not in self.taken:
+                os.close(fd)
+
+
+def send_message(sock, message, writer=None):
+    state = json.dumps(message).encode("utf-8")
+    parts, fds = (writer.parts, writer.fds) if writer is not None else ([], [])
+    sock.sendall(MESSAGE_HEADER.pack(len(state), sum(map(len, parts)), len(fds)) + state)
+    for part in parts:
+        sock.sendall(part)
+    for i in range(0, len(fds), SCM_MAX_FD):
+        socket.send_fds(sock, [b"\0"], fds[i : i + SCM_MAX_FD])
+
+
+def recv_message(sock):
+    """(message, `HandoffReader` of its bytes and fds)"""
+    state_size, blob_size, fds_count = MESSAGE_HEADER.unpack(recv_exactly(sock, MESSAGE_HEADER.size))
+    message = json.loads(recv_exactly(sock, state_size))
+    blob = recv_exactly(sock, blob_size)
+    fds = []
+    while len(fds) < fds_count:
+        _, received, _, _ = socket.recv_fds(sock, 1, min(SCM_MAX_FD, fds_count - len(fds)), socket.MSG_CMSG_CLOEXEC)
+        if not received:
+            raise HandoffError(f"{len(fds)} of {fds_count} fds received")
+        fds += received
+    return message, HandoffReader(blob, fds)
+
+
+def recv_exactly(sock, size):
+    data = bytearray(size)
+    with memoryview(data) as view:
+        received = 0
+        while received < size:
+            count = sock.recv_into(view[received:])
+            if not count:
+                raise HandoffError("connection closed by the other jobaman")
+            received += count
+    return data
+
+
+def systemd_socket():
+    """the listening socket passed by systemd socket activation (`LISTEN_FDS`), `None` if there is none"""
+    if os.environ.get("LISTEN_PID") != str(os.getpid()) or int(os.environ.get("LISTEN_FDS", "0")) < 1:
+        return None
+    for name in ("LISTEN_PID", "LISTEN_FDS", "LISTEN_FDNAMES"):  # not for the jobs
+        os.environ.pop(name, None)
+    os.set_inheritable(SYSTEMD_FIRST_FD, False)
+    log.info("using the listening socket passed by systemd")
+    return socket.socket(fileno=SYSTEMD_FIRST_FD)
+
+
+class Handoff:
+
+    TIMEOUT_DEFAULT = 30.0
+    RESTART_SIGNAL = signal.SIGUSR2
+
+    def __init__(self, config=None):
+        self.timeout = float((config or {}).get("restart_timeout", 0) or self.TIMEOUT_DEFAULT)
+        self.restarting = threading.Lock()
+        self.process = None  # the new jobaman
+        self.peer = None  # our end of the socket pair
+        self.stop_fd, self._stop_w = os.pipe()  # readable: servers stop accepting and return
+        os.set_blocking(self.stop_fd, False)
+        fd = os.environ.pop(HANDOFF_FD_ENV, None)
+        if fd is not None:
+            self.peer = socket.socket(fileno=int(fd))
+            self.peer.settimeout(self.timeout)
+
+    def __repr__(self) -> str:
+        return f"Handoff(incoming={self.incoming}, process={self.process})"
+
+    @property
+    def incoming(self):
+        """this jobaman was started by a restart and has not taken over yet"""
+        return self.peer is not None and self.process is None
+
+    def install_signal_handler(self):
+        signal.signal(self.RESTART_SIGNAL, lambda *_: self.restart())
+
+    def restart(self):
+        """start a new jobaman to hand over to (in the background), `False` if a restart is in progress"""
+        if self.incoming or not self.restarting.acquire(blocking=False):
+            return False
+        threading.Thread(target=self._start_successor, name="jobaman-restart", daemon=True).start()
+        return True
+
+    def _start_successor(self):
+        ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            with theirs:
+                self.process = subprocess.Popen(
+                    [sys.executable, *sys.orig_argv[1:]],
+                    pass_fds=(theirs.fileno(),),
+                    env={**os.environ, HANDOFF_FD_ENV: str(theirs.fileno())},
+                )
+            log.info("restart: started pid=%s, waiting for it to get ready", self.process.pid)
+            ours.settimeout(self.timeout)
+            message, _ = recv_message(ours)
+            if not message.get("ready"):
+                raise HandoffError(f"unexpected message {message}")
+        except Exception as e:
+            log.error("restart failed: %s", e)
+            ours.close()
+            self._abort()
+            return
+        self.peer = ours
+        os.write(self._stop_w, b"\0")
+
+    def hand_over(self, sock, manager=None):
+        """(old jobaman, servers stopped) send the socket and the jobs, `True` once the new jobaman has them"""
+        if self.peer is None or self.process is None:
+            return False
+        writer = HandoffWriter()
+        try:
+            listen = writer.fd(sock.fileno())
+            jobs = manager.export_jobs(writer) if manager is not None else []
+            send_message(self.peer, {"listen": listen, "jobs": jobs}, writer)
+            message, _ = recv_message(self.peer)
+            if not message.get("done"):
+                raise HandoffError(f"unexpected message {message}")
+        except Exception as e:
+            log.error("restart failed, resuming: %s", e)
+            if manager is not None:
+                manager.resume()
+            self._abort()
+            return False
+        finally:
+            writer.close()
+        if manager is not None:
+            manager.detach_jobs()
+        log.info("restart: %d jobs handed over to pid=%s", len(jobs), self.process.pid)
+        self.peer.close()
+        return True
+
+    def take_over(self, config, manager=None):
+        """
+        (new jobaman) get the listening socket and the jobs, `False` if the old jobaman did not send them
+        within the restart timeout (it finishes its requests in progress first): the old one carries on then
+        """
+        try:
+            send_message(self.peer, {"ready": True, "pid": os.getpid()})
+            message, reader = recv_message(self.peer)  # `TimeoutError` past `self.timeout`
+            config["server_socket"] = socket.socket(fileno=reader.fd(message["listen"]))
+            if manager is not None:
+                manager.import_jobs(message["jobs"], reader)
+            reader.close_unused()
+            send_message(self.peer, {"done": True})
+        except Exception as e:
+            log.error("take over failed: %s", e)
+            return False
+        finally:
+            self.peer.close()
+            self.peer = None
+        log.info("took over from the previous jobaman: %d jobs", len(message["jobs"]))
+        return True
+
+    def _abort(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+        if self.peer is not None:
+            self.peer.close()
+            self.peer = None
+        try:
+            while os.read(self.stop_fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        self.restarting.release()
@@ -40,6 +40,19 @@ def get_pids_by_ppid(ppid):
     return pids
 
 
+def get_process_start_time(pid):
+    """process start time (clock ticks since boot) to tell a process from a later one with the same pid"""
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # comm (2nd field) may contain spaces, the fields after it are fixed
+    fields = stat.rpartition(")")[2].split()
+    starttime_index = 22 - 3
+    return int(fields[starttime_index]) if len(fields) > starttime_index else None
+
+
 def human_time(seconds):
     minute = 60
     hour = minute * 60
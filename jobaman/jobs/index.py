@@ -0,0 +1,136 @@
+import bisect
+import collections
+import heapq
+import itertools
+import math
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class JobSelection:
+    """a page of jobs in the given states (and labels) started after/before the given times, see `JobIndex.select`"""
+
+    states: tuple
+    labels: tuple | None = None
+    started_after: float | None = None
+    started_before: float | None = None
+    descending: bool = False
+    cursor: tuple | None = None  # (ts, seq) of the last job of the previous page
+    limit: int = 100
+
+
+class JobIndex:
+    """
+    Job ids sorted by (start time, submission order) per state and per (state, label),
+    so listings are filtered and paginated with bisection instead of a scan of all jobs.
+    Queued jobs are sorted by their submission time.
+    """
+
+    BULK_FILTER_MIN = 16  # removing more entries from a list than this rebuilds it instead of deleting one by one
+
+    def __init__(self):
+        self.lists = {}  # (state, label or None) -> sorted [(ts, seq, job_id)]
+        self.entries = {}  # job_id -> ((ts, seq, job_id), state, label)
+        self.seqs = itertools.count()
+
+    def __repr__(self) -> str:
+        return f"JobIndex(jobs={len(self.entries)}, lists={len(self.lists)})"
+
+    def __len__(self):
+        return len(self.entries)
+
+    def update(self, job_id, job):
+        old = self.entries.get(job_id)
+        seq = old[0][1] if old is not None else next(self.seqs)
+        ts = job.ts_started if job.ts_started is not None else job.ts_queued
+        new = ((ts, seq, job_id), job.state, job.label)
+        if new == old:
+            return
+        if old is not None:
+            self._discard(*old)
+        for key in ((job.state, None), (job.state, job.label)):
+            bisect.insort(self.lists.setdefault(key, []), new[0])
+        self.entries[job_id] = new
+
+    def cursor(self, job_id):
+        """(start time, submission order) of the job, a `select` cursor of the jobs after it"""
+        entry = self.entries.get(job_id)
+        return entry[0][:2] if entry is not None else None
+
+    def remove(self, job_id):
+        old = self.entries.pop(job_id, None)
+        if old is not None:
+            self._discard(*old)
+
+    def remove_many(self, job_ids):
+        """remove jobs in bulk (e.g. evicted ones): each sorted list is filtered once, not shifted per job"""
+        removed = collections.defaultdict(set)
+        for job_id in job_ids:
+            old = self.entries.pop(job_id, None)
+            if old is not None:
+                entry, state, label = old
+                removed[(state, None)].add(entry)
+                removed[(state, label)].add(entry)
+        for key, entries in removed.items():
+            if len(entries) < self.BULK_FILTER_MIN:
+                for entry in entries:
+                    self._discard_entry(key, entry)
+            else:
+                self._discard_entries(key, sorted(entries))
+
+    def _discard_entries(self, key, removed):
+        entries = self.lists.get(key)
+        if entries is None:
+            return
+        kept, start = [], 0
+        for entry in removed:
+            i = bisect.bisect_left(entries, entry, lo=start)
+            if i < len(entries) and entries[i] == entry:
+                kept += entries[start:i]
+                start = i + 1
+        kept += entries[start:]
+        if kept:
+            self.lists[key] = kept
+        else:
+            del self.lists[key]
+
+    def _discard(self, entry, state, label):
+        for key in ((state, None), (state, label)):
+            self._discard_entry(key, entry)
+
+    def _discard_entry(self, key, entry):
+        entries = self.lists.get(key)
+        if entries is None:
+            return
+        i = bisect.bisect_left(entries, entry)
+        if i < len(entries) and entries[i] == entry:
+            del entries[i]
+        if not entries:
+            del self.lists[key]
+
+    def select(self, selection):
+        """
+        up to `selection.limit` job ids of the `JobSelection`,
+        return (job ids, number of all matching jobs, cursor of the next page or `None`)
+        """
+        after, before, cursor = selection.started_after, selection.started_before, selection.cursor
+        descending, limit = selection.descending, selection.limit
+        total = 0
+        ranges = []
+        for key in ((state, label) for state in selection.states for label in selection.labels or (None,)):
+            entries = self.lists.get(key)
+            if not entries:
+                continue
+            lo = 0 if after is None else bisect.bisect_right(entries, (after, math.inf))
+            hi = len(entries) if before is None else bisect.bisect_left(entries, (before,))
+            total += max(0, hi - lo)
+            if cursor is not None and descending:
+                hi = min(hi, bisect.bisect_left(entries, cursor))
+            elif cursor is not None:
+                lo = max(lo, bisect.bisect_left(entries, (cursor[0], cursor[1] + 1)))
+            if lo < hi:
+                ranges.append((entries, range(hi - 1, lo - 1, -1) if descending else range(lo, hi)))
+        merged = heapq.merge(*(map(entries.__getitem__, indexes) for entries, indexes in ranges), reverse=descending)
+        page = list(itertools.islice(merged, limit + 1))
+        next_cursor = page[limit - 1][:2] if len(page) > limit else None
+        return [job_id for _, _, job_id in page[:limit]], total, next_cursor
@@ -1,90 +1,360 @@
 import enum
 import os
+import re
 import signal
 import threading
 import time
-from collections import defaultdict, deque
+from dataclasses import dataclass, field
 
-from jobaman.helpers import get_pids_by_ppid, synchronized
+from jobaman.helpers import synchronized
+from jobaman.jobs.sampler import read_process_usage
+from jobaman.jobs.streams import StreamBuffer
 from jobaman.logger import get_logger
 
 log = get_logger()
 
+LINE_BREAK = re.compile(rb"\r\n|\r|\n")  # universal newlines, as the text mode pipes read before
+
 
 class JobState(enum.StrEnum):
     IDLE = "idle"
+    QUEUED = "queued"
     RUNNING = "running"
     DONE = "finished"
     KILLED = "killed"
+    LOST = "lost"
+
+
+@dataclass
+class JobSpec:
+    """what a job runs and how it is scheduled, see `Manager.run_task`"""
+
+    command: list | None = None
+    priority: int = 0
+    label: str = ""
+    after: list = field(default_factory=list)  # ids of the jobs that must succeed before this one starts
+    stdin_job: str | None = None  # id of the job whose stdout is the stdin of this one
 
 
 class Job:
 
-    STREAM_MAX_LINES_DEFAULT = 10_000
+    STREAMS = ("stdout", "stderr")
+    STREAM_MAX_BYTES_DEFAULT = 1024 * 1024
+    STREAM_ENCODING_DEFAULT = "utf-8"
+    READ_CHUNK_SIZE = 64 * 1024
+    KILL_GRACE_DEFAULT = 5.0
+    DRAIN_MAX_CHUNKS = 16
+    EXPORTED = (
+        "exit_code",
+        "command",
+        "priority",
+        "label",
+        "after",
+        "stdin_job",
+        "streams_limit",
+        "encoding",
+        "spool_path",
+        "ts_queued",
+        "ts_started",
+        "ts_completed",
+        "queued_at",
+        "queue_wait",
+        "cpu_time",
+        "rss",
+        "peak_rss",
+        "io_read_bytes",
+        "io_write_bytes",
+    )
 
-    def __init__(self, process, state=JobState.IDLE):
+    def __init__(self, process, state=JobState.IDLE, spec=None, encoding=None, streams_limit=None):
         self.lock = threading.Lock()
 
+        spec = spec or JobSpec()
         self.process = process
         self.state = state
         self.exit_code = None
+        self.command = spec.command
+        self.on_transition = None
+        self.priority = spec.priority
+        self.label = spec.label
+        self.after = list(spec.after)  # see `Manager`
+        self.stdin_job = spec.stdin_job
 
-        self.streams_limit = self.STREAM_MAX_LINES_DEFAULT
-        self.streams = defaultdict(lambda: deque(maxlen=self.streams_limit))
+        self.streams_limit = streams_limit or self.STREAM_MAX_BYTES_DEFAULT
+        self.encoding = encoding or self.STREAM_ENCODING_DEFAULT
+        self.spool_path = None
+        self.streams = {name: self._new_stream_buffer(name) for name in self.STREAMS}
 
-        self.process_handlers = []
-        self._start_process_handlers()
-
-        self.ts_started = int(time.time())
+        self.ts_queued = int(time.time())
+        self.ts_started = self.ts_queued if state != JobState.QUEUED else None
         self.ts_completed = None
+        self.queued_at = time.monotonic()
+        self.queue_wait = 0.0 if state != JobState.QUEUED else None  # seconds between submission and start
+
+        # resource usage of the whole process tree, see `Sampler`
+        self.cpu_time = 0.0
+        self.rss = 0
+        self.peak_rss = 0
+        self.io_read_bytes = 0
+        self.io_write_bytes = 0
+
+        self.watchers = []
+        self.detached = False  # handed over to another jobaman
+        self.reactor = None
+        self.readers = {}
+        self.partials = {name: b"" for name in self.STREAMS}  # incomplete last lines
 
     def __repr__(self) -> str:
         return (
             f"Job(state={self.state}, "
-            f"pid={self.process.pid}, exit_code={self.exit_code}, "
+            f"pid={self.pid}, exit_code={self.exit_code}, "
             f"ts_started={self.ts_started}, ts_completed={self.ts_completed})"
         )
 
+    @property
+    def pid(self):
+        return self.process.pid if self.process is not None else None
+
     @property
     def stdout(self):
-        with self.lock:
-            return "".join(self.streams["stdout"])
+        return self.read_output("stdout")[0]
 
     @property
     def stderr(self):
+        return self.read_output("stderr")[0]
+
+    @property
+    def streams_size(self):
+        """bytes of output kept in memory"""
+        return sum(buffer.size for buffer in list(self.streams.values()))
+
+    @synchronized
+    def read_lines(self, stream_name, cursor=None, tail=None):
+        """output lines starting at sequence number `cursor`, see `StreamBuffer.read`"""
+        return self.streams[stream_name].read(cursor=cursor, tail=tail)
+
+    @synchronized
+    def read_range(self, stream_name, offset, length):
+        """raw output bytes by absolute offset, see `StreamBuffer.read_range`"""
+        buffer = self.streams[stream_name]
+        data, offset = buffer.read_range(offset, length)
+        return data, offset, buffer.end
+
+    @synchronized
+    def release(self):
+        """drop the output, including the spool files"""
+        for buffer in self.streams.values():
+            buffer.release()
+        self.spool_path = None
+        self.streams = {name: self._new_stream_buffer(name) for name in self.STREAMS}
+
+    def grep(self, stream_name, search, offset=0, limit=100):
+        """
+        output lines matching `search` (a `jobaman.jobs.search.Search`) from absolute `offset` on:
+        a chunk at a time copied under the lock and searched with no lock held,
+        until `limit` lines are found, the end or the deadline of the search;
+        return (matches, offset to go on from -- the end of the output once it is all searched, all searched)
+        """
+        found = []
+        while len(found) < limit:
+            with self.lock:
+                chunk = self.streams[stream_name].copy_chunk(offset, search.context)
+            try:
+                matches, next_offset = search.lines(chunk, limit - len(found))
+            except TimeoutError:
+                break
+            found += matches
+            if next_offset is None:
+                return found, max(offset, chunk.end), True
+            offset = next_offset
+        return found, offset, False
+
+    @synchronized
+    def open_output(self, stream_name):
+        """a file descriptor to read the output from, see `StreamBuffer.open_fd`"""
+        return self.streams[stream_name].open_fd()
+
+    def _new_stream_buffer(self, stream_name):
+        spool_path = f"{self.spool_path}.{stream_name}" if self.spool_path else None
+        return StreamBuffer(self.streams_limit, encoding=self.encoding, spool_path=spool_path)
+
+    def read_output(self, stream_name, cursor=None, tail=None):
+        lines, next_cursor, dropped = self.read_lines(stream_name, cursor=cursor, tail=tail)
+        return "".join(lines), next_cursor, dropped
+
+    def add_watcher(self, callback):
+        """`callback()` is called on new output and state changes, it must be quick and thread-safe"""
         with self.lock:
-            return "".join(self.streams["stderr"])
+            self.watchers = self.watchers + [callback]
+
+    def remove_watcher(self, callback):
+        with self.lock:
+            self.watchers = [w for w in self.watchers if w is not callback]
+
+    def _notify(self):
+        for callback in self.watchers:
+            try:
+                callback()
+            except Exception as e:
+                log.error("job watcher %s failed: %s", callback, e)
 
     @property
     def runtime(self):
+        if self.ts_started is None:
+            return 0
         if self.ts_completed is not None:
             return int(self.ts_completed - self.ts_started)
         return int(time.time()) - self.ts_started
 
+    def update_usage(self, cpu_time, rss, io_read_bytes, io_write_bytes):
+        """record a usage sample, totals never go down (processes reaped outside the job take their share away)"""
+        self.cpu_time = max(self.cpu_time, cpu_time)
+        self.rss = rss
+        self.peak_rss = max(self.peak_rss, rss)
+        self.io_read_bytes = max(self.io_read_bytes, io_read_bytes)
+        self.io_write_bytes = max(self.io_write_bytes, io_write_bytes)
+
+    @classmethod
+    def restore(cls, record, process, state, **kwargs):
+        """job known from a previous run (a `Registry` record): output is only what is left in its spool files"""
+        spec = JobSpec(
+            record["command"],
+            record["priority"] or 0,
+            record["label"] or "",
+            record["after"],
+            record["stdin_job"],
+        )
+        job = cls(process, state=state, spec=spec, **kwargs)
+        job.exit_code = record["exit_code"]
+        job.ts_started = record["ts_started"] if record["ts_started"] is not None else job.ts_started
+        job.ts_completed = record["ts_completed"]
+        spool_path = record["spool_path"]
+        if spool_path:
+            job.spool_path = spool_path
+            job.streams = {
+                name: StreamBuffer.from_spool(job.streams_limit, f"{spool_path}.{name}", encoding=job.encoding)
+                for name in cls.STREAMS
+            }
+        return job
+
     @synchronized
-    def kill(self, wait=0.1):
-        if self.state != JobState.RUNNING:
-            return
-        pids = get_pids_by_ppid(self.process.pid)
-        pids.insert(0, self.process.pid)
-        log.info("killing job: %s, pids: %s", self, pids)
-        self.process.terminate()
-        time.sleep(wait)
-        for pid in pids:
+    def export(self, writer):
+        """the job as plain values for `from_export` in another jobaman, its output and pipes go to `writer`"""
+        record = {name: getattr(self, name) for name in self.EXPORTED}
+        record["state"] = self.state.value
+        record["pid"] = self.pid
+        record["streams"] = {name: buffer.export(writer) for name, buffer in self.streams.items()}
+        record["partials"] = {name: writer.blob(partial) for name, partial in self.partials.items()}
+        record["pipes"] = {}
+        if self.state == JobState.RUNNING:
+            record["pipes"] = {stream_name: writer.fd(fd) for fd, (_, stream_name) in self.readers.items()}
+        return record
+
+    @classmethod
+    def from_export(cls, record, reader, process):
+        """a job exported by another jobaman, with the process it has made of the pipes in `reader`"""
+        job = cls(process, state=JobState(record["state"]))
+        for name in cls.EXPORTED:
+            if name in record:  # not by an older jobaman
+                setattr(job, name, record[name])
+        job.streams = {name: StreamBuffer.from_export(stream, reader) for name, stream in record["streams"].items()}
+        job.partials = {name: bytes(reader.blob(ref)) for name, ref in record["partials"].items()}
+        return job
+
+    def adopt(self, reactor):
+        """read the output and watch the exit of the process of a running job taken over from another jobaman"""
+        self.reactor = reactor
+        self._start_process_handlers()
+
+    @synchronized
+    def detach(self):
+        """the job is handed over to another jobaman: it is not signalled or recorded here any more"""
+        self.detached = True
+        self.on_transition = None
+
+    def start(self, process, reactor, spool_path=None):
+        """start a queued job with its just spawned process, `False` if the job is no longer queued"""
+        with self.lock:
+            if self.state != JobState.QUEUED:
+                return False
+            self.process = process
+            self.spool_path = spool_path
+            self.streams = {name: self._new_stream_buffer(name) for name in self.STREAMS}
+            self.state = JobState.RUNNING
+            self.ts_started = int(time.time())
+            self.queue_wait = time.monotonic() - self.queued_at
+            self.reactor = reactor
+        self._start_process_handlers()
+        self._transitioned(True)
+        return True
+
+    def kill(self, grace=None):
+        """SIGTERM the job (cancel it if queued), SIGKILL what is left after `grace` seconds on the reactor timer"""
+        changed = self.terminate()
+        if changed and self.process is not None:
+            grace = self.KILL_GRACE_DEFAULT if grace is None else grace
+            if self.reactor is not None and grace > 0:
+                self.reactor.call_later(grace, self.escalate)
+            else:
+                self.escalate()
+        return changed
+
+    def terminate(self):
+        """SIGTERM the job process group, the job is `killed` right away; `False` if it was not running"""
+        changed = self._terminate()
+        self._transitioned(changed)
+        return changed
+
+    def escalate(self):
+        """SIGKILL whatever is left of the job process group"""
+        self.send_signal(signal.SIGKILL)
+
+    def send_signal(self, sig):
+        """signal the whole process group: jobs run in their own session, so grandchildren get it too"""
+        try:
+            os.killpg(self.process.pid, sig)
+        except ProcessLookupError:
+            pass
+        except OSError as e:
+            log.error("cannot send signal %s to job %s: %s", sig, self, e)
+
+    def _transitioned(self, changed):
+        if changed and self.on_transition is not None:
             try:
-                os.kill(pid, signal.SIGKILL)
-            except Exception:  # noqa
-                continue
-        if self.process.poll() is None:
-            self.process.kill()
+                self.on_transition(self)
+            except Exception as e:
+                log.error("job transition callback failed: %s", e)
+        self._notify()
+
+    @synchronized
+    def _terminate(self):
+        if self.detached:
+            return False
+        if self.state == JobState.QUEUED:
+            self.state = JobState.KILLED
+            self.ts_completed = int(time.time())
+            log.info("queued job cancelled: %s", self)
+            return True
+        if self.state != JobState.RUNNING:
+            return False
+        self.send_signal(signal.SIGTERM)
         self.exit_code = -1
         self.state = JobState.KILLED
+        self.ts_completed = int(time.time())
         log.info("job killed: %s", self)
-        self._close_handlers()
+        return True
 
-    @synchronized
     def wait_job_completion(self, timeout=None):
-        if self.state == JobState.RUNNING:
+        exit_code, changed = self._wait_job_completion(timeout=timeout)
+        self._transitioned(changed)
+        return exit_code
+
+    @synchronized
+    def _wait_job_completion(self, timeout=None):
+        changed = self.state == JobState.RUNNING
+        if not changed:
+            self.process.poll()  # reap a killed job
+        else:
             if self.process.poll() is None:
                 try:
                     self.process.wait(timeout=timeout)
@@ -92,47 +362,92 @@ class Job:
                     pass
             self.exit_code = self.process.returncode
             self.state = JobState.DONE
-            self._close_handlers()
             self.ts_completed = int(time.time())
-        log.info("job completed: %s", self)
-        return self.exit_code
-
-    def _close_handlers(self):
-        ct = threading.current_thread()
-        _ = list(map(lambda t: t is not ct and t.join(timeout=0.1), self.process_handlers))
+        log.info(
+            "job completed: %s, cpu_time=%.2f peak_rss=%d io_read_bytes=%d io_write_bytes=%d",
+            self,
+            self.cpu_time,
+            self.peak_rss,
+            self.io_read_bytes,
+            self.io_write_bytes,
+        )
+        return self.exit_code, changed
 
     @synchronized
     def _start_process_handlers(self):
-
-        def read_stream(stream, stream_name):
+        attach = getattr(self.process, "attach", None)
+        if attach is not None:  # a worker pool task: output and exit come from the pool, see `WorkerTask`
+            self.reactor.call_soon(attach, self)
+            return
+        for stream_name in self.STREAMS:
+            stream = getattr(self.process, stream_name, None)
             if stream is None:
-                return
+                continue
+            fd = stream.fileno()
+            os.set_blocking(fd, False)
+            self.readers[fd] = (stream, stream_name)
+            self.reactor.add_reader(fd, self._read_stream)
+        self.reactor.watch_exit(self.process, self._on_process_exit)
+
+    def _read_stream(self, fd):
+        """read available data from a job pipe (reactor thread), return `True` if more data may be pending"""
+        reader = self.readers.get(fd)
+        if reader is None:
+            return False
+        stream, stream_name = reader
+        try:
+            data = os.read(fd, self.READ_CHUNK_SIZE)
+        except BlockingIOError:
+            return False
+        except Exception as e:
+            log.error("Error reading %s stream: %s", stream_name, e)
+            with self.lock:
+                self.streams[stream_name].append(str(e).encode(self.encoding))
+            data = b""
+
+        self.append_output(stream_name, data)
+        if not data:
+            self.reactor.remove_reader(fd)
+            del self.readers[fd]
             try:
-                for line in iter(stream.readline, ""):
-                    with self.lock:
-                        self.streams[stream_name].append(line)
-            except Exception as e:
-                log.error("Error reading %s stream: %s", stream_name, e)
-                self.streams[stream_name].append(str(e))
-            finally:
-                if not stream.closed:
-                    try:
-                        stream.close()
-                    except Exception as _:
-                        pass
-
-        def poll_job_completion(wait=0.5):
-            while self.state == JobState.RUNNING and self.process.poll() is None:
-                threading.Event().wait(wait)
-            self.wait_job_completion()
-
-        self.process_handlers = [
-            threading.Thread(target=read_stream, args=(self.process.stdout, "stdout"), daemon=True),
-            threading.Thread(target=read_stream, args=(self.process.stderr, "stderr"), daemon=True),
-            threading.Thread(target=poll_job_completion, daemon=True),
-        ]
-
-        _ = list(map(lambda t: t.start(), self.process_handlers))
+                stream.close()
+            except Exception as _:
+                pass
+            return False
+        return len(data) == self.READ_CHUNK_SIZE
+
+    def append_output(self, stream_name, data):
+        """
+        split output into lines at LF, CRLF or a lone CR (each ends up as LF, as with universal newlines),
+        the last incomplete one waits for more data; `b""` ends the stream
+        """
+        buffer, held = self.partials[stream_name] + data, b""
+        if data.endswith(b"\r"):  # an LF may follow in the next chunk
+            buffer, held = buffer[:-1], b"\r"
+        lines = LINE_BREAK.split(buffer) if b"\r" in buffer else buffer.split(b"\n")
+        partial = lines.pop() + held
+        lines = [line + b"\n" for line in lines]
+        if partial and (not data or len(partial) >= self.streams_limit):
+            lines.append(partial)
+            partial = b""
+        self.partials[stream_name] = partial
+        if lines:
+            with self.lock:
+                self.streams[stream_name].extend(lines)
+            self._notify()
+        if not data:
+            with self.lock:
+                self.streams[stream_name].close()
+
+    def _on_process_exit(self):
+        usage = read_process_usage(self.process.pid)  # not reaped yet: final totals including its children
+        if usage is not None:
+            self.update_usage(usage[0], 0, *usage[2:])
+        for fd in list(self.readers):
+            for _ in range(self.DRAIN_MAX_CHUNKS):
+                if not self._read_stream(fd):
+                    break
+        self.wait_job_completion()
 
     def __del__(self):
         self.kill()
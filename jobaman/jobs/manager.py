@@ -1,27 +1,210 @@
+import collections
+import dataclasses
+import functools
+import heapq
+import itertools
+import os
+import shlex
 import subprocess
 import threading
+import time
+import urllib.parse
+import uuid
 
-from jobaman.helpers import synchronized
-from jobaman.jobs.job import Job, JobState
+from jobaman.helpers import get_process_start_time, synchronized
+from jobaman.jobs.index import JobIndex
+from jobaman.jobs.job import Job, JobSpec, JobState
+from jobaman.jobs.pool import WorkerPool
+from jobaman.jobs.process import AdoptedProcess, ExitedProcess
+from jobaman.jobs.reactor import Reactor
+from jobaman.jobs.registry import Registry
+from jobaman.jobs.sampler import Sampler
 from jobaman.logger import get_logger
+from jobaman.metrics import DURATION_BUCKETS, Counter, Histogram, TimedLock
 
 log = get_logger()
 
+SPAWN_DURATION = Histogram("jobaman_spawn_duration_seconds", "time to spawn a job process")
+LOCK_WAIT = Histogram("jobaman_manager_lock_wait_seconds", "time waited for the manager lock when it was held")
+QUEUE_WAIT = Histogram("jobaman_job_queue_wait_seconds", "time from submission to start", buckets=DURATION_BUCKETS)
+JOB_DURATION = Histogram("jobaman_job_duration_seconds", "job run time", ("state",), buckets=DURATION_BUCKETS)
+JOB_EXIT_CODES = Counter("jobaman_job_exit_codes_total", "completed jobs by exit code", ("exit_code",))
+JOBS_REJECTED = Counter("jobaman_jobs_rejected_total", "submissions rejected", ("reason",))
+
+
+class CapacityError(ValueError):
+    """no free slot and no room in the queue for a submission, see `Manager.free_slot_eta`"""
+
 
 class Manager:
 
     CMD_ENCODING = "utf-8"
     ENTRYPOINT_DEFAULT = None
+    SPOOL_MEMORY_BYTES_DEFAULT = 64 * 1024
+    REGISTRY_LOAD_LIMIT_DEFAULT = 10_000
+    FINISHED_STATES = (JobState.DONE, JobState.KILLED, JobState.LOST)
+    RETENTION_INTERVAL = 1.0
+    RETENTION_BATCH = 1000  # finished jobs evicted per reactor turn
+    DURATION_WEIGHT = 0.05  # of the last job in the mean run time
 
-    def __init__(self, config=None):
+    def __init__(self, config=None, restore=True):
         self.jobs = {}
-        self.lock = threading.Lock()
+        self.by_state = {state: {} for state in JobState}  # state -> {job_id: job}, kept on transitions
+        self.finished = collections.OrderedDict()  # job_id -> bytes kept in memory, in completion order
+        self.finished_bytes = 0
+        self.index = JobIndex()  # sorted by start time per state and label, for listings
+        self.lock = TimedLock(threading.RLock(), LOCK_WAIT)  # job transition callbacks may come while it is held
+        self.reactor = Reactor()
+        self.registry = None
+        self.queue = {}  # label -> heap of (-priority, turn, job_id, job), cancelled jobs are dropped lazily
+        self.queued = set()
+        self.waiting = {}  # job_id -> ids of the jobs it waits for, see `run_task`
+        self.dependents = collections.defaultdict(set)  # job_id -> ids of the jobs waiting for it
+        self.running_labels = collections.Counter()
+        self.label_turns = {}  # label -> turn of its last started job
+        self.turns = itertools.count()
+        self.closing = False
+        self.handing_over = False  # see `export_jobs`
+        self.kill_grace = Job.KILL_GRACE_DEFAULT
+        self.sampler = None
+        self.pool = None
+        self.version = 0  # bumped on every job addition, transition and removal
+        self.job_seconds = 0.0  # moving mean of the job run time
         if config:
-            self.configure(config)
+            self.configure(config, restore=restore)
 
-    def configure(self, config):
+    def configure(self, config, restore=True):
+        """`restore=False`: do not reload the registry, the jobs are taken over from another jobaman instead"""
         self.entrypoint = config.get("entrypoint", self.ENTRYPOINT_DEFAULT)
         self.max_jobs = int(config.get("max_jobs", 10))
+        self.max_queue = int(config.get("max_queue", 0) or 0)
+        self.kill_grace = float(config.get("kill_grace_period", 0) or Job.KILL_GRACE_DEFAULT)
+        self.stream_max_bytes = int(config.get("stream_max_bytes", 0) or 0) or Job.STREAM_MAX_BYTES_DEFAULT
+        self.spool_dir = config.get("output_spool_dir") or None
+        self.spool_memory_bytes = (
+            int(config.get("output_spool_memory_bytes", 0) or 0) or self.SPOOL_MEMORY_BYTES_DEFAULT
+        )
+        self.spool_retention = int(config.get("output_spool_retention", 0) or 0)
+        if self.spool_dir:
+            os.makedirs(self.spool_dir, exist_ok=True)
+        self.retention_age = int(config.get("jobs_retention_age", 0) or 0)
+        self.retention_count = int(config.get("jobs_retention_count", 0) or 0)
+        self.retention_bytes = int(config.get("jobs_retention_bytes", 0) or 0)
+        if self.retention_age or self.retention_count or self.retention_bytes:
+            self.reactor.call_later(self.RETENTION_INTERVAL, self._retention_tick)
+        pool_size = int(config.get("worker_pool_size", 0) or 0)
+        pool_command = config.get("worker_pool_command") or None
+        if pool_size > 0 and pool_command:
+            self.pool = WorkerPool(
+                shlex.split(pool_command),
+                pool_size,
+                self.reactor,
+                max_tasks=int(config.get("worker_pool_max_tasks", 0) or 0),
+                max_rss=int(config.get("worker_pool_max_rss", 0) or 0),
+            )
+        sample_interval = float(config.get("usage_sample_interval", 0) or 0)
+        if sample_interval > 0:
+            self.sampler = Sampler(self.running_jobs_snapshot, interval=sample_interval)
+        registry_path = config.get("registry_path") or None
+        if registry_path:
+            self.registry = Registry(registry_path)
+            load_limit = config.get("registry_load_limit") or self.REGISTRY_LOAD_LIMIT_DEFAULT
+            if restore:
+                self._restore_jobs(int(load_limit))
+
+    @synchronized
+    def _restore_jobs(self, limit):
+        """reload the job history, adopt jobs of a previous instance that are still running, queue the queued ones"""
+        queued = []
+        for record in self.registry.load(limit=limit):
+            job_id, state = record["job_id"], JobState(record["state"])
+            process = self._adopt_process(record) if state == JobState.RUNNING else None
+            if state == JobState.RUNNING and process is None:
+                state = JobState.LOST
+            if state != JobState.QUEUED and process is None:
+                process = ExitedProcess(record["pid"], record["exit_code"])
+            streams_limit = self.spool_memory_bytes if self.spool_dir else self.stream_max_bytes
+            job = Job.restore(record, process, state, encoding=self.CMD_ENCODING, streams_limit=streams_limit)
+            if state != record["state"]:
+                self.registry.record(job_id, job)
+            self._add_job(job_id, job)
+            if job.state == JobState.RUNNING:
+                self.running_labels[job.label] += 1
+                job.reactor = self.reactor  # for kill escalation timers
+                self.reactor.watch_exit(process, job.wait_job_completion)
+            elif job.state == JobState.QUEUED:
+                queued.append((job_id, job))
+        for job_id, job in queued:  # once all the jobs they may depend on are known
+            self._wait_or_enqueue(job_id, job)
+        self._schedule()
+        log.info(
+            "restored %d jobs from %s, %d running, %d queued",
+            len(self.jobs),
+            self.registry,
+            self._running_jobs_count,
+            len(queued),
+        )
+
+    def _adopt_process(self, record):
+        pid, pid_start = record["pid"], record["pid_start"]
+        if not pid or pid_start is None or get_process_start_time(pid) != pid_start:
+            return None
+        try:
+            return AdoptedProcess(pid)
+        except OSError as e:
+            log.error("cannot adopt job process pid=%s: %s", pid, e)
+            return None
+
+    def _on_job_transition(self, job_id, job):
+        if self.registry is not None:
+            self.registry.record(job_id, job)
+        self._on_job_state(job_id, job)
+
+    @synchronized
+    def _on_job_state(self, job_id, job):
+        if self.jobs.get(job_id) is not job:
+            return
+        self._index(job_id, job)
+        if job.state not in self.FINISHED_STATES:
+            return
+        self._release_dependents(job_id, job)
+        if job.ts_started is None:  # cancelled while queued
+            self.queued.discard(job)
+            self.waiting.pop(job_id, None)
+            return
+        duration = time.monotonic() - job.queued_at - job.queue_wait
+        JOB_DURATION.observe(duration, job.state)
+        self.job_seconds += (duration - self.job_seconds) * self.DURATION_WEIGHT
+        JOB_EXIT_CODES.inc(str(job.exit_code))
+        self.running_labels[job.label] -= 1
+        self._schedule()
+
+    def _index(self, job_id, job):
+        self.version += 1
+        self.index.update(job_id, job)
+        state = job.state
+        for jobs in self.by_state.values():
+            jobs.pop(job_id, None)
+        self.by_state[state][job_id] = job
+        if state in self.FINISHED_STATES:
+            if job_id not in self.finished:
+                self.finished[job_id] = job.streams_size
+                self.finished_bytes += self.finished[job_id]
+        elif job_id in self.finished:
+            self.finished_bytes -= self.finished.pop(job_id)
+
+    def _remove(self, job_id, unindex=True):
+        """forget the job; with `unindex=False` the caller removes it from `self.index` (in bulk)"""
+        self.version += 1
+        if unindex:
+            self.index.remove(job_id)
+        job = self.jobs.pop(job_id)
+        for jobs in self.by_state.values():
+            jobs.pop(job_id, None)
+        if job_id in self.finished:
+            self.finished_bytes -= self.finished.pop(job_id)
+        job.release()
+        return job
 
     def _build_command(self, command):
         if not command and not self.entrypoint:
@@ -35,30 +218,271 @@ class Manager:
         return command
 
     @synchronized
-    def run_task(self, command, job_id=None):
-        if job_id and job_id in self.jobs and self.jobs[job_id].state == JobState.RUNNING:
-            raise ValueError(f"job_id {job_id} already exists and is running")
-        if self._running_jobs_count >= self.max_jobs:
-            raise ValueError("max_jobs limit reached")
-        command_run = self._build_command(command)
-        log.debug("command=%s", command_run)
-        process = subprocess.Popen(
-            command_run,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
+    def run_task(self, command, job_id=None, output_bytes=None, **options):
+        """
+        start the command, or queue it when `max_jobs` are running, `options` are the other `JobSpec` fields:
+        queued jobs are started as running jobs complete, higher `priority` first,
+        jobs of equal priority take turns by `label`;
+        a job waits (queued) until all the jobs in `after` have finished with exit code 0, it is cancelled
+        as soon as one of them fails; the stdout of `stdin_job` is its stdin (it waits for that job too)
+        """
+        spec = self._check_spec(JobSpec(command, **options))
+        spec.command = self._check_task(command, job_id, output_bytes)
+        spec.after = self._check_after(spec.after, spec.stdin_job)
+        self._check_capacity(1)
+        return self._submit(spec, job_id, output_bytes)
+
+    @synchronized
+    def run_batch(self, tasks):
+        """
+        `run_task` for every task (a dict of its arguments) under one lock acquisition:
+        either the whole batch is valid and fits into the free slots and the queue, or nothing is submitted;
+        `after` and `stdin_job` of a task may refer to earlier tasks of the batch by their position (a DAG);
+        return the job ids, an `OSError` in place of a job that failed to spawn
+        """
+        job_ids = [task.get("job_id") for task in tasks]
+        if len(set(filter(None, job_ids))) != len(list(filter(None, job_ids))):
+            raise ValueError("duplicate job_id in batch")
+        refs = []
+        for i, task in enumerate(tasks):
+            after = [self._batch_ref(ref, i, job_ids) for ref in task.get("after") or ()]
+            stdin_job = task.get("stdin_job")
+            refs.append((after, self._batch_ref(stdin_job, i, job_ids) if stdin_job is not None else None))
+        submits = []
+        for i, task in enumerate(tasks):
+            command_run = self._check_task(task.get("command"), job_ids[i], task.get("output_bytes"))
+            after = self._check_after(*refs[i], batch_ids=job_ids[:i])
+            spec = self._check_spec(JobSpec(command_run, task.get("priority"), task.get("label"), after, refs[i][1]))
+            submits.append((spec, job_ids[i], task.get("output_bytes")))
+        self._check_capacity(len(submits))
+        results = []
+        for submit in submits:
+            try:
+                results.append(self._submit(*submit))
+            except OSError as e:
+                log.error("job failed to start: %s", e)
+                results.append(e)
+        return results
+
+    def _check_task(self, command, job_id, output_bytes):
+        if job_id and job_id in self.jobs and self.jobs[job_id].state in (JobState.RUNNING, JobState.QUEUED):
+            JOBS_REJECTED.inc("job_id_exists")
+            raise ValueError(f"job_id {job_id} already exists and is {self.jobs[job_id].state}")
+        if output_bytes is not None and int(output_bytes) <= 0:
+            raise ValueError(f"invalid output_bytes: {output_bytes}")
+        return self._build_command(command)
+
+    @staticmethod
+    def _check_spec(spec):
+        """the `JobSpec` with its priority and label coerced, `ValueError` if they are invalid"""
+        try:
+            spec.priority = int(spec.priority or 0)
+        except (TypeError, ValueError):
+            raise ValueError(f"invalid priority: {spec.priority!r}") from None
+        if not isinstance(spec.label or "", str):
+            raise ValueError(f"invalid label: {spec.label!r}")
+        spec.label = spec.label or ""
+        return spec
+
+    @staticmethod
+    def _batch_ref(ref, position, job_ids):
+        """the job id a batch task refers to: an id as is, or the position of an earlier task (which gets an id)"""
+        if isinstance(ref, str):
+            return ref
+        if not isinstance(ref, int) or not 0 <= ref < position:
+            raise ValueError(f"invalid reference {ref!r}: a job id or the position of an earlier job of the batch")
+        job_ids[ref] = job_ids[ref] or uuid.uuid4().hex
+        return job_ids[ref]
+
+    def _check_after(self, after, stdin_job, batch_ids=()):
+        """the ids of the jobs to wait for, `ValueError` if one of them is unknown or has failed already"""
+        after = list(dict.fromkeys([*(after or ()), *([stdin_job] if stdin_job is not None else [])]))
+        for dependency_id in after:
+            if dependency_id in batch_ids:
+                continue
+            if dependency_id not in self.jobs:
+                raise ValueError(f"dependency job_id {dependency_id} not found")
+            if self._failed(self.jobs[dependency_id]):
+                raise ValueError(f"dependency job_id {dependency_id} has failed")
+        if stdin_job is not None and stdin_job not in batch_ids and not self.jobs[stdin_job].streams["stdout"].complete:
+            raise ValueError(f"stdin job_id {stdin_job} has dropped output lines (no spool dir)")
+        return after
+
+    @staticmethod
+    def _failed(job):
+        """a finished job its dependents are cancelled for; exit codes of adopted jobs are unknown, not failures"""
+        return job.state in (JobState.KILLED, JobState.LOST) or job.exit_code not in (0, None)
+
+    def _check_capacity(self, count):
+        free = max(0, self.max_jobs - self._running_jobs_count) if not self.queued else 0
+        if count > free + max(0, self.max_queue - len(self.queued) - len(self.waiting)):
+            reason = "max_queue" if self.max_queue else "max_jobs"
+            JOBS_REJECTED.inc(reason, value=count)
+            raise CapacityError(f"{reason} limit reached")
+
+    @synchronized
+    def free_slot_eta(self):
+        """seconds until a submission may fit: the jobs ahead of it (queued) over the slots, at the mean run time"""
+        queued = len(self.queued) + len(self.waiting)
+        return self.job_seconds * (queued + 1) / max(1, self.max_jobs)
+
+    def _submit(self, spec, job_id, output_bytes):
+        log.debug("command=%s", spec.command)
+        if self._running_jobs_count >= self.max_jobs or self.queued or self.pool is not None or spec.after:
+            job_id = job_id or uuid.uuid4().hex  # the pid is not unique for pool tasks either
+        spec.after = spec.after or []
+        job = Job(
+            None,
+            state=JobState.QUEUED,
+            spec=spec,
             encoding=self.CMD_ENCODING,
-            errors="ignore",
-            shell=False,
-            bufsize=1,
-            start_new_session=True,
+            streams_limit=output_bytes or (self.spool_memory_bytes if self.spool_dir else self.stream_max_bytes),
         )
-        job_id = job_id or str(process.pid)
-        job = Job(process, state=JobState.RUNNING)
-        self.jobs[job_id] = job
-        log.info("job started: %s=%s", job_id, job)
+        if job_id is None:  # the pid is the job id, start right away
+            process = self._spawn(spec.command)
+            job_id = str(process.pid)
+            self._add_job(job_id, job)
+            self._start_job(job_id, job, process)
+        else:
+            self._add_job(job_id, job)
+            self._wait_or_enqueue(job_id, job)
+            self._schedule()
+        log.info("job %s: %s=%s", job.state, job_id, job)
         return job_id
 
+    def _add_job(self, job_id, job):
+        job.on_transition = functools.partial(self._on_job_transition, job_id)
+        if job_id in self.jobs:
+            self._remove(job_id)
+        self.jobs[job_id] = job
+        self._index(job_id, job)
+
+    def _spawn(self, command_run, stdin_job=None):
+        # no preexec_fn (nor user/group/umask changes): Popen then uses vfork,
+        # so spawning under the lock does not grow with the RSS of this process (see bench.spawn)
+        ts = time.perf_counter()
+        if self.pool is not None and stdin_job is None:  # a warm worker runs the task, it gets the arguments only
+            process = self.pool.run(command_run[1:] if self.entrypoint else command_run)
+            if process is not None:
+                SPAWN_DURATION.observe(time.perf_counter() - ts)
+                return process
+        # the output of a finished job as a file: the process reads it directly, not through a pipe from us
+        stdin = self.jobs[stdin_job].open_output("stdout") if stdin_job is not None else None
+        try:
+            process = subprocess.Popen(
+                command_run,
+                stdin=stdin,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                shell=False,
+                start_new_session=True,
+            )
+        finally:
+            if stdin is not None:
+                os.close(stdin)
+        SPAWN_DURATION.observe(time.perf_counter() - ts)
+        return process
+
+    def _start_job(self, job_id, job, process=None):
+        try:
+            process = process or self._spawn(job.command, stdin_job=job.stdin_job)
+        except (OSError, KeyError) as e:
+            log.error("job %s failed to start: %s", job_id, e)
+            job.kill()
+            return
+        if not job.start(process, self.reactor, spool_path=self._spool_path(job_id, process.pid)):
+            process.kill()
+            process.wait()
+            return
+        QUEUE_WAIT.observe(job.queue_wait)
+        self.running_labels[job.label] += 1
+        self.label_turns[job.label] = next(self.turns)
+
+    def _wait_or_enqueue(self, job_id, job):
+        """queue the job, or make it wait for its dependencies that have not finished yet"""
+        pending = set()
+        for dependency_id in job.after:
+            dependency = self.jobs.get(dependency_id)
+            if dependency is None or self._failed(dependency):
+                log.info("job %s cancelled: dependency %s is gone or has failed", job_id, dependency_id)
+                job.kill()
+                return
+            if dependency.state not in self.FINISHED_STATES:
+                pending.add(dependency_id)
+        if not pending:
+            self._enqueue(job_id, job)
+            return
+        self.waiting[job_id] = pending
+        for dependency_id in pending:
+            self.dependents[dependency_id].add(job_id)
+        self._on_job_transition(job_id, job)
+
+    def _release_dependents(self, job_id, job):
+        """a job has finished: queue the jobs that waited only for it, or cancel them all if it has failed"""
+        failed = self._failed(job)
+        for dependent_id in self.dependents.pop(job_id, ()):
+            pending = self.waiting.get(dependent_id)
+            if pending is None:  # cancelled meanwhile
+                continue
+            if failed:
+                del self.waiting[dependent_id]
+                log.info("job %s cancelled: dependency %s is %s", dependent_id, job_id, job.state)
+                self.jobs[dependent_id].kill()
+                continue
+            pending.discard(job_id)
+            if not pending:
+                del self.waiting[dependent_id]
+                self._enqueue(dependent_id, self.jobs[dependent_id])
+
+    def _enqueue(self, job_id, job):
+        heapq.heappush(self.queue.setdefault(job.label, []), (-job.priority, next(self.turns), job_id, job))
+        self.queued.add(job)
+        self._on_job_transition(job_id, job)
+
+    def _dequeue(self):
+        """the next queued job: highest priority, then the label with the fewest running jobs and the oldest turn"""
+        best, best_label = None, None
+        for label, heap in list(self.queue.items()):
+            while heap and heap[0][3] not in self.queued:
+                heapq.heappop(heap)
+            if not heap:
+                del self.queue[label]
+                continue
+            key = (heap[0][0], self.running_labels[label], self.label_turns.get(label, -1), heap[0][1])
+            if best is None or key < best:
+                best, best_label = key, label
+        if best_label is None:
+            return None, None
+        _, _, job_id, job = heapq.heappop(self.queue[best_label])
+        self.queued.discard(job)
+        return job_id, job
+
+    @synchronized
+    def _schedule(self):
+        while not (self.closing or self.handing_over) and self.queued and self._running_jobs_count < self.max_jobs:
+            job_id, job = self._dequeue()
+            if job is None:
+                break
+            self._start_job(job_id, job)
+
+    def _spool_path(self, job_id, pid):
+        if not self.spool_dir:
+            return None
+        return os.path.join(self.spool_dir, f"{urllib.parse.quote(job_id, safe='')}.{pid}")
+
+    def _sweep_spool(self):
+        """remove spool files not owned by any known job and older than `spool_retention` seconds"""
+        if not self.spool_dir or not self.spool_retention:
+            return
+        owned = {os.path.basename(job.spool_path) for job in self.jobs.values() if job.spool_path}
+        expired = time.time() - self.spool_retention
+        for entry in os.scandir(self.spool_dir):
+            try:
+                if entry.name.rpartition(".")[0] not in owned and entry.stat().st_mtime < expired:
+                    os.unlink(entry.path)
+            except OSError as e:
+                log.error("error removing spool file %s: %s", entry.path, e)
+
     @synchronized
     def __getitem__(self, job_id):
         return self.jobs[job_id]
@@ -70,11 +494,39 @@ class Manager:
     @property
     @synchronized
     def running_jobs(self):
-        return {job_id: job for job_id, job in self.jobs.items() if job.state == JobState.RUNNING}
+        return dict(self.by_state[JobState.RUNNING])
+
+    def running_jobs_snapshot(self):
+        """the running jobs, for the `Sampler`"""
+        return list(self.running_jobs.values())
+
+    @property
+    @synchronized
+    def active_jobs(self):
+        """running and queued jobs"""
+        return {**self.by_state[JobState.RUNNING], **self.by_state[JobState.QUEUED]}
+
+    @property
+    @synchronized
+    def queued_jobs_count(self):
+        """queued jobs, including those waiting for their dependencies"""
+        return len(self.queued) + len(self.waiting)
+
+    @property
+    @synchronized
+    def jobs_count_by_state(self):
+        return {state.value: len(jobs) for state, jobs in self.by_state.items()}
+
+    @property
+    @synchronized
+    def streams_size(self):
+        """job output bytes kept in memory: active jobs now, finished ones as of their completion"""
+        active = {**self.by_state[JobState.RUNNING], **self.by_state[JobState.QUEUED]}
+        return sum(job.streams_size for job in active.values()) + self.finished_bytes
 
     @property
     def _running_jobs_count(self):
-        return sum((1 for job in self.jobs.values() if job.state == JobState.RUNNING))
+        return len(self.by_state[JobState.RUNNING])
 
     @property
     @synchronized
@@ -83,23 +535,197 @@ class Manager:
 
     @synchronized
     def purge(self):
-        jobs = {}
-        for job_id, job in self.jobs.items():
-            if job.state not in (JobState.DONE, JobState.KILLED):
-                jobs[job_id] = job
-        self.jobs = jobs
+        purged = []
+        while self.finished:
+            purged.append(next(iter(self.finished)))
+            self._remove(purged[-1], unindex=False)
+        self.index.remove_many(purged)
+        self._sweep_spool()
         return len(self.jobs)
 
+    def _retention_tick(self):
+        """evict expired finished jobs a batch at a time (reactor thread)"""
+        if self.closing:
+            return
+        more = self._evict(self.RETENTION_BATCH)
+        self.reactor.call_later(0 if more else self.RETENTION_INTERVAL, self._retention_tick)
+
     @synchronized
-    def shutdown(self):
-        for job_id, job in self.jobs.items():
-            if job.state != JobState.RUNNING:
-                continue
+    def _evict(self, limit):
+        """drop the oldest finished jobs over the retention limits, return `True` if the limit was hit"""
+        expired = time.time() - self.retention_age if self.retention_age else None
+        evicted = []
+        while self.finished and len(evicted) < limit:
+            job_id = next(iter(self.finished))
+            job = self.jobs[job_id]
+            if not (
+                (self.retention_count and len(self.finished) > self.retention_count)
+                or (self.retention_bytes and self.finished_bytes > self.retention_bytes)
+                or (expired is not None and (job.ts_completed or job.ts_started or 0) < expired)
+            ):
+                break
+            self._remove(job_id, unindex=False)
+            evicted.append(job_id)
+        self.index.remove_many(evicted)
+        if evicted:
+            log.debug("evicted %d finished jobs, %d left", len(evicted), len(self.finished))
+        return len(evicted) == limit
+
+    @synchronized
+    def kill_jobs(self, job_ids=None, state=None, label=None, grace=None):
+        """
+        kill (or cancel) jobs by id, or all running and queued jobs, optionally only in `state` and with `label`:
+        SIGTERM to all of them now and one timer to SIGKILL the leftovers after `grace` seconds;
+        return ids of the jobs killed
+        """
+        killed = self._terminate_jobs(self._select_jobs(job_ids, state, label))
+        grace = self.kill_grace if grace is None else grace
+        if killed:
+            self.reactor.call_later(grace, self._escalate, list(killed.values()))
+        return list(killed)
+
+    @synchronized
+    def query_jobs(self, selection):
+        """
+        a page of jobs of the `JobSelection` (states by name or `JobState`), see `JobIndex.select`;
+        return ({job_id: job} in start time order, number of all matching jobs, cursor of the next page or `None`)
+        """
+        states = tuple(JobState(state) for state in selection.states)
+        job_ids, total, next_cursor = self.index.select(dataclasses.replace(selection, states=states))
+        return {job_id: self.jobs[job_id] for job_id in job_ids}, total, next_cursor
+
+    def _select_jobs(self, job_ids=None, state=None, label=None):
+        if job_ids is not None:
+            jobs = {job_id: self.jobs[job_id] for job_id in job_ids if job_id in self.jobs}
+        elif state is not None:
+            jobs = dict(self.by_state[JobState(state)])
+        else:
+            jobs = {**self.by_state[JobState.QUEUED], **self.by_state[JobState.RUNNING]}
+        if label is not None:
+            jobs = {job_id: job for job_id, job in jobs.items() if job.label == label}
+        return jobs
+
+    @synchronized
+    def _terminate_jobs(self, jobs):
+        """queued ones first: slots freed by killed jobs must not start them"""
+        killed = {}
+        for job_id, job in sorted(jobs.items(), key=lambda item: item[1].state != JobState.QUEUED):
             try:
-                job.kill()
-                log.info("job terminated: %s:%s", job_id, job)
+                if job.terminate():
+                    killed[job_id] = job
             except Exception as e:
                 log.error("error terminating job %s: %s", job_id, e)
+        if killed:
+            log.info("%d jobs terminated", len(killed))
+        return killed
+
+    def _escalate(self, jobs):
+        for job in jobs:
+            if job.process is not None:
+                job.escalate()
+
+    def export_jobs(self, writer):
+        """
+        stop handling the jobs and export them for `import_jobs` in another jobaman, in listing order:
+        queued jobs are not started, running pool tasks are waited for (at most a kill grace period, they are
+        exported as lost then), the reactor is paused, so pipes are no longer read nor exits reaped;
+        `resume` if they could not be handed over, `detach_jobs` if they were
+        """
+        with self.lock:
+            self.handing_over = True
+        deadline = time.monotonic() + self.kill_grace
+        while self._pool_tasks() and time.monotonic() < deadline:
+            time.sleep(1 / 100)
+        self.reactor.pause()
+        if self.registry is not None:
+            self.registry.flush()
+        with self.lock:
+            pool_tasks = self._pool_tasks()
+            records = []
+            for job_id in sorted(self.jobs, key=self.index.cursor):
+                job = self.jobs[job_id]
+                killed = job.state == JobState.KILLED and isinstance(job.process, subprocess.Popen)
+                if killed and job.process.poll() is None:
+                    job.escalate()  # its pending SIGKILL timer is not handed over
+                record = {"job_id": job_id, **job.export(writer), "pidfd": None}
+                if job in pool_tasks:
+                    record.update(state=JobState.LOST.value, ts_completed=int(time.time()), pipes={})
+                elif job.state == JobState.RUNNING:
+                    record["pidfd"] = writer.fd(self._open_pidfd(job.process), owned=True)
+                records.append(record)
+        return records
+
+    def _pool_tasks(self):
+        return [job for job in self.running_jobs.values() if hasattr(job.process, "attach")]
+
+    def _open_pidfd(self, process):
+        try:
+            return os.dup(process.pidfd) if getattr(process, "pidfd", None) is not None else os.pidfd_open(process.pid)
+        except OSError as e:
+            log.error("cannot open pidfd of pid=%s: %s", process.pid, e)
+            return None
+
+    def resume(self):
+        """handle the jobs again after `export_jobs`"""
+        self.reactor.resume()
+        with self.lock:
+            self.handing_over = False
+            self._schedule()
+
+    @synchronized
+    def detach_jobs(self):
+        """after `export_jobs`, once another jobaman has taken the jobs over: they are never touched here again"""
+        for job in self.jobs.values():
+            job.detach()
+        if self.registry is not None:
+            self.registry.close()
+
+    @synchronized
+    def import_jobs(self, records, reader):
+        """take over the jobs exported by another jobaman: running ones keep running, queued ones are queued"""
+        queued = []
+        for record in records:
+            job_id, state = record["job_id"], JobState(record["state"])
+            process = None
+            if state == JobState.RUNNING:
+                pipes = {name: open(reader.fd(index), "rb", buffering=0) for name, index in record["pipes"].items()}
+                try:
+                    process = AdoptedProcess(record["pid"], pidfd=reader.fd(record["pidfd"]), **pipes)
+                except OSError as e:
+                    log.error("cannot adopt job %s process pid=%s: %s", job_id, record["pid"], e)
+                    for pipe in pipes.values():
+                        pipe.close()
+                    record.update(state=JobState.LOST.value, ts_completed=int(time.time()))
+            if state != JobState.QUEUED and process is None:
+                process = ExitedProcess(record["pid"], record["exit_code"])
+            job = Job.from_export(record, reader, process)
+            self._add_job(job_id, job)
+            if job.state == JobState.RUNNING:
+                self.running_labels[job.label] += 1
+                job.adopt(self.reactor)
+            elif job.state == JobState.QUEUED:
+                queued.append((job_id, job))
+        for job_id, job in queued:  # once all the jobs they may depend on are known
+            self._wait_or_enqueue(job_id, job)
+        self._schedule()
+        log.info("took over %d jobs, %d running, %d queued", len(records), self._running_jobs_count, len(queued))
+
+    def shutdown(self):
+        """terminate all jobs, wait for them at most one grace period, then SIGKILL the rest"""
+        with self.lock:
+            self.closing = True
+            killed = self._terminate_jobs(self._select_jobs())
+        if self.sampler is not None:
+            self.sampler.stop()
+        processes = [job.process for job in killed.values() if job.process is not None]
+        deadline = time.monotonic() + self.kill_grace
+        while any(process.poll() is None for process in processes) and time.monotonic() < deadline:
+            time.sleep(1 / 100)
+        self._escalate(killed.values())
+        if self.pool is not None:
+            self.pool.close()
+        if self.registry is not None:
+            self.registry.close()
 
     def __del__(self):
         self.shutdown()
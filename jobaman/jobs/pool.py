@@ -0,0 +1,324 @@
+"""
+Warm worker pool: pre-started entrypoint processes running one task at a time,
+so short jobs do not pay for interpreter startup and imports every time.
+
+Protocol, over the worker's stdin/stdout:
+
+- jobaman -> worker: a task is one line, the JSON list of its arguments;
+- worker -> jobaman: frames `<kind> <length>\\n<payload>`, `kind` is `stdout` or `stderr` (task output)
+  or `exit` (payload: the decimal exit code, the task is done and the worker is idle again).
+
+A worker exits when its stdin is closed; its own stderr is jobaman's stderr.
+`serve()` is the worker side for Python entrypoints.
+"""
+
+import collections
+import io
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import traceback
+
+from jobaman.jobs.sampler import read_process_stat, read_process_usage
+from jobaman.logger import get_logger
+
+log = get_logger()
+
+FRAME_KINDS = (b"stdout", b"stderr", b"exit")
+FRAME_HEADER_MAX = 64
+
+
+class WorkerTask:
+    """
+    `Popen`-like handle of a task run by a pool worker: `pid` is the worker,
+    so killing the task's process group kills the worker (the pool starts a new one);
+    once the task is complete, signals are not sent: the worker may run another task by then.
+    """
+
+    stdout = None
+    stderr = None
+
+    def __init__(self, worker):
+        self.worker = worker
+        self.pid = worker.process.pid
+        # the worker's usage so far (cpu seconds, rss, read bytes, write bytes), not the task's, see `Sampler`
+        self.usage_base = read_process_usage(self.pid) or (0.0, 0, 0, 0)
+        self.returncode = None
+        self.job = None
+        self.pending = []  # output that came before the job was attached
+
+    def __repr__(self) -> str:
+        return f"WorkerTask(pid={self.pid}, returncode={self.returncode})"
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+    def send_signal(self, sig):
+        if self.returncode is not None:
+            return
+        try:
+            os.killpg(self.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+    def attach(self, job):
+        """(reactor thread) deliver the task output and exit to `job`"""
+        self.job = job
+        for stream_name, data in self.pending:
+            job.append_output(stream_name, data)
+        self.pending = []
+        if self.returncode is not None:
+            self._finish()
+
+    def output(self, stream_name, data):
+        if self.job is None:
+            self.pending.append((stream_name, data))
+        elif data:
+            self.job.append_output(stream_name, data)
+
+    def complete(self, returncode):
+        self.returncode = returncode
+        if self.job is not None:
+            self._finish()
+
+    def _finish(self):
+        for stream_name in self.job.STREAMS:
+            self.job.append_output(stream_name, b"")
+        self.job.wait_job_completion()
+
+
+class Worker:
+
+    def __init__(self, process):
+        self.process = process
+        self.task = None
+        self.tasks_done = 0
+        self.buffer = b""
+
+    def __repr__(self) -> str:
+        return f"Worker(pid={self.process.pid}, tasks_done={self.tasks_done}, busy={self.task is not None})"
+
+
+class WorkerPool:
+    """
+    `size` workers started with `command`, I/O handled in the reactor thread;
+    a worker is replaced after `max_tasks` tasks, when its RSS exceeds `max_rss` bytes, or when it dies.
+    """
+
+    MAX_TASKS_DEFAULT = 1000
+    READ_CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, command, size, reactor, max_tasks=None, max_rss=None):
+        self.command = command
+        self.size = size
+        self.reactor = reactor
+        self.max_tasks = max_tasks or self.MAX_TASKS_DEFAULT
+        self.max_rss = max_rss or None
+        self.lock = threading.Lock()
+        self.workers = set()  # live workers, retired ones excluded
+        self.idle = collections.deque()
+        self.closed = False
+        for _ in range(size):
+            self._start_worker()
+
+    def __repr__(self) -> str:
+        return f"WorkerPool(size={self.size}, workers={len(self.workers)}, idle={len(self.idle)})"
+
+    def run(self, args):
+        """hand `args` to an idle worker, `None` if all of them are busy"""
+        line = json.dumps(args).encode() + b"\n"
+        with self.lock:
+            while self.idle:
+                worker = self.idle.popleft()
+                task = worker.task = WorkerTask(worker)
+                try:
+                    worker.process.stdin.write(line)
+                    worker.process.stdin.flush()
+                except OSError as e:  # the worker is gone, its exit callback replaces it
+                    log.error("worker %s does not take tasks: %s", worker, e)
+                    worker.task = None
+                    continue
+                return task
+        return None
+
+    def close(self):
+        """close the stdin of every worker: idle ones exit, busy ones are killed with their jobs"""
+        with self.lock:
+            self.closed = True
+            workers, self.idle = list(self.workers), collections.deque()
+        for worker in workers:
+            self._close_stdin(worker)
+
+    def _start_worker(self):
+        try:
+            process = subprocess.Popen(
+                self.command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                shell=False,
+                start_new_session=True,
+            )
+        except OSError as e:
+            log.error("worker %s failed to start: %s", self.command, e)
+            return
+        worker = Worker(process)
+        os.set_blocking(process.stdout.fileno(), False)
+        with self.lock:
+            self.workers.add(worker)
+            self.idle.append(worker)
+        self.reactor.add_reader(process.stdout.fileno(), lambda fd: self._read(worker, fd))
+        self.reactor.watch_exit(process, lambda: self._on_exit(worker))
+        log.debug("worker started: %s", worker)
+
+    def _close_stdin(self, worker):
+        try:
+            worker.process.stdin.close()
+        except OSError:
+            pass
+
+    def _read(self, worker, fd):
+        """(reactor thread) read and dispatch the worker frames, `False` once there is nothing more to read"""
+        try:
+            data = os.read(fd, self.READ_CHUNK_SIZE)
+        except BlockingIOError:
+            return False
+        except OSError:
+            data = b""
+        if not data:
+            self.reactor.remove_reader(fd)
+            return False
+        worker.buffer += data
+        while True:
+            header, sep, rest = worker.buffer.partition(b"\n")
+            if not sep:
+                if len(header) > FRAME_HEADER_MAX:
+                    self._protocol_error(worker, header)
+                break
+            kind, _, length = header.partition(b" ")
+            if kind not in FRAME_KINDS or not length.isdigit():
+                self._protocol_error(worker, header)
+                break
+            length = int(length)
+            if len(rest) < length:
+                break
+            payload, worker.buffer = rest[:length], rest[length:]
+            self._on_frame(worker, kind, payload)
+        return True
+
+    def _protocol_error(self, worker, header):
+        log.error("worker %s protocol error, frame header %.64r", worker, header)
+        worker.buffer = b""
+        worker.process.kill()
+
+    def _on_frame(self, worker, kind, payload):
+        task = worker.task
+        if task is None:
+            log.error("worker %s sent %s without a task", worker, kind.decode())
+            return
+        if kind != b"exit":
+            task.output(kind.decode(), payload)
+            return
+        with self.lock:
+            worker.task = None
+            worker.tasks_done += 1
+            retire = self.closed or worker.tasks_done >= self.max_tasks or self._too_big(worker)
+            if retire:
+                self.workers.discard(worker)
+        task.complete(int(payload))  # the job is done before the worker takes another task (and signals)
+        if not retire:
+            with self.lock:
+                if worker in self.workers and not self.closed:
+                    self.idle.append(worker)
+        if retire:
+            log.debug("worker retired: %s", worker)
+            self._close_stdin(worker)
+            if not self.closed:
+                self._start_worker()
+
+    def _too_big(self, worker):
+        if not self.max_rss:
+            return False
+        stat = read_process_stat(worker.process.pid)
+        return stat is not None and stat[2] > self.max_rss
+
+    def _on_exit(self, worker):
+        """(reactor thread) a worker exited: finish its task (killed or crashed) and replace it"""
+        fd = worker.process.stdout.fileno()
+        while self._read(worker, fd):
+            pass
+        self.reactor.remove_reader(fd)
+        worker.process.stdout.close()
+        worker.process.wait()
+        with self.lock:
+            replace = worker in self.workers and not self.closed
+            self.workers.discard(worker)
+            if worker in self.idle:
+                self.idle.remove(worker)
+            task, worker.task = worker.task, None
+        if task is not None:  # killed with its job, or crashed
+            task.complete(worker.process.returncode)
+        elif replace:
+            log.warning("idle worker exited: %s, exit_code=%s", worker, worker.process.returncode)
+        if replace:
+            self._start_worker()
+
+
+class _FrameWriter(io.RawIOBase):
+
+    def __init__(self, out, kind):
+        self.out = out
+        self.kind = kind
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        send_frame(self.out, self.kind, bytes(data))
+        return len(data)
+
+
+def send_frame(out, kind, payload):
+    out.write(b"%s %d\n%s" % (kind, len(payload), payload))
+
+
+def serve(handler, encoding="utf-8"):
+    """
+    worker side, for Python entrypoints: `handler(args)` is called for every task
+    with `sys.stdout`/`sys.stderr` going to the task output; its return value is the exit code
+    (`None` is 0, `SystemExit` works as usual, an exception is 1)
+    """
+    out = os.fdopen(os.dup(1), "wb", buffering=0)
+    os.dup2(2, 1)  # stray writes to fd 1 (child processes) must not break the framing
+    stdout, stderr = sys.stdout, sys.stderr
+    for line in sys.stdin.buffer:
+        args = json.loads(line)
+        sys.stdout = io.TextIOWrapper(_FrameWriter(out, b"stdout"), encoding=encoding, write_through=True)
+        sys.stderr = io.TextIOWrapper(_FrameWriter(out, b"stderr"), encoding=encoding, write_through=True)
+        try:
+            exit_code = handler(args)
+        except SystemExit as e:
+            exit_code = e.code
+        except Exception:
+            traceback.print_exc()
+            exit_code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            sys.stdout, sys.stderr = stdout, stderr
+        if exit_code is None:
+            exit_code = 0
+        elif not isinstance(exit_code, int):
+            exit_code = 1
+        send_frame(out, b"exit", b"%d" % exit_code)
@@ -0,0 +1,73 @@
+import os
+import select
+import signal
+
+
+class ExitedProcess:
+    """stand-in for the process of a job restored from the registry that is no longer running"""
+
+    stdout = None
+    stderr = None
+
+    def __init__(self, pid, returncode=None):
+        self.pid = pid
+        self.returncode = returncode
+
+    def __repr__(self) -> str:
+        return f"ExitedProcess(pid={self.pid}, returncode={self.returncode})"
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+    def terminate(self):
+        pass
+
+    def kill(self):
+        pass
+
+
+class AdoptedProcess:
+    """
+    Still running process of a job started by a previous jobaman instance.
+    It is not our child: its exit status is unknown, `returncode` stays `None`, exit is detected with a pidfd;
+    its output pipes are gone, unless they were handed over along with the pidfd (see `jobaman.handoff`).
+    """
+
+    stdout = None
+    stderr = None
+
+    def __init__(self, pid, pidfd=None, stdout=None, stderr=None):
+        self.pid = pid
+        self.returncode = None
+        self.pidfd = pidfd if pidfd is not None else os.pidfd_open(pid)
+        self.stdout = stdout
+        self.stderr = stderr
+
+    def __repr__(self) -> str:
+        return f"AdoptedProcess(pid={self.pid})"
+
+    def poll(self):
+        return None
+
+    def wait(self, timeout=None):
+        if self.pidfd is not None:
+            ready, _, _ = select.select([self.pidfd], [], [], timeout)
+            if ready:
+                os.close(self.pidfd)
+                self.pidfd = None
+        return self.returncode
+
+    def send_signal(self, sig):
+        try:
+            os.kill(self.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
@@ -0,0 +1,143 @@
+import collections
+import heapq
+import itertools
+import os
+import selectors
+import threading
+import time
+
+from jobaman.logger import get_logger
+
+log = get_logger()
+
+
+class Reactor:
+    """
+    Single I/O thread for all jobs of a manager:
+    pipe readers and process exit watchers (via pidfd) share one selector,
+    timers run in the same thread.
+    """
+
+    EXIT_POLL_INTERVAL = 0.5
+
+    def __init__(self, name="jobaman-reactor"):
+        self.selector = selectors.DefaultSelector()
+        self.calls = collections.deque()
+        self.polled = {}
+        self.timers = []  # heap of [deadline, seq, callback, args]
+        self.timer_seq = itertools.count()
+        self.paused = False
+
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        self.selector.register(self._wakeup_r, selectors.EVENT_READ, self._on_wakeup)
+
+        self.name = name
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def __repr__(self) -> str:
+        return f"Reactor(name={self.thread.name}, fds={len(self.selector.get_map())}, polled={len(self.polled)})"
+
+    @property
+    def in_reactor_thread(self):
+        return threading.current_thread() is self.thread
+
+    def call_soon(self, callback, *args):
+        self.calls.append((callback, args))
+        if not self.in_reactor_thread:
+            self._wakeup()
+
+    def call_later(self, delay, callback, *args):
+        """call `callback(*args)` in the reactor thread after `delay` seconds, return a timer for `cancel`"""
+        timer = [time.monotonic() + delay, next(self.timer_seq), callback, args]
+        self.call_soon(heapq.heappush, self.timers, timer)
+        return timer
+
+    def cancel(self, timer):
+        timer[2] = None
+
+    def add_reader(self, fd, callback):
+        """call `callback(fd)` in the reactor thread every time `fd` is readable"""
+        self.call_soon(self.selector.register, fd, selectors.EVENT_READ, callback)
+
+    def remove_reader(self, fd):
+        """stop watching `fd`, must be called from the reactor thread (i.e. from a reader callback)"""
+        try:
+            self.selector.unregister(fd)
+        except (KeyError, ValueError):
+            pass
+
+    def pause(self):
+        """stop the reactor thread, fds stay registered and calls are kept for `resume`"""
+        self.paused = True
+        self._wakeup()
+        self.thread.join()
+
+    def resume(self):
+        self.paused = False
+        self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def watch_exit(self, process, callback):
+        """call `callback()` in the reactor thread as soon as `process` exits"""
+        try:
+            pidfd = os.dup(process.pidfd) if getattr(process, "pidfd", None) is not None else os.pidfd_open(process.pid)
+        except (AttributeError, OSError) as e:
+            log.debug("pidfd is not available for pid=%s (%s), falling back to polling", process.pid, e)
+            self.call_soon(self.polled.__setitem__, process, callback)
+            return
+
+        def on_exit(fd):
+            self.remove_reader(fd)
+            os.close(fd)
+            callback()
+
+        self.add_reader(pidfd, on_exit)
+
+    def _wakeup(self):
+        try:
+            os.write(self._wakeup_w, b"\0")
+        except BlockingIOError:
+            pass
+
+    def _on_wakeup(self, fd):
+        try:
+            while os.read(fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _call(self, callback, *args):
+        try:
+            callback(*args)
+        except Exception as e:
+            log.error("reactor callback %s failed: %s", callback, e)
+
+    def _run_timers(self):
+        now = time.monotonic()
+        while self.timers and self.timers[0][0] <= now:
+            _, _, callback, args = heapq.heappop(self.timers)
+            if callback is not None:
+                self._call(callback, *args)
+
+    def _check_polled(self):
+        for process in [p for p in self.polled if p.poll() is not None]:
+            self._call(self.polled.pop(process))
+
+    def _run(self):
+        while not self.paused:
+            while self.calls:
+                callback, args = self.calls.popleft()
+                self._call(callback, *args)
+            timeout = self.EXIT_POLL_INTERVAL if self.polled else None
+            if self.timers:
+                delay = max(0, self.timers[0][0] - time.monotonic())
+                timeout = delay if timeout is None else min(timeout, delay)
+            for key, _ in self.selector.select(timeout):
+                self._call(key.data, key.fd)
+            if self.polled:
+                self._check_polled()
+            if self.timers:
+                self._run_timers()
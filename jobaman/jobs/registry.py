@@ -0,0 +1,235 @@
+import json
+import queue
+import sqlite3
+import threading
+import time
+
+from jobaman.helpers import get_process_start_time
+from jobaman.logger import get_logger
+
+log = get_logger()
+
+
+class Registry:
+    """
+    Persistent job history in SQLite (WAL mode):
+    `jobs` keeps the latest state and result of every job id, `transitions` the lifecycle log.
+    Writes are queued by the callers and committed in batches by one writer thread.
+    """
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            pid INTEGER,
+            pid_start INTEGER,
+            state TEXT NOT NULL,
+            command TEXT,
+            exit_code INTEGER,
+            ts_started INTEGER,
+            ts_completed INTEGER,
+            spool_path TEXT,
+            ts_updated REAL NOT NULL,
+            priority INTEGER,
+            label TEXT,
+            stdin_job TEXT,
+            after_jobs TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)",
+        "CREATE INDEX IF NOT EXISTS jobs_ts_started ON jobs (ts_started)",
+        """
+        CREATE TABLE IF NOT EXISTS transitions (
+            id INTEGER PRIMARY KEY,
+            job_id TEXT NOT NULL,
+            state TEXT NOT NULL,
+            exit_code INTEGER,
+            ts REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS transitions_job_id ON transitions (job_id)",
+    )
+
+    ADDED_COLUMNS = (  # to the `jobs` table of an older registry
+        ("priority", "INTEGER"),
+        ("label", "TEXT"),
+        ("stdin_job", "TEXT"),
+        ("after_jobs", "TEXT"),
+    )
+
+    UPSERT_JOB = """
+        INSERT INTO jobs (job_id, pid, pid_start, state, command, exit_code, ts_started, ts_completed, spool_path,
+                          priority, label, stdin_job, after_jobs, ts_updated)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (job_id) DO UPDATE SET
+            pid = excluded.pid,
+            pid_start = COALESCE(excluded.pid_start, jobs.pid_start),
+            state = excluded.state,
+            command = excluded.command,
+            exit_code = excluded.exit_code,
+            ts_started = excluded.ts_started,
+            ts_completed = excluded.ts_completed,
+            spool_path = excluded.spool_path,
+            priority = excluded.priority,
+            label = excluded.label,
+            stdin_job = excluded.stdin_job,
+            after_jobs = excluded.after_jobs,
+            ts_updated = excluded.ts_updated
+    """
+    INSERT_TRANSITION = "INSERT INTO transitions (job_id, state, exit_code, ts) VALUES (?, ?, ?, ?)"
+    COLUMNS = (
+        "job_id",
+        "pid",
+        "pid_start",
+        "state",
+        "command",
+        "exit_code",
+        "ts_started",
+        "ts_completed",
+        "spool_path",
+        "priority",
+        "label",
+        "stdin_job",
+        "after_jobs",
+    )
+
+    BATCH_MAX = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self.queue = queue.SimpleQueue()
+        self.closed = False
+
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        for statement in self.SCHEMA:
+            self.db.execute(statement)
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(jobs)")}
+        for name, column_type in self.ADDED_COLUMNS:
+            if name not in columns:
+                self.db.execute(f"ALTER TABLE jobs ADD COLUMN {name} {column_type}")
+        self.db_lock = threading.Lock()
+
+        self.writer = threading.Thread(target=self._write_loop, name="jobaman-registry", daemon=True)
+        self.writer.start()
+
+    def __repr__(self) -> str:
+        return f"Registry(path={self.path})"
+
+    def record(self, job_id, job):
+        """queue the current state of the job, cheap enough to be called under locks"""
+        if self.closed:
+            return
+        self.queue.put(
+            (
+                job_id,
+                job.pid,
+                job.state.value,
+                job.command,
+                job.exit_code,
+                job.ts_started,
+                job.ts_completed,
+                job.spool_path,
+                job.priority,
+                job.label,
+                job.stdin_job,
+                job.after,
+                time.time(),
+            )
+        )
+
+    def flush(self, timeout=None):
+        """wait until everything queued so far is committed"""
+        done = threading.Event()
+        self.queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout=10):
+        if self.closed:
+            return
+        self.flush(timeout=timeout)
+        self.closed = True
+        self.queue.put(None)
+        self.writer.join(timeout=timeout)
+        with self.db_lock:
+            self.db.close()
+
+    def load(self, limit=None):
+        """the most recent `limit` jobs plus every job recorded as running or queued, oldest first (queued last)"""
+        with self.db_lock:
+            cursor = self.db.execute(
+                f"""
+                SELECT {", ".join(self.COLUMNS)} FROM (
+                    SELECT * FROM jobs WHERE state IN ('running', 'queued')
+                    UNION
+                    SELECT * FROM (SELECT * FROM jobs ORDER BY ts_started DESC LIMIT ?)
+                ) ORDER BY ts_started IS NULL, ts_started, ts_updated, job_id
+                """,
+                (-1 if limit is None else limit,),
+            )
+            rows = cursor.fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def history(self, state=None, started_after=None, started_before=None, limit=100):
+        """recorded jobs, newest first"""
+        conditions, params = [], []
+        if state is not None:
+            conditions.append("state = ?")
+            params.append(state)
+        if started_after is not None:
+            conditions.append("ts_started > ?")
+            params.append(started_after)
+        if started_before is not None:
+            conditions.append("ts_started < ?")
+            params.append(started_before)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self.db_lock:
+            rows = self.db.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM jobs {where} ORDER BY ts_started DESC LIMIT ?",
+                (*params, limit),
+            ).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def _row_to_dict(self, row):
+        record = dict(zip(self.COLUMNS, row, strict=True))
+        record["command"] = json.loads(record["command"]) if record["command"] else None
+        record["after"] = json.loads(record.pop("after_jobs") or "[]")
+        return record
+
+    def _write_loop(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.BATCH_MAX:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            records = [item for item in batch if isinstance(item, tuple)]
+            if records:
+                try:
+                    self._write(records)
+                except Exception as e:
+                    log.error("registry write of %d records failed: %s", len(records), e)
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+            if None in batch:
+                return
+
+    def _write(self, records):
+        jobs, transitions = [], []
+        for job_id, pid, state, command, exit_code, *fields, after, ts in records:
+            pid_start = get_process_start_time(pid) if pid and state == "running" else None
+            command_json = json.dumps(command) if command is not None else None
+            jobs.append((job_id, pid, pid_start, state, command_json, exit_code, *fields, json.dumps(after), ts))
+            transitions.append((job_id, state, exit_code, ts))
+        with self.db_lock:
+            self.db.execute("BEGIN")
+            try:
+                self.db.executemany(self.UPSERT_JOB, jobs)
+                self.db.executemany(self.INSERT_TRANSITION, transitions)
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+
+from jobaman.logger import get_logger
+
+log = get_logger()
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def read_process_stat(pid):
+    """(session id, cpu seconds including waited-for children, rss bytes) from `/proc/<pid>/stat`"""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # comm (2nd field) may contain spaces, the fields after it are fixed: fields[n - 3] is the n-th field
+    fields = stat.rpartition(b")")[2].split()
+    cpu_ticks = int(fields[11]) + int(fields[12]) + int(fields[13]) + int(fields[14])
+    return int(fields[3]), cpu_ticks / CLOCK_TICKS, int(fields[21]) * PAGE_SIZE
+
+
+def read_process_io(pid):
+    """(read bytes, write bytes) of storage I/O from `/proc/<pid>/io`, including waited-for children"""
+    read_bytes = write_bytes = 0
+    try:
+        with open(f"/proc/{pid}/io", "rb") as f:
+            for line in f:
+                if line.startswith(b"read_bytes:"):
+                    read_bytes = int(line[11:])
+                elif line.startswith(b"write_bytes:"):
+                    write_bytes = int(line[12:])
+    except OSError:
+        pass
+    return read_bytes, write_bytes
+
+
+def read_process_usage(pid):
+    """(cpu seconds, rss bytes, read bytes, write bytes) of one process, `None` if it is gone"""
+    stat = read_process_stat(pid)
+    if stat is None:
+        return None
+    _, cpu_time, rss = stat
+    return (cpu_time, rss, *read_process_io(pid))
+
+
+class Sampler:
+    """
+    One thread sampling the resource usage of all running jobs:
+    every `interval` seconds `/proc` is walked once, processes are matched to jobs by session id
+    (jobs run in their own session, so the job pid is the session id of its whole process tree),
+    and the sums per job go to `Job.update_usage`. A pool task (`WorkerTask`) is charged what its worker
+    used since the task was handed to it, not the worker's lifetime totals.
+    """
+
+    INTERVAL_DEFAULT = 5.0
+
+    def __init__(self, running_jobs, interval=None, name="jobaman-sampler"):
+        self.running_jobs = running_jobs
+        self.interval = interval or self.INTERVAL_DEFAULT
+        self.last_duration = None
+        self.passes = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def __repr__(self) -> str:
+        return f"Sampler(interval={self.interval}, last_duration={self.last_duration})"
+
+    def stop(self):
+        self.stopped.set()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                log.error("usage sampling failed: %s", e)
+
+    def sample(self):
+        ts = time.monotonic()
+        jobs = {job.pid: job for job in self.running_jobs() if job.pid}
+        if not jobs:
+            return
+        usage = {sid: [0.0, 0, 0, 0] for sid in jobs}
+        for name in os.listdir("/proc"):
+            if not name.isdigit():
+                continue
+            stat = read_process_stat(name)
+            if stat is None or stat[0] not in usage:
+                continue
+            sid, cpu_time, rss = stat
+            read_bytes, write_bytes = read_process_io(name)
+            totals = usage[sid]
+            totals[0] += cpu_time
+            totals[1] += rss
+            totals[2] += read_bytes
+            totals[3] += write_bytes
+        for sid, totals in usage.items():
+            base = getattr(jobs[sid].process, "usage_base", None)
+            if base is not None:
+                for i in (0, 2, 3):  # cpu and io, not rss
+                    totals[i] -= base[i]
+            jobs[sid].update_usage(*totals)
+        self.passes += 1
+        self.last_duration = time.monotonic() - ts
@@ -0,0 +1,169 @@
+"""
+Search of job output (`/jobs/grep`, see `Job.grep`).
+
+The output is copied out of a stream buffer a chunk at a time (`StreamBuffer.copy_chunk`) and searched
+with no lock held. A plain string is searched in place; a regular expression is searched by a child process
+(`RegexProcess`) that is killed at the deadline of the search: a pattern from a client may backtrack for
+ages (`(a+)+b`), and `re` holds the GIL all that time.
+
+Protocol, over the child's stdin/stdout:
+- jobaman -> child: a JSON header line (pattern, flags, span, limit, size) and `size` bytes to search;
+- child -> jobaman: a JSON line, the list of match positions (the first match of every line, at most `limit`).
+A child exits when its stdin is closed. `serve()` is the child side.
+"""
+
+import json
+import os
+import re
+import select
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+
+
+def find_lines(regex, data, span, limit):
+    """positions of the first matches of `regex` on up to `limit` newline separated lines of data[lo:hi]"""
+    pos, hi = span
+    found = []
+    while len(found) < limit:
+        match = regex.search(data, pos, hi)
+        if match is None or match.start() >= hi:
+            break
+        found.append(match.start())
+        pos = data.find(b"\n", match.start(), hi) + 1 or hi
+    return found
+
+
+@dataclass
+class Search:
+    """a search of job output: the pattern, the number of `context` lines around a match and the deadline"""
+
+    pattern: bytes
+    fixed: bool = False
+    ignore_case: bool = False
+    context: int = 0
+    deadline: float | None = None  # monotonic
+    process: "RegexProcess | None" = field(default=None, repr=False)
+
+    def __post_init__(self):
+        pattern = re.escape(self.pattern) if self.fixed else self.pattern
+        self.regex = re.compile(pattern, self.flags)  # `re.error` for an invalid pattern
+
+    @property
+    def flags(self):
+        return re.MULTILINE | (re.IGNORECASE if self.ignore_case else 0)
+
+    @property
+    def expired(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def lines(self, chunk, limit):
+        """
+        up to `limit` matching lines of `chunk` (an `OutputChunk`), see `OutputChunk.lines`;
+        return (matches, offset to go on from or None at the end), `TimeoutError` once past the deadline
+        """
+        if self.expired:
+            raise TimeoutError("search deadline passed")
+        span = (chunk.lo, chunk.hi)
+        if self.fixed:  # a plain string takes linear time
+            positions = find_lines(self.regex, chunk.data, span, limit)
+        else:
+            if self.process is None:
+                self.process = RegexProcess()
+            positions = self.process.find(self, chunk.data, span, limit)
+        matches = chunk.lines(positions, self.context)
+        if len(positions) < limit:
+            return matches, chunk.next_offset
+        return matches, chunk.base + chunk.line_bounds(positions[-1])[2]
+
+    def close(self):
+        if self.process is not None:
+            self.process.close()
+            self.process = None
+
+
+class RegexProcess:
+    """a child process searching with regular expressions, see the module docstring"""
+
+    EXIT_TIMEOUT = 1.0
+
+    def __init__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, "-I", __file__],  # standard library only, no jobaman imports
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            start_new_session=True,
+        )
+        self.buffer = b""
+
+    def __repr__(self) -> str:
+        return f"RegexProcess(pid={self.process.pid})"
+
+    def find(self, search, data, span, limit):
+        """`find_lines` with the `search` pattern in the child, killed with a `TimeoutError` at the deadline"""
+        header = {
+            "pattern": search.pattern.decode("latin-1"),
+            "flags": search.flags,
+            "span": span,
+            "limit": limit,
+            "size": len(data),
+        }
+        try:
+            self.process.stdin.write(json.dumps(header).encode() + b"\n")
+            self.process.stdin.write(data)
+            self.process.stdin.flush()
+            return json.loads(self._read_line(search.deadline))
+        except (OSError, ValueError) as e:  # `TimeoutError` included
+            self.kill()
+            if isinstance(e, TimeoutError):
+                raise
+            raise OSError(f"regex search failed: {e}") from e
+
+    def _read_line(self, deadline):
+        fd = self.process.stdout.fileno()
+        while b"\n" not in self.buffer:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not select.select([fd], [], [], timeout)[0]:
+                raise TimeoutError("search deadline passed")
+            data = os.read(fd, 64 * 1024)
+            if not data:
+                raise OSError("regex process exited")
+            self.buffer += data
+        line, _, self.buffer = self.buffer.partition(b"\n")
+        return line
+
+    def kill(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.close()
+
+    def close(self):
+        """close the stdin, the child exits (or is killed if it does not)"""
+        for pipe in (self.process.stdin, self.process.stdout):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+        try:
+            self.process.wait(timeout=self.EXIT_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def serve(stdin=None, stdout=None):
+    """the child side: answer search requests until stdin is closed"""
+    stdin = stdin or sys.stdin.buffer
+    stdout = stdout or sys.stdout.buffer
+    for line in stdin:
+        header = json.loads(line)
+        data = stdin.read(header["size"])
+        pattern = header["pattern"].encode("latin-1")
+        found = find_lines(re.compile(pattern, header["flags"]), data, tuple(header["span"]), header["limit"])
+        stdout.write(json.dumps(found).encode() + b"\n")
+        stdout.flush()
+
+
+if __name__ == "__main__":
+    serve()
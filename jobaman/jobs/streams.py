@@ -0,0 +1,371 @@
+import array
+import bisect
+import itertools
+import mmap
+import os
+from dataclasses import dataclass
+
+from jobaman.logger import get_logger
+
+log = get_logger()
+
+
+class OutputDroppedError(OSError):
+    """the whole output is asked for, but lines of it were dropped and there is no spool file"""
+
+
+class StreamBuffer:
+    """
+    Byte-budgeted ring of output lines:
+    raw bytes in one `bytearray` plus an index of line start offsets,
+    lines are decoded only when read.
+
+    Every line gets a stable sequence number:
+    the first line ever written is 0, numbers keep growing as old lines are dropped.
+    Byte offsets are absolute too: the first byte ever written is at offset 0.
+
+    With `spool_path` all the output is also appended to that file
+    (so file offsets are the absolute offsets) and the ring is just its hot tail.
+    """
+
+    ENCODING_DEFAULT = "utf-8"
+    COMPACT_RATIO = 4  # compact storage once dropped lines take 1/4 of the kept size
+    GREP_CHUNK = 1024 * 1024  # bytes copied per `copy_chunk` call
+
+    def __init__(self, max_bytes, encoding=None, spool_path=None):
+        self.max_bytes = max_bytes
+        self.encoding = encoding or self.ENCODING_DEFAULT
+        self.spool_path = spool_path
+        self.spool_fd = None
+        if spool_path:
+            self.spool_fd = os.open(spool_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC, 0o600)
+        self.data = bytearray()
+        self.base = 0  # absolute offset of data[0]
+        self.offsets = array.array("q")  # absolute offsets of line starts, kept lines are offsets[head:]
+        self.head = 0
+        self.next_seq = 0
+
+    @classmethod
+    def from_spool(cls, max_bytes, spool_path, encoding=None):
+        """read-only buffer over an existing spool file: nothing in memory, byte ranges only"""
+        buffer = cls(max_bytes, encoding=encoding)
+        buffer.spool_path = spool_path
+        try:
+            buffer.base = os.path.getsize(spool_path)
+        except OSError:
+            buffer.spool_path = None
+        return buffer
+
+    def __repr__(self) -> str:
+        return (
+            f"StreamBuffer(first_seq={self.first_seq}, next_seq={self.next_seq}, "
+            f"bytes={self.size}, max_bytes={self.max_bytes})"
+        )
+
+    def export(self, writer):
+        """plain values for `from_export` in another jobaman, the kept bytes and the spool fd go to `writer`"""
+        start = self.start - self.base
+        return {
+            "max_bytes": self.max_bytes,
+            "encoding": self.encoding,
+            "spool_path": self.spool_path,
+            "spool_fd": writer.fd(self.spool_fd),
+            "base": self.start,
+            "first_seq": self.first_seq,
+            "data": writer.blob(bytes(self.data[start:])),
+            "offsets": writer.blob(self.offsets[self.head :].tobytes()),
+        }
+
+    @classmethod
+    def from_export(cls, record, reader):
+        buffer = cls(record["max_bytes"], encoding=record["encoding"])
+        buffer.spool_path = record["spool_path"]
+        buffer.spool_fd = reader.fd(record["spool_fd"])
+        buffer.data = bytearray(reader.blob(record["data"]))
+        buffer.base = record["base"]
+        buffer.offsets.frombytes(reader.blob(record["offsets"]))
+        buffer.next_seq = record["first_seq"] + len(buffer.offsets)
+        return buffer
+
+    def __len__(self):
+        return len(self.offsets) - self.head
+
+    def __iter__(self):
+        return iter(self.read()[0])
+
+    def __getitem__(self, index):
+        count = len(self)
+        if index < 0:
+            index += count
+        if not 0 <= index < count:
+            raise IndexError("stream buffer index out of range")
+        return self._decode(self.head + index)
+
+    @property
+    def first_seq(self):
+        return self.next_seq - len(self)
+
+    @property
+    def complete(self):
+        """all the output written can be read: it is spooled, or no line was dropped"""
+        return self.spool_path is not None or self.first_seq == 0
+
+    @property
+    def end(self):
+        """absolute offset of the next byte to be written"""
+        return self.base + len(self.data)
+
+    @property
+    def start(self):
+        """absolute offset of the first kept byte"""
+        return self.offsets[self.head] if len(self) else self.end
+
+    @property
+    def size(self):
+        """bytes kept"""
+        return self.end - self.start
+
+    @property
+    def max_line(self):
+        """longest line that fits into the budget along with its index entry"""
+        return max(1, self.max_bytes - self.offsets.itemsize)
+
+    @property
+    def allocated(self):
+        """bytes held, including not yet compacted dropped lines"""
+        return len(self.data) + self.offsets.itemsize * len(self.offsets)
+
+    def append(self, line):
+        """append one line (bytes, normally ending with a newline)"""
+        self.extend([line])
+
+    def extend(self, lines):
+        """append lines, a line that does not fit into the budget is split into several"""
+        lines = list(lines)
+        if not lines:
+            return
+        max_line = self.max_line
+        if max(map(len, lines)) > max_line:
+            lines = [line[i : i + max_line] for line in lines for i in range(0, len(line) or 1, max_line)]
+        payload = b"".join(lines)
+        if self.spool_fd is not None:
+            self._spool(payload)
+        self.offsets.extend(itertools.accumulate(map(len, lines[:-1]), initial=self.end))
+        self.data += payload
+        self.next_seq += len(lines)
+        self._trim()
+
+    def read_range(self, offset, length):
+        """
+        raw bytes starting at absolute `offset`, from the hot tail or the spool file (mmap-ed);
+        return (data, offset of the data -- later than asked if those bytes are gone)
+        """
+        offset = max(0, offset)
+        length = max(0, length)
+        if offset >= self.start or self.spool_path is None:
+            offset = min(max(offset, self.start), self.end)
+            stop = min(self.end, offset + length)
+            return bytes(self.data[offset - self.base : stop - self.base]), offset
+        stop = offset + length
+        with open(self.spool_path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if offset >= size:
+                return b"", offset
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return mm[offset : min(stop, size)], offset
+
+    def open_fd(self):
+        """
+        a file descriptor to read the output from (e.g. the stdin of another process): the spool file
+        with all of it, or an in-memory file with a copy of the kept bytes, nothing is decoded;
+        `OutputDroppedError` if lines were dropped: a part of the output is no input for anything
+        """
+        if not self.complete:
+            raise OutputDroppedError(f"{self.first_seq} output lines dropped and not spooled")
+        if self.spool_path is not None:
+            return os.open(self.spool_path, os.O_RDONLY | os.O_CLOEXEC)
+        fd = os.memfd_create("jobaman-output", os.MFD_CLOEXEC)
+        try:
+            view = memoryview(self.data)[self.start - self.base :]
+            while view:
+                view = view[os.write(fd, view) :]
+            os.lseek(fd, 0, os.SEEK_SET)
+        except OSError:
+            os.close(fd)
+            raise
+        return fd
+
+    def copy_chunk(self, offset, context=0, size=GREP_CHUNK):
+        """
+        a copy (`OutputChunk`) of the whole lines of about `size` bytes from absolute `offset` on, with up to
+        `context` lines around them: from the spool file (mmap-ed) up to the hot tail, then from the kept bytes
+        """
+        offset = max(0, offset)
+        if offset < self.start and self.spool_path is not None:
+            with open(self.spool_path, "rb") as f:
+                stop = min(self.start, os.fstat(f.fileno()).st_size)
+                if offset < stop:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        return self._copy_spool_chunk(mm, (offset, stop), context, size)
+        offset = max(offset, self.start)
+        if offset >= self.end:
+            return OutputChunk(b"", self.end, end=self.end, encoding=self.encoding)
+        offsets, head, count = self.offsets, self.head, len(self.offsets)
+        first = bisect.bisect_right(offsets, offset, lo=head) - 1
+        last = bisect.bisect_right(offsets, offset + size, lo=first + 1)
+        copy_first, copy_last = max(head, first - context), min(count, last + context)
+        copy_start = offsets[copy_first]
+        copy_end = offsets[copy_last] if copy_last < count else self.end
+        stop = offsets[last] if last < count else self.end
+        return OutputChunk(
+            bytes(self.data[copy_start - self.base : copy_end - self.base]),
+            copy_start,
+            lo=offset - copy_start,
+            hi=stop - copy_start,
+            starts=offsets[copy_first:copy_last],
+            first_seq=self.first_seq + copy_first - head,
+            next_offset=stop if stop < self.end else None,
+            end=self.end,
+            encoding=self.encoding,
+        )
+
+    def _copy_spool_chunk(self, mm, span, context, size):
+        """`copy_chunk` of the spool file bytes in `span` (lines split at newlines there)"""
+        offset, stop = span
+        hi = mm.find(b"\n", offset + size, stop) + 1 or stop
+        copy_start = mm.rfind(b"\n", 0, offset) + 1
+        copy_end = hi
+        for _ in range(context):
+            if copy_start > 0:
+                copy_start = mm.rfind(b"\n", 0, copy_start - 1) + 1
+            if copy_end < stop:
+                copy_end = mm.find(b"\n", copy_end, stop) + 1 or stop
+        return OutputChunk(
+            mm[copy_start:copy_end],
+            copy_start,
+            lo=offset - copy_start,
+            hi=hi - copy_start,
+            next_offset=hi if hi < self.end else None,
+            end=self.end,
+            encoding=self.encoding,
+        )
+
+    def close(self):
+        """stop spooling, the spool file stays for `read_range`"""
+        if self.spool_fd is not None:
+            os.close(self.spool_fd)
+            self.spool_fd = None
+
+    def release(self):
+        """close and remove the spool file"""
+        self.close()
+        if self.spool_path:
+            try:
+                os.unlink(self.spool_path)
+            except FileNotFoundError:
+                pass
+
+    def _spool(self, payload):
+        view = memoryview(payload)
+        try:
+            while view:
+                view = view[os.write(self.spool_fd, view) :]
+        except OSError as e:
+            log.error("spool %s write failed, spooling stopped: %s", self.spool_path, e)
+            self.close()
+
+    def read(self, cursor=None, tail=None):
+        """
+        lines from sequence number `cursor` (or from the oldest kept line),
+        at most the last `tail` of them;
+        return (lines, next cursor, number of lines lost before `cursor` was reached)
+        """
+        first_seq = self.first_seq
+        start = first_seq if cursor is None else min(max(cursor, first_seq), self.next_seq)
+        dropped = 0 if cursor is None else max(0, first_seq - cursor)
+        if tail is not None:
+            start = max(start, self.next_seq - tail)
+        index = self.head + start - first_seq
+        lines = [self._decode(i) for i in range(index, len(self.offsets))]
+        return lines, self.next_seq, dropped
+
+    def _line_bounds(self, index):
+        line_end = self.offsets[index + 1] if index + 1 < len(self.offsets) else self.end
+        return self.offsets[index] - self.base, line_end - self.base
+
+    def _decode(self, index):
+        line_start, line_end = self._line_bounds(index)
+        return self.data[line_start:line_end].decode(self.encoding, errors="ignore")
+
+    def _trim(self):
+        """drop the oldest lines until kept bytes plus their index entries fit into the budget"""
+        offsets = self.offsets
+        end = self.end
+        itemsize = offsets.itemsize
+        count = len(offsets)
+        lo = bisect.bisect_left(offsets, end - self.max_bytes, lo=self.head)
+        hi = count - 1
+        while lo < hi:  # first line from which kept bytes + index fit, the last line is always kept
+            mid = (lo + hi) // 2
+            if end - offsets[mid] + itemsize * (count - mid) > self.max_bytes:
+                lo = mid + 1
+            else:
+                hi = mid
+        head = lo
+        self.head = head
+
+        dead = offsets[head] - self.base
+        if dead and dead * self.COMPACT_RATIO >= len(self.data) - dead:
+            del self.data[:dead]
+            self.base += dead
+        if head and head * self.COMPACT_RATIO >= count - head:
+            del offsets[:head]
+            self.head = 0
+
+
+@dataclass
+class OutputChunk:
+    """
+    A copy of output lines to search, see `StreamBuffer.copy_chunk`:
+    `data` is at absolute offset `base`, the lines to search are data[lo:hi], the others are there for the context.
+    Lines of the hot tail have their absolute `starts` and the sequence number of the first one;
+    spool file lines have none (`None`), they are split at newlines.
+    """
+
+    data: bytes
+    base: int
+    lo: int = 0
+    hi: int = 0
+    starts: array.array | None = None
+    first_seq: int | None = None
+    next_offset: int | None = None  # where the next chunk starts, `None` if this one reaches the end
+    end: int = 0  # end of the output when copied
+    encoding: str = StreamBuffer.ENCODING_DEFAULT
+
+    def line_bounds(self, pos):
+        """(sequence number or None, start, end) of the line with data[pos]"""
+        if self.starts is None:
+            return None, self.data.rfind(b"\n", 0, pos) + 1, self.data.find(b"\n", pos) + 1 or len(self.data)
+        index = bisect.bisect_right(self.starts, self.base + pos) - 1
+        line_end = self.starts[index + 1] - self.base if index + 1 < len(self.starts) else len(self.data)
+        return self.first_seq + index, self.starts[index] - self.base, line_end
+
+    def lines(self, positions, context=0):
+        """[(seq or None, offset, line, lines before, lines after)] of the lines with data[pos] for `positions`"""
+        found = []
+        for pos in positions:
+            seq, line_start, line_end = self.line_bounds(pos)
+            before, after = [], []
+            bound = line_start
+            while len(before) < context and bound > 0:
+                _, bound, before_end = self.line_bounds(bound - 1)
+                before.insert(0, self._decode(bound, before_end))
+            bound = line_end
+            while len(after) < context and bound < len(self.data):
+                _, after_start, bound = self.line_bounds(bound)
+                after.append(self._decode(after_start, bound))
+            found.append((seq, self.base + line_start, self._decode(line_start, line_end), before, after))
+        return found
+
+    def _decode(self, start, end):
+        return self.data[start:end].removesuffix(b"\n").decode(self.encoding, errors="ignore")
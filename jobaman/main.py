@@ -2,37 +2,68 @@ import argparse
 
 import jobaman.jobs.manager
 import jobaman.logger
+from jobaman.api.async_server import run_async_server
+from jobaman.api.limits import Admission
 from jobaman.api.server import run_server
+from jobaman.api.shard_handlers import SHARD_ROUTES
+from jobaman.api.shards import ShardRouter
 from jobaman.config import Configuration
+from jobaman.handoff import Handoff
 from jobaman.helpers import run_command
 
 log = jobaman.logger.get_logger(__name__)
 
+SERVERS = {
+    "threads": run_server,
+    "asyncio": run_async_server,
+}
+
 
 def main():
 
     config = read_configuration()
 
     jobaman.logger.configure(config)
-    manager = jobaman.jobs.manager.Manager(config)
-    config["manager"] = manager
+    handoff = Handoff(config)  # started by a restart: the jobs come from the previous jobaman, not the registry
+    config["handoff"] = handoff
+    config["admission"] = Admission(config)
+    manager = None
+    if config.get("router_backends"):  # router mode: jobs run on the backends
+        service = ShardRouter(config)
+        config["router"] = service
+        config["routes"] = SHARD_ROUTES
+    else:
+        service = manager = jobaman.jobs.manager.Manager(config, restore=not handoff.incoming)
+        config["manager"] = service
 
     log.debug("jobaman config:")
     for key, value in config.as_dict().items():
         log.debug("%s=%s", key, value)
 
-    run_command(config["startup_command"], "startup")
-
+    if not handoff.incoming:
+        run_command(config["startup_command"], "startup")
+    elif not handoff.take_over(config, manager):
+        if manager is not None:
+            manager.detach_jobs()  # the previous jobaman keeps them
+        service.shutdown()
+        return
+    handoff.install_signal_handler()
+
+    server_mode = config.get("server-mode") or "threads"
+    handed_over = False
     try:
-        run_server(config)
+        while not handed_over:  # servers return on a restart, and run again if it fails
+            SERVERS[server_mode](config)
+            handed_over = handoff.hand_over(config["server_socket"], manager)
     except KeyboardInterrupt:
         log.info("shutting down on user interrupt")
     except Exception as e:
         log.error("fatal error: %s", e)
     finally:
-        manager.shutdown()
+        service.shutdown()
 
-    run_command(config["shutdown_command"], "shutdown")
+    if not handed_over:
+        run_command(config["shutdown_command"], "shutdown")
 
 
 def read_configuration():
@@ -62,6 +93,7 @@ def parse_cli_params():
     parser.add_argument("--env-use", action=argparse.BooleanOptionalAction, default=True)
     parser.add_argument("--env-prefix", type=str, default="JOBAMAN")
     parser.add_argument("--log-level", type=str)
+    parser.add_argument("--server-mode", type=str, choices=list(SERVERS))
     parser.add_argument("--debug", action=argparse.BooleanOptionalAction, default=None)
     params, _ = parser.parse_known_args()
 
@@ -0,0 +1,169 @@
+"""
+Process-wide counters and histograms, rendered in the Prometheus text format.
+
+Every thread updates its own shard (a plain dict, no locks on the hot path),
+`render()` merges the shards when metrics are scraped.
+"""
+
+import bisect
+import collections
+import threading
+import time
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+DURATION_BUCKETS = (0.1, 1, 10, 60, 300, 1800, 3600, 6 * 3600, 24 * 3600)
+
+_local = threading.local()
+_shards = []
+_shards_lock = threading.Lock()
+_metrics = []
+
+
+def _shard():
+    try:
+        return _local.shard
+    except AttributeError:
+        shard = _local.shard = {}
+        with _shards_lock:
+            _shards.append(shard)
+        return shard
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values, strict=True)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metric:
+
+    TYPE = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        _metrics.append(self)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(name={self.name})"
+
+    def samples(self, values):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+
+    TYPE = "counter"
+
+    def inc(self, *label_values, value=1):
+        shard = _shard()
+        key = (self, label_values)
+        shard[key] = shard.get(key, 0) + value
+
+    def samples(self, values):
+        for label_values, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {value}"
+
+
+class Histogram(Metric):
+    """per label values: a count per bucket (the last one is +Inf), then the sum of the observed values"""
+
+    TYPE = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        shard = _shard()
+        key = (self, label_values)
+        counts = shard.get(key)
+        if counts is None:
+            counts = shard[key] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self, values):
+        for label_values, counts in sorted(values.items()):
+            total = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts, strict=False):
+                total += count
+                labels = _format_labels(self.labels, label_values, f'le="{bound}"')
+                yield f"{self.name}_bucket{labels} {total}"
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {counts[-1]}"
+            yield f"{self.name}_count{labels} {total}"
+
+
+class Gauge(Metric):
+    """current values, set by the scraping thread right before `render()`"""
+
+    TYPE = "gauge"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self.values = {}
+
+    def set(self, value, *label_values):
+        self.values[label_values] = value
+
+    def samples(self, values):
+        for label_values, value in sorted(self.values.items()):
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {value}"
+
+
+class TimedLock:
+    """lock wrapper observing how long contended acquisitions waited, uncontended ones are not timed"""
+
+    def __init__(self, lock, histogram):
+        self.lock = lock
+        self.histogram = histogram
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self.lock.acquire(blocking=False):
+            return True
+        if not blocking:
+            return False
+        ts = time.perf_counter()
+        acquired = self.lock.acquire(timeout=timeout)
+        self.histogram.observe(time.perf_counter() - ts)
+        return acquired
+
+    def release(self):
+        self.lock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def render():
+    """all metrics in the Prometheus text exposition format"""
+    merged = collections.defaultdict(dict)
+    with _shards_lock:
+        shards = list(_shards)
+    for shard in shards:
+        for (metric, label_values), value in shard.copy().items():
+            values = merged[metric]
+            if isinstance(value, list):
+                total = values.get(label_values)
+                if total is None:
+                    values[label_values] = list(value)
+                else:
+                    values[label_values] = [a + b for a, b in zip(total, value, strict=True)]
+            else:
+                values[label_values] = values.get(label_values, 0) + value
+    lines = []
+    for metric in _metrics:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.TYPE}")
+        lines.extend(metric.samples(merged.get(metric, {})))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,95 @@
+import os
+import socket
+import threading
+import time
+import unittest
+
+from jobaman.handoff import HANDOFF_FD_ENV, Handoff, HandoffWriter, recv_message, send_message
+from jobaman.jobs.manager import JobState, Manager
+from tests.base import BaseTestCase
+from tests.test_manager import get_process_state
+
+
+def hand_over(old, new):
+    """export the jobs of `old` and import them into `new` over a socket pair, as a restart does"""
+    ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    writer = HandoffWriter()
+    jobs = old.export_jobs(writer)
+    sender = threading.Thread(target=send_message, args=(ours, {"jobs": jobs}, writer))
+    sender.start()
+    message, reader = recv_message(theirs)
+    sender.join()
+    new.import_jobs(message["jobs"], reader)
+    reader.close_unused()
+    writer.close()
+    old.detach_jobs()
+    ours.close()
+    theirs.close()
+    return message
+
+
+class TestHandoff(BaseTestCase, unittest.TestCase):
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(1 / 50)
+        return condition()
+
+    def test_10_running_and_queued_jobs(self):
+        old = Manager(config={"max_jobs": 1, "max_queue": 5, "entrypoint": None})
+        running_id = old.run_task(["sh", "-c", "echo before; sleep 0.5; echo after"])
+        queued_id = old.run_task(["echo", "queued"])
+        done_id = old.run_task(["echo", "done"])
+        dependent_id = old.run_task(["cat"], stdin_job=running_id)
+        self.assertTrue(self.wait_for(lambda: old[running_id].stdout == "before\n"))
+        pid = old[running_id].pid
+
+        new = Manager(config={"max_jobs": 1, "max_queue": 5, "entrypoint": None}, restore=False)
+        message = hand_over(old, new)
+        self.assertEqual([job["job_id"] for job in message["jobs"]], [running_id, queued_id, done_id, dependent_id])
+        old.shutdown()  # handed over: nothing is killed
+        self.assertIsNotNone(get_process_state(pid))
+
+        job = new[running_id]
+        self.assertEqual((job.state, job.pid), (JobState.RUNNING, pid))
+        self.assertTrue(self.wait_for(lambda: new[dependent_id].state == JobState.DONE))
+        self.assertEqual(job.stdout, "before\nafter\n")  # the output continues in the new manager
+        self.assertIsNone(job.exit_code)  # not a child of the new one
+        self.assertEqual([new[queued_id].stdout, new[done_id].stdout], ["queued\n", "done\n"])
+        self.assertEqual(new[dependent_id].stdout, "before\nafter\n")  # waited for the running job
+        self.assertEqual(new[done_id].exit_code, 0)
+        new.shutdown()
+
+    def test_20_resume_after_failed_handoff(self):
+        manager = Manager(config={"max_jobs": 1, "max_queue": 5, "entrypoint": None})
+        running_id = manager.run_task(["sleep", "0.3"])
+        queued_id = manager.run_task(["echo", "queued"])
+        writer = HandoffWriter()
+        manager.export_jobs(writer)
+        writer.close()
+        time.sleep(0.5)
+        self.assertEqual(manager[queued_id].state, JobState.QUEUED)  # not started while handing over
+
+        manager.resume()
+        self.assertTrue(self.wait_for(lambda: manager[queued_id].state == JobState.DONE))
+        self.assertEqual(manager[running_id].exit_code, 0)
+        self.assertEqual(manager[queued_id].stdout, "queued\n")
+        manager.shutdown()
+
+    def test_30_take_over_timeout(self):
+        ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        os.environ[HANDOFF_FD_ENV] = str(theirs.detach())
+        handoff = Handoff({"restart_timeout": 0.2})
+        config = {}
+        ts = time.monotonic()
+        self.assertFalse(handoff.take_over(config))  # the old jobaman never sends the jobs
+        self.assertLess(time.monotonic() - ts, 2)
+        self.assertEqual(recv_message(ours)[0]["ready"], True)
+        self.assertNotIn("server_socket", config)
+        self.assertIsNone(handoff.peer)
+        ours.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+
+from jobaman.api.limits import Admission, TokenBuckets
+from jobaman.api.query import Query
+from tests.base import BaseTestCase
+
+
+class TestLimits(BaseTestCase, unittest.TestCase):
+
+    def test_10_token_buckets(self):
+        buckets = TokenBuckets(rate=2, burst=4, max_keys=3)
+        self.assertEqual([buckets.take("a", now=0) for _ in range(5)], [0, 0, 0, 0, 0.5])
+        self.assertEqual(buckets.take("a", now=1), 0)  # 2 tokens back
+        self.assertEqual(buckets.take("b", cost=10, now=1), 0)  # at most the burst
+        self.assertEqual(buckets.take("b", cost=3, now=1), 1.5)
+        for key in "cde":
+            buckets.take(key, now=1.5)
+        self.assertEqual(list(buckets.buckets), ["c", "d", "e"])  # the least recently used are evicted
+        buckets.take("f", now=10)
+        self.assertEqual(list(buckets.buckets), ["f"])  # idle ones are full again, dropped
+
+    def test_20_admission(self):
+        admission = Admission({"rate_limit_run_rate": 10, "server_workers": 2, "shed_backlog": 2})
+
+        def query(path, data=None, addr="10.0.0.1"):
+            return Query(addr=(addr, 1000), path=path, data=data)
+
+        self.assertIsNone(admission.admit(query("/jobs/output")))  # no read limit
+        self.assertIsNone(admission.admit(query("/jobs/run-batch", data=[{}] * 10)))
+        self.assertEqual(admission.admit(query("/jobs/run")), (429, 1))
+        self.assertIsNone(admission.admit(query("/jobs/run", addr="10.0.0.2")))
+
+        admission.handled(4.0)
+        for _ in range(4):
+            admission.submitted()
+        self.assertIsNone(admission.admit(query("/jobs/")))
+        admission.submitted()
+        self.assertEqual(admission.admit(query("/jobs/")), (503, 1))  # 3 waiting for 2 workers
+        self.assertIsNone(admission.admit(query("/ping")))
+        for _ in range(5):
+            admission.done()
+        self.assertEqual(admission.backlog, 0)
+
+    def test_30_admission_clients(self):
+        admission = Admission(
+            {
+                "rate_limit_read_rate": 1,
+                "rate_limit_key_header": "X-Api-Key",
+                "rate_limit_keys": "known, other",
+                "rate_limit_exempt_addresses": "10.0.0.9",
+            }
+        )
+
+        def query(key=None, addr="10.0.0.1"):
+            return Query(addr=(addr, 1000), path="/jobs/", headers={"x-api-key": key} if key else {})
+
+        self.assertIsNone(admission.admit(query()))
+        self.assertEqual(admission.admit(query("made-up-1")), (429, 1))  # an unknown key: the address budget
+        self.assertEqual(admission.admit(query("made-up-2")), (429, 1))
+        self.assertIsNone(admission.admit(query("known")))  # a budget per known key
+        self.assertEqual(admission.admit(query("known", addr="10.0.0.2")), (429, 1))
+        self.assertIsNone(admission.admit(query("other")))
+        for _ in range(3):
+            self.assertIsNone(admission.admit(query(addr="10.0.0.9")))  # a router
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,24 @@
+import os
+import tempfile
 import time
 import unittest
 
+from jobaman.jobs.index import JobSelection
+from jobaman.jobs.job import Job, JobSpec
 from jobaman.jobs.manager import JobState, Manager
+from jobaman.jobs.process import ExitedProcess
 from tests.base import BaseTestCase
 
 
+def get_process_state(pid):
+    """`R`, `S`, `Z`... or `None` if there is no such process"""
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            return f.read().rpartition(")")[2].split()[0]
+    except FileNotFoundError:
+        return None
+
+
 class TestManager(BaseTestCase, unittest.TestCase):
 
     def tearDown(self) -> None:
@@ -50,3 +64,190 @@ class TestManager(BaseTestCase, unittest.TestCase):
         time.sleep(1 / 5)
         manager.shutdown()
         self.assertEqual(job.state, JobState.KILLED)
+
+    def test_40_output_spool(self, n=20_000):
+        with tempfile.TemporaryDirectory() as spool_dir:
+            config = {"max_jobs": n, "entrypoint": None, "output_spool_dir": spool_dir}
+            manager = Manager(config=config)
+            job_id = manager.run_task(["seq", str(n)])
+            job = manager[job_id]
+            time.sleep(1)
+            self.assertEqual(job.state, JobState.DONE)
+            self.assertLessEqual(job.streams["stdout"].size, manager.spool_memory_bytes)
+            spool_files = [f"{job_id}.{job.pid}.stderr", f"{job_id}.{job.pid}.stdout"]
+            self.assertEqual(sorted(os.listdir(spool_dir)), spool_files)
+
+            data, offset, end = job.read_range("stdout", 0, 10)
+            self.assertEqual((data, offset), (b"1\n2\n3\n4\n5\n", 0))
+            self.assertEqual(end, os.path.getsize(job.spool_path + ".stdout"))
+            self.assertEqual(job.read_range("stdout", end - 6, 100)[0], f"{n}\n".encode())
+
+            manager.purge()
+            self.assertEqual(os.listdir(spool_dir), [])
+            manager.shutdown()
+
+    def test_50_state_index(self):
+        manager = Manager(config={"max_jobs": 2, "max_queue": 1, "entrypoint": None})
+        sleeper = manager.run_task(["sleep", "5"])
+        quick = manager.run_task(["true"])
+        queued = manager.run_task(["true"])
+        self.assertEqual(set(manager.by_state[JobState.RUNNING]), {sleeper, quick})
+        self.assertEqual(set(manager.by_state[JobState.QUEUED]), {queued})
+        time.sleep(1 / 2)
+        self.assertEqual(set(manager.running_jobs), {sleeper})
+        self.assertEqual(set(manager.by_state[JobState.DONE]), {quick, queued})
+        self.assertEqual(list(manager.finished), [quick, queued])
+        manager[sleeper].kill()
+        self.assertEqual(manager.running_jobs_count, 0)
+        self.assertEqual(set(manager.by_state[JobState.KILLED]), {sleeper})
+        manager.shutdown()
+
+    def test_60_retention(self, n=5):
+        manager = Manager(config={"max_jobs": n, "entrypoint": None, "jobs_retention_count": 2})
+        for _ in range(n):
+            manager.run_task(["true"])
+        time.sleep(1 / 2)
+        completed = list(manager.finished)
+        self.assertEqual(len(completed), n)
+        time.sleep(manager.RETENTION_INTERVAL)
+        self.assertEqual(set(manager.jobs), set(completed[-2:]))
+        self.assertEqual(set(manager.by_state[JobState.DONE]), set(completed[-2:]))
+        manager.shutdown()
+
+    def test_70_kill_process_group(self):
+        manager = Manager(config={"max_jobs": 2, "entrypoint": None})
+        job = manager[manager.run_task(["sh", "-c", "sleep 30 & echo $!; wait"])]
+        time.sleep(1 / 5)
+        grandchild = int(job.stdout)
+        job.kill()
+        self.assertEqual(job.state, JobState.KILLED)
+        self.assertIsNotNone(job.ts_completed)
+        time.sleep(1 / 5)
+        self.assertIn(get_process_state(grandchild), (None, "Z"))
+        manager.shutdown()
+
+    def test_80_kill_escalation(self):
+        manager = Manager(config={"max_jobs": 2, "entrypoint": None, "kill_grace_period": 0.3})
+        job = manager[manager.run_task(["sh", "-c", "trap '' TERM; echo ready; sleep 30"])]
+        time.sleep(1 / 5)
+        manager.kill_jobs(list(manager.running_jobs))
+        time.sleep(1 / 10)
+        self.assertIsNone(job.process.poll())
+        time.sleep(0.3)
+        self.assertEqual(job.process.poll(), -9)
+        manager.shutdown()
+
+    def test_90_bulk_kill(self, n=6):
+        manager = Manager(config={"max_jobs": n, "max_queue": n, "entrypoint": None})
+        jobs = {manager.run_task(["sleep", "30"], label=f"l{i % 2}"): i for i in range(n)}
+        queued = manager.run_task(["sleep", "30"], label="l0")
+        killed = manager.kill_jobs(label="l0")
+        self.assertEqual(sorted(killed), sorted([queued] + [job_id for job_id, i in jobs.items() if i % 2 == 0]))
+        self.assertEqual(manager[queued].state, JobState.KILLED)
+        self.assertEqual(manager.running_jobs_count, n // 2)
+        ts = time.monotonic()
+        manager.shutdown()
+        self.assertLess(time.monotonic() - ts, 1)
+        self.assertEqual(manager.running_jobs_count, 0)
+
+    def test_95_run_batch(self, n=4):
+        manager = Manager(config={"max_jobs": n, "max_queue": 2, "entrypoint": None})
+        with self.assertRaisesRegex(ValueError, "max_queue"):
+            manager.run_batch([{"command": ["sleep", "30"]}] * (n + 3))
+        self.assertEqual(len(manager.jobs), 0)
+        with self.assertRaisesRegex(ValueError, "duplicate"):
+            manager.run_batch([{"command": ["true"], "job_id": "a"}, {"command": ["true"], "job_id": "a"}])
+        tasks = [{"command": ["sleep", "30"], "label": "b"}] * n + [{"command": ["true"], "job_id": "q"}]
+        job_ids = manager.run_batch(tasks)
+        self.assertEqual(len(set(job_ids)), n + 1)
+        self.assertEqual(manager.running_jobs_count, n)
+        self.assertEqual(manager["q"].state, JobState.QUEUED)
+        manager.shutdown()
+
+    def test_96_dependencies(self):
+        manager = Manager(config={"max_jobs": 4, "max_queue": 10, "entrypoint": None})
+        source = manager.run_task(["sh", "-c", "sleep 0.3; printf 'b\\na\\nc\\n'"])
+        sort = manager.run_task(["sort"], stdin_job=source)
+        failing = manager.run_task(["sh", "-c", "exit 3"], after=[sort])
+        downstream = manager.run_task(["echo", "never"], after=[failing])
+        last = manager.run_task(["echo", "never"], after=[downstream, sort])
+        self.assertEqual(manager[sort].state, JobState.QUEUED)
+        self.assertEqual(manager.queued_jobs_count, 4)
+        with self.assertRaisesRegex(ValueError, "not found"):
+            manager.run_task(["true"], after=["no-such-job"])
+
+        time.sleep(1)
+        self.assertEqual(manager[sort].stdout, "a\nb\nc\n")  # the stdout of `source` was its stdin
+        self.assertEqual(manager[failing].exit_code, 3)
+        self.assertEqual([manager[job_id].state for job_id in (downstream, last)], [JobState.KILLED] * 2)
+        self.assertIsNone(manager[last].ts_started)
+        self.assertEqual(manager.queued_jobs_count, 0)
+        with self.assertRaisesRegex(ValueError, "has failed"):
+            manager.run_task(["true"], after=[failing])
+
+        tasks = [
+            {"command": ["sh", "-c", "echo x; echo y"]},
+            {"command": ["wc", "-l"], "stdin_job": 0},
+            {"command": ["echo", "z"], "after": [0, 1], "job_id": "z"},
+        ]
+        job_ids = manager.run_batch(tasks)
+        time.sleep(1 / 2)
+        self.assertEqual([manager[job_id].stdout.strip() for job_id in job_ids], ["x\ny", "2", "z"])
+        self.assertEqual(manager["z"].after, job_ids[:2])
+        with self.assertRaisesRegex(ValueError, "earlier job"):
+            manager.run_batch([{"command": ["true"], "after": [0]}])
+        running = manager.running_jobs_count
+        for task in ({"priority": "high"}, {"label": 1}):
+            with self.assertRaisesRegex(ValueError, "invalid"):
+                manager.run_batch([{"command": ["sleep", "1"]}, {"command": ["sleep", "1"], **task}])
+        self.assertEqual(manager.running_jobs_count, running)  # nothing of the batch started
+        manager.shutdown()
+
+    def test_96_stdin_dropped_output(self):
+        manager = Manager(config={"max_jobs": 2, "max_queue": 2, "stream_max_bytes": 4096, "entrypoint": None})
+        source = manager.run_task(["sh", "-c", "sleep 0.2; seq 100000"])
+        waiting = manager.run_task(["wc", "-l"], stdin_job=source)  # nothing dropped yet
+        time.sleep(1)
+        self.assertEqual(manager[source].exit_code, 0)
+        self.assertEqual(manager[waiting].state, JobState.KILLED)  # not started on a part of its input
+        self.assertIsNone(manager[waiting].ts_started)
+        with self.assertRaisesRegex(ValueError, "dropped output lines"):
+            manager.run_task(["wc", "-l"], stdin_job=source)
+        manager.shutdown()
+
+        with tempfile.TemporaryDirectory() as spool_dir:
+            config = {"max_jobs": 2, "stream_max_bytes": 4096, "output_spool_dir": spool_dir, "entrypoint": None}
+            manager = Manager(config=config)
+            source = manager.run_task(["seq", "100000"])
+            time.sleep(1 / 2)
+            count = manager.run_task(["wc", "-l"], stdin_job=source)
+            time.sleep(1 / 2)
+            self.assertEqual(manager[count].stdout.strip(), "100000")  # all of it, from the spool file
+            manager.shutdown()
+
+    def test_97_query_jobs(self, n=25):
+        manager = Manager(config={"max_jobs": 1, "entrypoint": None})
+        for i in range(n):
+            state = JobState.DONE if i % 5 else JobState.KILLED
+            job = Job(ExitedProcess(i, 0), state=state, spec=JobSpec(label=f"l{i % 2}"))
+            job.ts_started = 1000 + i // 2
+            manager._add_job(f"job-{i}", job)
+        done = [f"job-{i}" for i in range(n) if i % 5]
+
+        page, total, cursor = manager.query_jobs(JobSelection(["finished"], limit=7))
+        self.assertEqual((list(page), total), (done[:7], len(done)))
+        pages = list(page)
+        while cursor is not None:
+            page, _, cursor = manager.query_jobs(JobSelection(["finished"], cursor=cursor, limit=7))
+            pages.extend(page)
+        self.assertEqual(pages, done)
+
+        page, _, _ = manager.query_jobs(JobSelection(["finished", "killed"], descending=True, limit=3))
+        self.assertEqual(list(page), ["job-24", "job-23", "job-22"])
+        selection = JobSelection(("finished",), labels=("l1",), started_after=1002, started_before=1006)
+        page, total, _ = manager.query_jobs(selection)
+        self.assertEqual((list(page), total), (["job-7", "job-9", "job-11"], 3))
+
+        manager.purge()
+        self.assertEqual(manager.query_jobs(JobSelection(["finished"]))[1], 0)
+        manager.shutdown()
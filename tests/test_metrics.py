@@ -0,0 +1,70 @@
+import threading
+import time
+import unittest
+
+from jobaman import metrics
+from jobaman.api.handlers import TextResponse, handle
+from jobaman.api.query import Query
+from jobaman.api.server import render_response
+from jobaman.jobs.manager import JobState, Manager
+from tests.base import BaseTestCase
+
+
+class TestMetrics(BaseTestCase, unittest.TestCase):
+
+    def test_10_shards_are_merged(self):
+        counter = metrics.Counter("test_events_total", "test events", ("kind",))
+        histogram = metrics.Histogram("test_latency_seconds", "test latency", buckets=(0.1, 1))
+
+        def update():
+            for _ in range(100):
+                counter.inc("a")
+            counter.inc("b", value=5)
+            histogram.observe(0.05)
+            histogram.observe(0.5)
+            histogram.observe(5)
+
+        threads = [threading.Thread(target=update) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        lines = metrics.render().splitlines()
+        self.assertIn("# TYPE test_events_total counter", lines)
+        self.assertIn('test_events_total{kind="a"} 400', lines)
+        self.assertIn('test_events_total{kind="b"} 20', lines)
+        self.assertIn('test_latency_seconds_bucket{le="0.1"} 4', lines)
+        self.assertIn('test_latency_seconds_bucket{le="1"} 8', lines)
+        self.assertIn('test_latency_seconds_bucket{le="+Inf"} 12', lines)
+        self.assertIn("test_latency_seconds_count 12", lines)
+        self.assertIn("test_latency_seconds_sum 22.2", lines)
+
+    def test_20_metrics_handler(self):
+        manager = Manager(config={"max_jobs": 1, "entrypoint": None})
+        config = {"manager": manager}
+        job_id = manager.run_task(["sh", "-c", "echo hello; exit 3"])
+        with self.assertRaises(ValueError):
+            manager.run_task(["true"])
+        time.sleep(1 / 5)
+        self.assertEqual(manager[job_id].state, JobState.DONE)
+
+        code, rsp = handle(Query(method="GET", path="/metrics"), config)
+        self.assertEqual(code, 200)
+        self.assertIsInstance(rsp, TextResponse)
+        lines = rsp.body.splitlines()
+        self.assertIn('jobaman_jobs{state="finished"} 1', lines)
+        self.assertIn("jobaman_stream_buffered_bytes 6", lines)
+        self.assertIn('jobaman_job_exit_codes_total{exit_code="3"}', "\n".join(lines))
+        self.assertIn('jobaman_jobs_rejected_total{reason="max_jobs"}', "\n".join(lines))
+        self.assertTrue(any(line.startswith("jobaman_spawn_duration_seconds_count") for line in lines))
+
+        handle(Query(method="GET", path="/metrics"), config)
+        code, rsp = handle(Query(method="GET", path="/metrics"), config)
+        self.assertIn('jobaman_http_requests_total{route="/metrics",code="200"}', rsp.body)
+        self.assertIn(b"Content-Type: text/plain; version=0.0.4", render_response(code, rsp))
+        manager.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import json
+import socket
+import threading
+import unittest
+
+from jobaman.api.parser import RequestError, RequestParser
+from jobaman.api.query import Query
+from jobaman.api.server import recv_request
+from tests.base import BaseTestCase
+
+
+class TestRequestParser(BaseTestCase, unittest.TestCase):
+
+    def test_10_incremental(self):
+        body = json.dumps([{"command": ["echo", "é"]}]).encode()
+        request = b"POST /jobs/run-batch?x=1 HTTP/1.1\r\nHost: x\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body)
+        parser = RequestParser()
+        for i in range(len(request) - 1):
+            parser.feed(request[i : i + 1])
+            self.assertIsNone(parser.next_request())
+        parser.feed(request[-1:])
+        parsed = parser.next_request()
+        self.assertEqual((parsed.method, parsed.target, parsed.headers["host"]), ("POST", "/jobs/run-batch?x=1", "x"))
+        self.assertEqual(parsed.body, body)
+        query = Query.from_request(parsed)
+        self.assertEqual((query.path, query.params, query.data), ("/jobs/run-batch", {"x": ["1"]}, json.loads(body)))
+        self.assertIsNone(parser.next_request())
+
+    def test_20_pipelined(self):
+        parser = RequestParser()
+        parser.feed(b"GET /a HTTP/1.1\r\n\r\nPOST /b HTTP/1.1\r\nContent-Length: 2\r\n\r\n{}GET /c HTTP/1.1\r\n")
+        self.assertEqual(parser.next_request().target, "/a")
+        self.assertEqual(parser.next_request().body, b"{}")
+        self.assertIsNone(parser.next_request())
+        parser.feed(b"\r\n")
+        self.assertEqual(parser.next_request().target, "/c")
+
+    def test_30_limits(self):
+        cases = [
+            (b"GET / HTTP/1.1\r\nX: " + b"x" * 100 + b"\r\n\r\n", 431),
+            (b"GET / HTTP/1.1\r\nX: " + b"x" * 100, 431),
+            (b"POST / HTTP/1.1\r\nContent-Length: 65\r\n\r\n", 413),
+            (b"POST / HTTP/1.1\r\nContent-Length: x\r\n\r\n", 400),
+            (b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n", 501),
+            (b"GET /\r\n\r\n", 400),
+        ]
+        for request, code in cases:
+            parser = RequestParser(max_header_size=64, max_body_size=64)
+            parser.feed(request)
+            with self.assertRaises(RequestError) as e:
+                parser.next_request()
+            self.assertEqual(e.exception.code, code)
+
+    def test_40_recv_large_body(self):
+        body = b"[" + b" " * 500_000 + b"]"
+        request = b"POST / HTTP/1.1\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body)
+        client, server = socket.socketpair()
+        with client, server:
+            server.settimeout(5)
+            sender = threading.Thread(target=client.sendall, args=(request,))
+            sender.start()
+            self.assertEqual(recv_request(server).body, body)
+            sender.join()
+            client.close()
+            self.assertIsNone(recv_request(server))
+
+
+if __name__ == "__main__":
+    unittest.main()
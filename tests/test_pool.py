@@ -0,0 +1,97 @@
+import sys
+import time
+import unittest
+
+from jobaman.jobs.manager import JobState, Manager
+from tests.base import BaseTestCase
+
+WORKER = (
+    "import os, sys, time; from jobaman.jobs.pool import serve; "
+    "serve(lambda args: (print(os.getpid(), *args), print('err', file=sys.stderr), time.sleep(float(args[0])))[-1])"
+)
+
+
+def wait_done(jobs, timeout=5):
+    deadline = time.monotonic() + timeout
+    while any(job.state == JobState.RUNNING for job in jobs) and time.monotonic() < deadline:
+        time.sleep(1 / 100)
+
+
+class TestWorkerPool(BaseTestCase, unittest.TestCase):
+
+    def setUp(self):
+        self.manager = Manager(
+            config={
+                "max_jobs": 4,
+                "entrypoint": "/bin/echo",
+                "worker_pool_size": 2,
+                "worker_pool_command": f'{sys.executable} -c "{WORKER}"',
+                "worker_pool_max_tasks": 2,
+            }
+        )
+        time.sleep(1 / 2)
+
+    def tearDown(self):
+        self.manager.shutdown()
+
+    def test_10_tasks_run_in_workers(self):
+        jobs = [self.manager[self.manager.run_task(["0.2", "x"])] for _ in range(3)]
+        wait_done(jobs)
+        pooled, cold = jobs[:2], jobs[2]
+        self.assertEqual({job.state for job in jobs}, {JobState.DONE})
+        for job in pooled:
+            self.assertEqual(job.exit_code, 0)
+            self.assertEqual(job.stdout, f"{job.pid} 0.2 x\n")
+            self.assertEqual(job.stderr, "err\n")
+        self.assertEqual(cold.stdout, "0.2 x\n")  # all workers busy: the entrypoint is spawned as usual
+
+    def test_20_workers_are_recycled(self):
+        pids = []
+        for _ in range(4):
+            job = self.manager[self.manager.run_task(["0"])]
+            wait_done([job])
+            pids.append(job.pid)
+            time.sleep(1 / 10)
+        self.assertEqual(len(set(pids)), 2)  # max_tasks=2 per worker
+        self.assertEqual(len(self.manager.pool.workers), 2)
+
+    def test_30_kill_task(self):
+        killed = self.manager[self.manager.run_task(["30"])]
+        other = self.manager[self.manager.run_task(["0.5"])]
+        time.sleep(1 / 5)
+        killed.kill()
+        self.assertEqual(killed.state, JobState.KILLED)
+        wait_done([other])
+        self.assertEqual(other.state, JobState.DONE)
+        self.assertEqual(killed.process.returncode, -15)
+        self.assertEqual(len(self.manager.pool.workers), 2)
+
+    def test_40_kill_completing_task(self):
+        self.manager.shutdown()
+        self.manager = Manager(
+            config={
+                "max_jobs": 4,
+                "entrypoint": "/bin/echo",
+                "worker_pool_size": 1,
+                "worker_pool_command": f'{sys.executable} -c "{WORKER}"',
+            }
+        )
+        time.sleep(1 / 2)
+        job = self.manager[self.manager.run_task(["0.3"])]
+        task, submitted = job.process, []
+
+        def complete(returncode):  # the task has sent its exit, the job is not done yet
+            submitted.append(self.manager.pool.run(["0.3"]))
+            job.kill(grace=0)
+            type(task).complete(task, returncode)
+
+        task.complete = complete
+        wait_done([job])
+        self.assertEqual(submitted, [None])  # the worker is not idle until the job is done
+        other = self.manager[self.manager.run_task(["0"])]
+        wait_done([other])
+        self.assertEqual((other.state, other.exit_code), (JobState.DONE, 0))  # by the worker started in its place
+        self.assertEqual(len(self.manager.pool.workers), 1)
+
+if __name__ == "__main__":
+    unittest.main()
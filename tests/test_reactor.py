@@ -0,0 +1,63 @@
+import threading
+import time
+import unittest
+
+from jobaman.jobs.manager import JobState, Manager
+from tests.base import BaseTestCase
+
+
+def wait_done(job, timeout=5):
+    deadline = time.monotonic() + timeout
+    while job.state == JobState.RUNNING and time.monotonic() < deadline:
+        time.sleep(1 / 100)
+
+
+class TestReactor(BaseTestCase, unittest.TestCase):
+
+    def test_10_output_lines(self):
+        manager = Manager(config={"max_jobs": 2, "entrypoint": None})
+        script = "printf 'one\\r\\ntwo\\n'; printf 'err\\n' >&2; printf 'tail'"
+        job = manager[manager.run_task(["sh", "-c", script])]
+        wait_done(job)
+        time.sleep(1 / 10)
+        self.assertEqual(job.exit_code, 0)
+        self.assertEqual(list(job.streams["stdout"]), ["one\n", "two\n", "tail"])
+        self.assertEqual(job.stderr, "err\n")
+        manager.shutdown()
+
+    def test_20_large_output_is_drained(self, n=50_000):
+        manager = Manager(config={"max_jobs": 2, "entrypoint": None})
+        job = manager[manager.run_task(["seq", str(n)], output_bytes=64 * 1024)]
+        wait_done(job)
+        self.assertEqual(job.state, JobState.DONE)
+        self.assertEqual(job.streams["stdout"].next_seq, n)
+        self.assertLessEqual(job.streams["stdout"].size, 64 * 1024)
+        self.assertEqual(job.streams["stdout"][-1], f"{n}\n")
+        manager.shutdown()
+
+    def test_30_no_threads_per_job(self, n=20):
+        manager = Manager(config={"max_jobs": n, "entrypoint": None})
+        threads = threading.active_count()
+        jobs = [manager[manager.run_task(["sleep", "0.3"])] for _ in range(n)]
+        self.assertEqual(threading.active_count(), threads)
+        ts = time.monotonic()
+        for job in jobs:
+            wait_done(job)
+        self.assertLess(time.monotonic() - ts, 0.3 + 0.2)
+        self.assertTrue(all(job.exit_code == 0 for job in jobs))
+        manager.shutdown()
+
+    def test_40_call_later(self):
+        manager = Manager(config={"max_jobs": 1, "entrypoint": None})
+        reactor = manager.reactor
+        calls = []
+        reactor.call_later(0.2, calls.append, "later")
+        reactor.call_later(0.1, calls.append, "sooner")
+        reactor.cancel(reactor.call_later(0.1, calls.append, "cancelled"))
+        time.sleep(0.3)
+        self.assertEqual(calls, ["sooner", "later"])
+        manager.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
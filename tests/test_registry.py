@@ -0,0 +1,118 @@
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from jobaman.jobs.manager import JobState, Manager
+from jobaman.jobs.registry import Registry
+from tests.base import BaseTestCase
+
+
+def wait_done(job, timeout=5):
+    deadline = time.monotonic() + timeout
+    while job.state == JobState.RUNNING and time.monotonic() < deadline:
+        time.sleep(1 / 100)
+
+
+class TestRegistry(BaseTestCase, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.config = {
+            "max_jobs": 2,
+            "entrypoint": None,
+            "registry_path": os.path.join(self.tmp.name, "jobs.db"),
+            "output_spool_dir": os.path.join(self.tmp.name, "spool"),
+        }
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        return super().tearDown()
+
+    def test_10_history_survives_restart(self):
+        manager = Manager(config=self.config)
+        job_id = manager.run_task(["sh", "-c", "echo hello; exit 3"], job_id="one")
+        wait_done(manager[job_id])
+        time.sleep(1 / 10)
+        manager.shutdown()
+
+        manager = Manager(config=self.config)
+        job = manager["one"]
+        self.assertEqual(job.state, JobState.DONE)
+        self.assertEqual(job.exit_code, 3)
+        self.assertEqual(job.command, ["sh", "-c", "echo hello; exit 3"])
+        self.assertIsNotNone(job.ts_completed)
+        self.assertEqual(job.read_range("stdout", 0, 100)[0], b"hello\n")
+        history = manager.registry.history(state=JobState.DONE)
+        self.assertEqual([record["job_id"] for record in history], ["one"])
+        manager.shutdown()
+
+    def test_20_running_job_is_adopted(self):
+        manager = Manager(config=self.config)
+        job_id = manager.run_task(["sleep", "0.5"], job_id="sleeper")
+        manager.registry.flush()
+
+        restarted = Manager(config=self.config)
+        job = restarted[job_id]
+        self.assertEqual(job.state, JobState.RUNNING)
+        self.assertEqual(job.pid, manager[job_id].pid)
+        wait_done(job)
+        self.assertEqual(job.state, JobState.DONE)
+        self.assertIsNone(job.exit_code)
+        restarted.shutdown()
+        manager.shutdown()
+
+    def test_30_reused_pid_is_lost(self):
+        registry = Registry(self.config["registry_path"])
+        ts = int(time.time())
+        registry.db.execute(
+            registry.UPSERT_JOB,
+            ("stale", os.getpid(), -1, JobState.RUNNING.value, None, None, ts, None, None, 0, "", None, "[]", ts),
+        )
+        registry.close()
+
+        manager = Manager(config=self.config)
+        self.assertEqual(manager["stale"].state, JobState.LOST)
+        self.assertEqual(manager.running_jobs_count, 0)
+        manager.registry.flush()
+        self.assertEqual(manager.registry.history(state=JobState.LOST)[0]["job_id"], "stale")
+        manager.shutdown()
+
+    def test_40_queued_job_is_queued_again(self):
+        registry = Registry(self.config["registry_path"])
+        ts = int(time.time())
+        for row in (
+            ("dep", 1, None, "finished", '["true"]', 0, ts, ts, None, 0, "", None, "[]", time.time()),
+            ("next", None, None, "queued", '["echo", "again"]', None, None, None, None, 5, "l", None, '["dep"]', ts),
+        ):
+            registry.db.execute(registry.UPSERT_JOB, row)
+        registry.close()
+
+        manager = Manager(config=self.config)
+        job = manager["next"]
+        self.assertEqual((job.command, job.priority, job.label, job.after), (["echo", "again"], 5, "l", ["dep"]))
+        wait_done(job)
+        self.assertEqual((job.state, job.stdout), (JobState.DONE, "again\n"))
+        manager.shutdown()
+
+    def test_50_older_registry(self):
+        db = sqlite3.connect(self.config["registry_path"])
+        db.execute(
+            "CREATE TABLE jobs (job_id TEXT PRIMARY KEY, pid INTEGER, pid_start INTEGER, state TEXT NOT NULL, "
+            "command TEXT, exit_code INTEGER, ts_started INTEGER, ts_completed INTEGER, spool_path TEXT, "
+            "ts_updated REAL NOT NULL)"
+        )
+        db.execute("INSERT INTO jobs VALUES ('old', 1, NULL, 'finished', '[\"true\"]', 0, 1, 2, NULL, 3.0)")
+        db.commit()
+        db.close()
+
+        registry = Registry(self.config["registry_path"])
+        [record] = registry.load()
+        self.assertEqual((record["job_id"], record["label"], record["after"]), ("old", None, []))
+        registry.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+from jobaman.jobs.manager import JobState, Manager
+from jobaman.jobs.sampler import read_process_stat, read_process_usage
+from tests.base import BaseTestCase
+
+
+def wait_done(job, timeout=5):
+    deadline = time.monotonic() + timeout
+    while job.state == JobState.RUNNING and time.monotonic() < deadline:
+        time.sleep(1 / 100)
+
+
+class TestSampler(BaseTestCase, unittest.TestCase):
+
+    def test_10_read_process(self):
+        sid, cpu_time, rss = read_process_stat(os.getpid())
+        self.assertEqual(sid, os.getsid(0))
+        self.assertGreater(cpu_time, 0)
+        self.assertGreater(rss, 0)
+        self.assertIsNone(read_process_usage(2**22 + 1))
+
+    def test_20_process_tree_usage(self):
+        manager = Manager(config={"max_jobs": 2, "entrypoint": None, "usage_sample_interval": 0.1})
+        script = "\n".join(
+            [
+                "x = bytearray(64 << 20)",
+                "import time",
+                "t = time.process_time()",
+                "while time.process_time() - t < 0.5: pass",
+            ]
+        )
+        job = manager[manager.run_task(["sh", "-c", f"{sys.executable} -c '{script}'; true"])]
+        time.sleep(0.3)
+        self.assertGreater(job.rss, 64 << 20)
+        wait_done(job)
+        self.assertEqual(job.state, JobState.DONE)
+        self.assertGreater(job.peak_rss, 64 << 20)
+        self.assertGreaterEqual(job.cpu_time, 0.5)
+        manager.shutdown()
+
+    def test_30_final_totals(self):
+        manager = Manager(config={"max_jobs": 2, "entrypoint": None})
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "data")
+            job = manager[manager.run_task(["sh", "-c", f"dd if=/dev/zero of={path} bs=1M count=4 2>/dev/null"])]
+            wait_done(job)
+        self.assertIsNone(manager.sampler)
+        self.assertGreaterEqual(job.io_write_bytes, 4 << 20)
+        manager.shutdown()
+
+    def test_40_pool_tasks(self):
+        worker = (
+            "import time; from jobaman.jobs.pool import serve\n"
+            "def burn(args):\n"
+            "    t = time.process_time()\n"
+            "    while time.process_time() - t < float(args[0]): pass\n"
+            "serve(burn)"
+        )
+        manager = Manager(
+            config={
+                "max_jobs": 2,
+                "entrypoint": "/bin/echo",
+                "usage_sample_interval": 0.1,
+                "worker_pool_size": 1,
+                "worker_pool_command": f"{sys.executable} -c '{worker}'",
+            }
+        )
+        time.sleep(1 / 2)
+        jobs = []
+        for seconds in ("0.6", "0.2"):
+            jobs.append(manager[manager.run_task([seconds])])
+            wait_done(jobs[-1])
+            time.sleep(1 / 10)
+        self.assertEqual(jobs[0].pid, jobs[1].pid)  # the same worker
+        self.assertGreaterEqual(jobs[0].cpu_time, 0.4)
+        self.assertLess(jobs[1].cpu_time, 0.5)  # not the 0.6 seconds of the first task too
+        manager.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
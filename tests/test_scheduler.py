@@ -0,0 +1,71 @@
+import time
+import unittest
+
+from jobaman.jobs.manager import JobState, Manager
+from tests.base import BaseTestCase
+
+
+def wait_state(job, states=(JobState.RUNNING, JobState.QUEUED), timeout=5):
+    deadline = time.monotonic() + timeout
+    while job.state in states and time.monotonic() < deadline:
+        time.sleep(1 / 100)
+
+
+class TestScheduler(BaseTestCase, unittest.TestCase):
+
+    def run_queued(self, manager, jobs):
+        """submit (priority, label) jobs behind a blocker, return their job ids in start order"""
+        blocker = manager[manager.run_task(["sleep", "0.2"])]
+        job_ids = [manager.run_task(["true"], priority=priority, label=label) for priority, label in jobs]
+        self.assertTrue(all(manager[job_id].state == JobState.QUEUED for job_id in job_ids))
+        wait_state(blocker)
+        for job_id in job_ids:
+            wait_state(manager[job_id])
+        return sorted(job_ids, key=lambda job_id: manager[job_id].queued_at + manager[job_id].queue_wait)
+
+    def test_10_queued_until_slot_frees(self):
+        manager = Manager(config={"max_jobs": 1, "max_queue": 10, "entrypoint": None})
+        blocker = manager.run_task(["sleep", "0.2"])
+        job_id = manager.run_task(["echo", "queued"])
+        job = manager[job_id]
+        self.assertEqual(job.state, JobState.QUEUED)
+        self.assertIsNone(job.pid)
+        self.assertEqual(manager.queued_jobs_count, 1)
+        wait_state(job)
+        self.assertEqual(job.state, JobState.DONE)
+        self.assertEqual(job.stdout, "queued\n")
+        self.assertGreaterEqual(job.queue_wait, 0.15)
+        self.assertLess(manager[blocker].queue_wait, 0.1)
+        self.assertEqual(manager.queued_jobs_count, 0)
+        manager.shutdown()
+
+    def test_20_priority(self):
+        manager = Manager(config={"max_jobs": 1, "max_queue": 10, "entrypoint": None})
+        order = self.run_queued(manager, [(0, ""), (5, ""), (1, "")])
+        self.assertEqual([manager[job_id].priority for job_id in order], [5, 1, 0])
+        manager.shutdown()
+
+    def test_30_labels_take_turns(self):
+        manager = Manager(config={"max_jobs": 1, "max_queue": 10, "entrypoint": None})
+        order = self.run_queued(manager, [(0, "a"), (0, "a"), (0, "a"), (0, "b")])
+        self.assertEqual([manager[job_id].label for job_id in order], ["a", "b", "a", "a"])
+        manager.shutdown()
+
+    def test_40_queue_limit_and_cancel(self):
+        manager = Manager(config={"max_jobs": 1, "max_queue": 2, "entrypoint": None})
+        blocker = manager.run_task(["sleep", "0.2"])
+        cancelled, queued = manager.run_task(["true"]), manager.run_task(["true"])
+        with self.assertRaisesRegex(ValueError, "max_queue"):
+            manager.run_task(["true"])
+        manager[cancelled].kill()
+        self.assertEqual(manager[cancelled].state, JobState.KILLED)
+        self.assertEqual(manager.queued_jobs_count, 1)
+        wait_state(manager[blocker])
+        wait_state(manager[queued])
+        self.assertEqual(manager[queued].state, JobState.DONE)
+        self.assertIsNone(manager[cancelled].pid)
+        manager.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,272 @@
+import asyncio
+import http.client
+import json
+import os
+import socket
+import threading
+import time
+import types
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from jobaman.api.async_server import handle_request, run_async_server
+from jobaman.api.limits import Admission
+from jobaman.api.parser import RequestParser
+from jobaman.api.query import Query
+from jobaman.api.server import run_server
+from jobaman.api.streaming import SSE_HEADER, JobOutputStream
+from jobaman.config import Configuration
+from jobaman.jobs.job import JobState
+from jobaman.jobs.manager import Manager
+from tests.base import BaseTestCase
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class TestAsyncServer(BaseTestCase, unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.port = free_port()
+        cls.config = Configuration()
+        cls.config.configure(
+            params={"server-listen-port": cls.port, "server-keepalive-timeout": 5},
+            env_use=False,
+        )
+        cls.config["manager"] = Manager(config={"max_jobs": 4, "entrypoint": None})
+        threading.Thread(target=run_async_server, args=(cls.config,), daemon=True).start()
+        for _ in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", cls.port)).close()
+                break
+            except OSError:
+                time.sleep(1 / 100)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.config["manager"].shutdown()
+
+    def test_10_keep_alive(self):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=5)
+        sock = None
+        for _ in range(3):
+            conn.request("GET", "/ping")
+            rsp = conn.getresponse()
+            self.assertEqual(rsp.status, 200)
+            self.assertEqual(json.loads(rsp.read())["message"], "pong")
+            self.assertFalse(rsp.will_close)
+            sock = sock or conn.sock
+            self.assertIs(conn.sock, sock)
+        conn.close()
+
+    def test_20_connection_close(self):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=5)
+        conn.request("GET", "/jobs/", headers={"Connection": "close"})
+        rsp = conn.getresponse()
+        self.assertEqual(rsp.status, 200)
+        self.assertEqual(json.loads(rsp.read())["count"], 0)
+        self.assertTrue(rsp.will_close)
+        conn.close()
+
+    def test_30_stream(self):
+        manager = self.config["manager"]
+        job_id = manager.run_task(["sh", "-c", "echo one; sleep 0.3; echo two >&2; exit 3"])
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=5)
+        conn.request("GET", f"/jobs/stream?__job_id={job_id}")
+        rsp = conn.getresponse()
+        self.assertEqual(rsp.status, 200)
+        self.assertEqual(rsp.getheader("content-type"), "text/event-stream")
+        events = [event.split("\n") for event in rsp.read().decode().strip().split("\n\n")]
+        conn.close()
+        self.assertEqual(events[0], ["event: stdout", "id: 0", "data: one"])
+        self.assertEqual(events[1], ["event: stderr", "id: 0", "data: two"])
+        self.assertEqual(events[-1][0], "event: exit")
+        self.assertEqual(json.loads(events[-1][1].removeprefix("data: "))["exit_code"], 3)
+
+    def test_32_stream_queued(self):
+        class Writer(bytearray):
+            async def drain(self):
+                pass
+
+        manager = Manager(config={"max_jobs": 1, "max_queue": 1, "entrypoint": None})
+        manager.run_task(["sleep", "0.3"])
+        job_id = manager.run_task(["echo", "queued"])
+        self.assertEqual(manager[job_id].state, JobState.QUEUED)
+        writer = Writer()
+        writer.write = writer.extend
+        asyncio.run(asyncio.wait_for(JobOutputStream(job_id, manager[job_id]).serve(writer), timeout=5))
+        events = [event.split("\n") for event in writer.removeprefix(SSE_HEADER).decode().strip().split("\n\n")]
+        self.assertEqual(events[0], ["event: stdout", "id: 0", "data: queued"])  # followed once it started
+        self.assertEqual(json.loads(events[-1][1].removeprefix("data: "))["state"], JobState.DONE)
+        manager.shutdown()
+
+    def test_35_run_batch(self):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=5)
+        body = json.dumps({"jobs": [{"command": ["true"]}, {"command": "true", "job_id": "batch-1"}]})
+        conn.request("POST", "/jobs/run-batch", body=body, headers={"Content-Type": "application/json"})
+        rsp = conn.getresponse()
+        self.assertEqual(rsp.status, 200)
+        data = json.loads(rsp.read())
+        self.assertEqual(len(data["job_ids"]), 2)
+        self.assertEqual(data["job_ids"][1], "batch-1")
+        self.assertEqual(data["errors"], {})
+        conn.request("POST", "/jobs/run-batch", body=json.dumps([{"command": [1]}]))
+        rsp = conn.getresponse()
+        self.assertEqual(rsp.status, 400)
+        rsp.read()
+        conn.close()
+
+    def test_37_listing_etag(self):
+        manager = self.config["manager"]
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=5)
+        conn.request("GET", "/jobs/")
+        rsp = conn.getresponse()
+        rsp.read()
+        etag = rsp.getheader("etag")
+        self.assertEqual(rsp.status, 200)
+        conn.request("GET", "/jobs/", headers={"If-None-Match": etag})
+        rsp = conn.getresponse()
+        self.assertEqual((rsp.status, rsp.read()), (304, b""))
+        job_id = manager.run_task(["sleep", "0.2"], label="etag")
+        conn.request("GET", "/jobs/", headers={"If-None-Match": etag})
+        rsp = conn.getresponse()
+        self.assertEqual(rsp.status, 200)
+        self.assertIn(job_id, json.loads(rsp.read())["jobs"])
+        self.assertNotEqual(rsp.getheader("etag"), etag)
+        conn.request("GET", "/jobs/?__state=running&__label=etag&__limit=1&__sort=-started")
+        rsp = conn.getresponse()
+        data = json.loads(rsp.read())
+        self.assertEqual((data["count"], data["total"]), (1, 1))
+        conn.request("GET", "/jobs/?__state=unknown")
+        rsp = conn.getresponse()
+        rsp.read()
+        self.assertEqual(rsp.status, 400)
+        conn.close()
+
+    def test_38_wait(self):
+        manager = self.config["manager"]
+        quick = manager.run_task(["sh", "-c", "sleep 0.3; exit 4"])
+        slow = manager.run_task(["sleep", "5"])
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=5)
+        ts = time.monotonic()
+        conn.request("GET", f"/jobs/wait?__job_id={quick}&__job_id={slow}&mode=any&timeout=3")
+        rsp = conn.getresponse()
+        data = json.loads(rsp.read())
+        self.assertLess(time.monotonic() - ts, 1)
+        self.assertTrue(data["done"])
+        self.assertEqual(data["jobs"][quick]["exit_code"], 4)
+        self.assertEqual(data["jobs"][slow]["state"], "running")
+        conn.close()
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=5)
+        conn.request("GET", f"/jobs/wait?__job_id={quick}&__job_id={slow}&timeout=0.2")
+        data = json.loads(conn.getresponse().read())
+        self.assertFalse(data["done"])
+        manager[slow].kill()
+        conn.request("GET", f"/jobs/wait?__job_id={slow}")
+        data = json.loads(conn.getresponse().read())
+        self.assertEqual((data["done"], data["jobs"][slow]["state"]), (True, "killed"))
+        conn.close()
+
+    def test_40_keep_alive(self):
+        def keep_alive(request):
+            parser = RequestParser()
+            parser.feed(request)
+            return parser.next_request().keep_alive
+
+        self.assertTrue(keep_alive(b"GET / HTTP/1.1\r\nHost: x\r\n\r\n"))
+        self.assertFalse(keep_alive(b"GET / HTTP/1.1\r\nConnection: close\r\n\r\n"))
+        self.assertFalse(keep_alive(b"GET / HTTP/1.0\r\n\r\n"))
+        self.assertTrue(keep_alive(b"GET / HTTP/1.0\r\nConnection: Keep-Alive\r\n\r\n"))
+
+    def test_45_routes_and_limits(self):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=5)
+        conn.request("GET", "/jobs/unknown")
+        rsp = conn.getresponse()
+        rsp.read()
+        self.assertEqual(rsp.status, 404)
+        conn.request("GET", "/jobs/")
+        rsp = conn.getresponse()
+        rsp.read()
+        self.assertEqual(rsp.status, 200)
+        conn.close()
+        with socket.create_connection(("127.0.0.1", self.port), timeout=5) as sock:
+            sock.sendall(b"POST /jobs/run-batch HTTP/1.1\r\nContent-Length: 2000000\r\n\r\n[")
+            self.assertTrue(sock.recv(1024).startswith(b"HTTP/1.1 413"))
+        with socket.create_connection(("127.0.0.1", self.port), timeout=5) as sock:
+            sock.sendall(b"GET /ping HTTP/1.1\r\n" + b"X-Padding: x\r\n" * 2000 + b"\r\n")
+            self.assertTrue(sock.recv(1024).startswith(b"HTTP/1.1 431"))
+        with socket.create_connection(("127.0.0.1", self.port), timeout=5) as sock:
+            for part in (b"GET /pi", b"ng HTTP/1.1\r\nConnection: clo", b"se\r\n", b"\r\n"):
+                sock.sendall(part)
+                time.sleep(0.05)
+            self.assertIn(b'"pong"', sock.recv(1024))
+
+    def test_50_admission(self):
+        self.config["admission"] = Admission(
+            {
+                "rate_limit_read_rate": 1,
+                "rate_limit_read_burst": 2,
+                "rate_limit_key_header": "X-Api-Key",
+                "rate_limit_keys": "other",
+            }
+        )
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=5)
+
+        def get(path, **headers):
+            conn.request("GET", path, headers=headers)
+            rsp = conn.getresponse()
+            return rsp.status, rsp.getheader("Retry-After"), json.loads(rsp.read())
+
+        try:
+            self.assertEqual([get("/jobs/")[0] for _ in range(3)], [200, 200, 429])
+            self.assertEqual(get("/jobs/")[1], "1")
+            self.assertEqual(get("/jobs/", **{"X-Api-Key": "other"})[0], 200)  # a budget per key
+            self.assertEqual(get("/ping")[0], 200)
+
+            job_ids = [get("/jobs/run?_0=sleep&_1=10")[2].get("job_id") for _ in range(4)]  # not limited
+            status, retry_after, rsp = get("/jobs/run?_0=sleep&_1=10")  # no free slot
+            self.assertEqual((status, rsp["error"]), (503, "max_jobs limit reached"))
+            self.assertGreaterEqual(int(retry_after), 1)
+            self.config["manager"].kill_jobs(job_ids=job_ids)
+        finally:
+            self.config["admission"] = None
+            conn.close()
+
+    def test_55_admission_on_loop(self):
+        config = {"admission": Admission({"rate_limit_read_rate": 1})}
+        query = Query(addr=("10.0.0.1", 1000), method="GET", path="/jobs/")
+        self.assertIsNone(config["admission"].admit(query))  # its one token
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            executor.submit(time.sleep, 1)  # a busy server worker
+            ts = time.monotonic()
+            rsp_code, rsp_data = asyncio.run(handle_request(query, config, executor))
+            self.assertEqual((rsp_code, rsp_data.headers["Retry-After"]), (429, "1"))
+            self.assertLess(time.monotonic() - ts, 0.5)  # not queued behind the busy worker
+        self.assertEqual(config["admission"].in_flight, 0)
+
+
+class TestServer(BaseTestCase, unittest.TestCase):
+
+    def test_10_runs_again(self):
+        config = Configuration()
+        config.configure(params={"server-listen-port": free_port()}, env_use=False)
+        stop_fd, stop_w = os.pipe()
+        os.write(stop_w, b"x")  # a restart under way: the server returns at once
+        config["handoff"] = types.SimpleNamespace(stop_fd=stop_fd)
+        try:
+            for _ in range(3):  # the restart fails, `main` runs the server again
+                run_server(config)
+            streamers = [thread for thread in threading.enumerate() if thread.name == "jobaman-streamer"]
+            self.assertEqual(streamers, [config["streamer"].thread])
+        finally:
+            config["server_socket"].close()
+            os.close(stop_fd)
+            os.close(stop_w)
+
+
+if __name__ == "__main__":
+    unittest.main()
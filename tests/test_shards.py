@@ -0,0 +1,165 @@
+import http.client
+import json
+import socket
+import threading
+import time
+import unittest
+
+from jobaman.api.async_server import run_async_server
+from jobaman.api.shard_handlers import SHARD_ROUTES
+from jobaman.api.shards import ConnectionPool, ShardRouter
+from jobaman.config import Configuration
+from jobaman.jobs.manager import Manager
+from tests.base import BaseTestCase
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(params, **services):
+    port = free_port()
+    config = Configuration()
+    config.configure(params={"server-listen-port": port, "server-json-indent": 0, **params}, env_use=False)
+    for key, value in services.items():
+        config[key] = value
+    threading.Thread(target=run_async_server, args=(config,), daemon=True).start()
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            break
+        except OSError:
+            time.sleep(1 / 100)
+    return port, config
+
+
+class TestShards(BaseTestCase, unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.managers = [Manager(config={"max_jobs": 3, "entrypoint": None}) for _ in range(2)]
+        cls.backends = [start_server({}, manager=manager)[0] for manager in cls.managers]
+        backends = [f"http://127.0.0.1:{port}" for port in cls.backends] + [f"http://127.0.0.1:{free_port()}"]
+        cls.router = ShardRouter({"router_backends": ",".join(backends), "router_health_interval": 0.2})
+        cls.port, _ = start_server({}, router=cls.router, routes=SHARD_ROUTES)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.router.shutdown()
+        for manager in cls.managers:
+            manager.shutdown()
+
+    def get(self, path):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=10)
+        conn.request("GET", path)
+        rsp = conn.getresponse()
+        data = json.loads(rsp.read())
+        conn.close()
+        return rsp.status, data
+
+    def test_10_health_and_owners(self):
+        _, rsp = self.get("/ping")
+        self.assertEqual([backend["healthy"] for backend in rsp["backends"].values()], [True, True, False])
+        self.assertEqual(self.router.owners("s1-" + "0" * 32), [self.router.shards[1]])
+        owners = self.router.owners("my-job")
+        self.assertEqual(sorted(shard.index for shard in owners), [0, 1, 2])
+        self.assertEqual(owners, self.router.owners("my-job"))
+
+    def test_20_run_list_output(self):
+        job_ids = []
+        for i in range(4):
+            status, rsp = self.get(f"/jobs/run?_0=sh&_1=-c&_2=echo+{i}%3B+sleep+0.2&__label=list")
+            self.assertEqual(status, 200)
+            job_ids.append(rsp["job_id"])
+        self.assertEqual(sorted(len(manager.jobs) for manager in self.managers), [2, 2])  # least loaded first
+
+        _, rsp = self.get("/jobs/wait?" + "&".join(f"__job_id={job_id}" for job_id in job_ids))
+        self.assertTrue(rsp["done"])
+        self.assertEqual({job["exit_code"] for job in rsp["jobs"].values()}, {0})
+        status, rsp = self.get(f"/jobs/output?__job_id={job_ids[3]}")
+        self.assertEqual((status, rsp["stdout"]), (200, "3\n"))
+
+        pages, cursor = [], None
+        while True:
+            path = "/jobs/?__state=finished&__label=list&__limit=3" + (f"&__cursor={cursor}" if cursor else "")
+            _, rsp = self.get(path)
+            pages.append(list(rsp["jobs"]))
+            self.assertEqual(rsp["total"], 4)
+            cursor = rsp["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual([len(page) for page in pages], [3, 1])
+        self.assertEqual(sorted(sum(pages, [])), sorted(job_ids))
+
+    def test_30_kill_and_not_found(self):
+        _, rsp = self.get("/jobs/run?_0=sleep&_1=10&__job_id=kill-me")
+        self.assertIn(rsp["backend"], [f"http://127.0.0.1:{port}" for port in self.backends])
+        status, rsp = self.get("/jobs/kill?__job_id=kill-me&__job_id=no-such-job")
+        self.assertEqual((status, rsp["killed"], rsp["not_found"]), (200, ["kill-me"], ["no-such-job"]))
+        self.assertEqual(self.get("/jobs/output?__job_id=no-such-job")[0], 404)
+
+    def test_40_dependencies(self):
+        _, rsp = self.get("/jobs/run?_0=sh&_1=-c&_2=sleep+0.2%3B+echo+2%3B+echo+1")
+        source = rsp["job_id"]
+        _, rsp = self.get(f"/jobs/run?_0=sort&__stdin={source}")
+        self.assertEqual(rsp["job_id"].partition("-")[0], source.partition("-")[0])  # on the same backend
+        _, rsp = self.get(f"/jobs/wait?__job_id={rsp['job_id']}")
+        self.assertTrue(rsp["done"])
+        status, rsp = self.get(f"/jobs/output?__job_id={rsp['jobs'].popitem()[0]}")
+        self.assertEqual((status, rsp["stdout"]), (200, "1\n2\n"))
+
+    def test_50_grep(self):
+        job_ids = []
+        for i in range(4):
+            _, rsp = self.get(f"/jobs/run?_0=seq&_1={i * 10}&_2={i * 10 + 9}&__label=grep")
+            job_ids.append(rsp["job_id"])
+        self.get("/jobs/wait?" + "&".join(f"__job_id={job_id}" for job_id in job_ids))
+        status, rsp = self.get("/jobs/grep?__label=grep&pattern=5$")
+        self.assertEqual((status, rsp["matches"], rsp["complete"]), (200, 4, True))
+        self.assertEqual(sorted(job["stdout"][0]["line"] for job in rsp["jobs"].values()), ["15", "25", "35", "5"])
+        _, rsp = self.get(f"/jobs/grep?__job_id={job_ids[1]}&__job_id={job_ids[2]}&pattern=1&fixed=1&max_matches=10")
+        self.assertFalse(rsp["complete"])  # 10 lines with a 1 in one job, 1 in the other one
+        self.assertLessEqual(rsp["matches"], 10)
+        self.assertEqual(sorted([*rsp["jobs"], *rsp["pending"]]), sorted(job_ids[1:3]))
+
+    def test_60_pool_resend(self):
+        listener = socket.create_server(("127.0.0.1", 0))
+        requests = []
+        ok = b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n{}"
+
+        def backend():
+            conn, _ = listener.accept()
+            requests.append(conn.recv(65536))
+            conn.sendall(ok)
+            conn.close()  # closed while idle in the pool
+            conn, _ = listener.accept()
+            requests.append(conn.recv(65536))  # sent again on a new connection
+            conn.sendall(ok)
+            requests.append(conn.recv(65536))
+            time.sleep(0.5)  # answered too late
+            conn.close()
+            listener.settimeout(0.5)
+            try:
+                requests.append(listener.accept()[0].recv(65536))
+            except TimeoutError:
+                pass
+
+        thread = threading.Thread(target=backend)
+        thread.start()
+        pool = ConnectionPool("127.0.0.1", listener.getsockname()[1], timeout=0.2)
+        self.assertEqual(pool.request("GET", "/ping")[0], 200)
+        time.sleep(0.1)
+        self.assertEqual(pool.request("GET", "/ping")[0], 200)
+        with self.assertRaises(TimeoutError):
+            pool.request("GET", "/jobs/run?_0=true")
+        thread.join()
+        listener.close()
+        pool.close()
+        self.assertEqual(len(requests), 3)  # the timed out one is not sent again
+        self.assertTrue(requests[-1].startswith(b"GET /jobs/run"))
+
+
+if __name__ == "__main__":
+    unittest.main()
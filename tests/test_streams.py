@@ -0,0 +1,190 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from jobaman.api.handlers import handle_grep_jobs, handle_output_job, parse_output_cursor
+from jobaman.api.query import Query
+from jobaman.jobs.job import Job, JobState
+from jobaman.jobs.manager import Manager
+from jobaman.jobs.search import Search
+from jobaman.jobs.streams import StreamBuffer
+from tests.base import BaseTestCase
+
+
+class TestStreamBuffer(BaseTestCase, unittest.TestCase):
+
+    def test_10_read_cursor(self):
+        buffer = StreamBuffer(max_bytes=100)
+        buffer.extend(f"{i}\n".encode() for i in range(3))
+        self.assertEqual(buffer.read(), (["0\n", "1\n", "2\n"], 3, 0))
+        self.assertEqual(buffer.read(cursor=2), (["2\n"], 3, 0))
+        self.assertEqual(buffer.read(cursor=3), ([], 3, 0))
+        self.assertEqual(buffer.read(cursor=42), ([], 3, 0))
+
+    def test_20_read_dropped(self):
+        buffer = StreamBuffer(max_bytes=65)
+        buffer.extend(f"{i}\n".encode() for i in range(12))
+        self.assertEqual(buffer.first_seq, 6)
+        self.assertEqual(buffer.size, 14)
+        lines, cursor, dropped = buffer.read(cursor=4)
+        self.assertEqual(lines, ["6\n", "7\n", "8\n", "9\n", "10\n", "11\n"])
+        self.assertEqual((cursor, dropped), (12, 2))
+
+    def test_30_read_tail(self):
+        buffer = StreamBuffer(max_bytes=65)
+        buffer.extend(f"{i}\n".encode() for i in range(12))
+        self.assertEqual(buffer.read(tail=2), (["10\n", "11\n"], 12, 0))
+        self.assertEqual(buffer.read(cursor=11, tail=2), (["11\n"], 12, 0))
+        self.assertEqual(buffer.read(tail=0), ([], 12, 0))
+
+    def test_35_byte_budget(self):
+        buffer = StreamBuffer(max_bytes=100)
+        slack = 20  # more than a line and its offset take, the budget is full after as many lines
+        for i in range(1000):
+            buffer.append(b"x" * (i % 7) + "\u00e9\n".encode())
+            self.assertLessEqual(buffer.size + 8 * len(buffer), 100)
+            if i > slack:
+                self.assertGreater(buffer.size + 8 * len(buffer), 100 - slack)
+            self.assertLessEqual(len(buffer.data), 2 * 100)
+        self.assertEqual(buffer.next_seq, 1000)
+        self.assertEqual(buffer[-1], "x" * (999 % 7) + "\u00e9\n")
+        self.assertEqual(buffer.read(cursor=998)[0], [buffer[-2], buffer[-1]])
+        self.assertEqual(sum(len(line.encode()) for line in buffer), buffer.size)
+
+    def test_37_long_line_split(self):
+        buffer = StreamBuffer(max_bytes=24)
+        buffer.append(b"a" * 20 + b"\n")
+        self.assertEqual((list(buffer), buffer.next_seq), (["aaaa\n"], 2))
+        buffer.append(b"b\n")
+        self.assertEqual(list(buffer), ["aaaa\n", "b\n"])
+
+    def test_36_line_breaks(self):
+        job = Job(process=None, state=JobState.DONE)
+        for data in (b"a\r\nb\rc", b"\nd\r", b"\ne\r", b"f\r", b""):
+            job.append_output("stdout", data)
+        self.assertEqual(list(job.streams["stdout"]), ["a\n", "b\n", "c\n", "d\n", "e\n", "f\n"])
+
+    def test_38_spool_read_range(self):
+        with tempfile.TemporaryDirectory() as spool_dir:
+            spool_path = os.path.join(spool_dir, "job.stdout")
+            buffer = StreamBuffer(max_bytes=64, spool_path=spool_path)
+            buffer.extend(f"{i:04d}\n".encode() for i in range(100))
+            self.assertEqual(buffer.end, 500)
+            self.assertGreater(buffer.start, 400)
+            self.assertEqual(buffer.read_range(10, 15), (b"0002\n0003\n0004\n", 10))
+            self.assertEqual(buffer.read_range(495, 100), (b"0099\n", 495))
+            buffer.release()
+            self.assertFalse(os.path.exists(spool_path))
+
+        buffer = StreamBuffer(max_bytes=64)
+        buffer.extend(f"{i:04d}\n".encode() for i in range(100))
+        self.assertEqual(buffer.read_range(0, 5), (buffer[0].encode(), buffer.start))
+
+    def grep(self, buffer, search, offset=0, limit=100, size=StreamBuffer.GREP_CHUNK):
+        return search.lines(buffer.copy_chunk(offset, search.context, size), limit)
+
+    def test_39_grep(self):
+        buffer = StreamBuffer(max_bytes=4096)
+        buffer.extend(f"{i:04d}\n".encode() for i in range(100))
+        search = Search(rb"^00[1-3]5$", context=1)
+        found, offset = self.grep(buffer, search)
+        self.assertIsNone(offset)
+        self.assertEqual([line for _, _, line, _, _ in found], ["0015", "0025", "0035"])
+        self.assertEqual(found[0], (found[0][0], found[0][0] * 5, "0015", ["0014"], ["0016"]))
+        found, offset = self.grep(buffer, search, limit=1)
+        self.assertEqual((found[0][1], offset), (75, 80))
+        self.assertEqual(self.grep(buffer, search, 80, size=10), ([], 95))  # a chunk ends at a line end
+        search.close()
+
+        with tempfile.TemporaryDirectory() as spool_dir:
+            buffer = StreamBuffer(max_bytes=64, spool_path=os.path.join(spool_dir, "job.stdout"))
+            buffer.extend(f"{i:04d}\n".encode() for i in range(100))
+            search = Search(b"0015", fixed=True, context=2)
+            found, offset = self.grep(buffer, search)
+            self.assertEqual(found[0], (None, 75, "0015", ["0013", "0014"], ["0016", "0017"]))  # only in the spool
+            search = Search(b"9\n", fixed=True)
+            matches = []
+            offset = 0
+            while offset is not None:
+                found, offset = self.grep(buffer, search, offset, size=100)
+                matches += found
+            self.assertEqual(len(matches), 10)
+            self.assertEqual(matches[-1][:3], (99, 495, "0099"))  # kept in memory, with a seq
+            buffer.release()
+
+    def test_39_grep_deadline(self):
+        job = Job(process=None, state=JobState.DONE)
+        job.streams["stdout"].extend([b"a" * 40 + b"\n"] * 10)
+        search = Search(b"(a+)+b", deadline=time.monotonic() + 0.2)  # backtracks for ages
+        results = []
+        searcher = threading.Thread(target=lambda: results.append(job.grep("stdout", search)))
+        ts = time.monotonic()
+        searcher.start()
+        time.sleep(0.05)
+        with job.lock:  # neither the GIL nor the job lock is held by the search
+            self.assertLess(time.monotonic() - ts, 0.15)
+        searcher.join()
+        self.assertLess(time.monotonic() - ts, 1.5)  # the search process is killed at the deadline
+        self.assertEqual(results, [([], 0, False)])
+        search.close()
+
+    def test_40_output_handler(self):
+        job = Job(process=None, state=JobState.DONE)
+        job.streams["stdout"].extend([b"a\n", b"b\n", b"c\n"])
+        job.streams["stderr"].append(b"e\n")
+        config = {"manager": {"42": job}}
+
+        query = Query(method="GET", path="/jobs/output", params={"__job_id": ["42"]})
+        code, rsp = handle_output_job(query, config)
+        self.assertEqual(code, 200)
+        self.assertEqual((rsp["stdout"], rsp["stderr"], rsp["cursor"]), ("a\nb\nc\n", "e\n", "3:1"))
+
+        query.params.update({"cursor": ["2:1"]})
+        code, rsp = handle_output_job(query, config)
+        self.assertEqual((rsp["stdout"], rsp["stderr"], rsp["cursor"]), ("c\n", "", "3:1"))
+
+        query.params.update({"cursor": ["x"]})
+        code, rsp = handle_output_job(query, config)
+        self.assertEqual(code, 400)
+
+    def test_45_grep_handler(self):
+        manager = Manager(config={"max_jobs": 2, "max_queue": 5, "entrypoint": None})
+        job_ids = [manager.run_task(["sh", "-c", "seq 1 20; echo Error >&2"]) for _ in range(3)]
+        while any(manager[job_id].state != JobState.DONE for job_id in job_ids):
+            time.sleep(1 / 50)
+
+        query = Query(method="GET", path="/jobs/grep", params={"__job_id": job_ids[:1], "pattern": ["^1[05]$"]})
+        code, rsp = handle_grep_jobs(query, {"manager": manager})
+        self.assertEqual((code, rsp["matches"], rsp["complete"]), (200, 2, True))
+        result = rsp["jobs"][job_ids[0]]
+        self.assertEqual([match["line"] for match in result["stdout"]], ["10", "15"])
+        self.assertEqual((result["stderr"], result["next_offset"]), ([], "51:6"))
+
+        query.params = {"pattern": ["error"], "ignore_case": ["1"], "stream": ["stderr"], "context": ["1"]}
+        code, rsp = handle_grep_jobs(query, {"manager": manager})
+        self.assertEqual((rsp["matches"], sorted(rsp["jobs"])), (3, sorted(job_ids)))
+        self.assertNotIn("stdout", rsp["jobs"][job_ids[0]])
+
+        query.params = {"pattern": ["1"], "fixed": ["1"], "max_matches": ["12"]}
+        code, rsp = handle_grep_jobs(query, {"manager": manager})
+        self.assertEqual((rsp["matches"], rsp["complete"], len(rsp["pending"])), (12, False, 1))
+        offset = rsp["jobs"][job_ids[1]]["next_offset"]
+        query.params = {"__job_id": job_ids[1:2], "pattern": ["1"], "fixed": ["1"], "offset": [offset]}
+        code, rsp = handle_grep_jobs(query, {"manager": manager})
+        self.assertEqual((rsp["matches"], rsp["complete"]), (10, True))  # the rest of 11 lines with a 1
+
+        for params in ({"pattern": ["("]}, {"pattern": ["a"], "stream": ["x"]}, {"pattern": ["a"], "context": ["99"]}):
+            self.assertEqual(handle_grep_jobs(Query(path="/jobs/grep", params=params), {"manager": manager})[0], 400)
+        manager.shutdown()
+
+    def test_50_parse_output_cursor(self):
+        self.assertEqual(parse_output_cursor(None), {})
+        self.assertEqual(parse_output_cursor("5:7"), {"stdout": 5, "stderr": 7})
+        with self.assertRaises(ValueError):
+            parse_output_cursor("-1:0")
+
+
+if __name__ == "__main__":
+    unittest.main()